@@ -3,18 +3,24 @@
 #Assignment: Belsimpel warehouse case
 
 
-from elasticsearch import Elasticsearch
-import urllib3
+import os
 import pandas as pd
 
 """ STEP 1.1: DATA GATHERING AND PROCESSING """
 
-#disable annoying warnings before the start of the code:
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-#load in elasticsearch client
-es = Elasticsearch("https://localhost:9200", ca_certs=False, verify_certs=False, http_auth=('elastic',
-                                                                                            'j3nfTPHpJxz5iYTVMu8V'))
+#load in elasticsearch client, or the in-process emulator when BELSIMPEL_ES_EMULATOR=sales.csv is set
+if os.environ.get("BELSIMPEL_ES_EMULATOR"):
+  from es_emulator import local_elasticsearch
+  es = local_elasticsearch(os.environ["BELSIMPEL_ES_EMULATOR"])
+  es.cluster.put_settings(body={"persistent": {"search.max_buckets": 1000000}}) #like set in Kibana
+else:
+  from elasticsearch import Elasticsearch
+  import urllib3
+
+  #disable annoying warnings before the start of the code:
+  urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+  es = Elasticsearch("https://localhost:9200", ca_certs=False, verify_certs=False, http_auth=('elastic',
+                                                                                              'j3nfTPHpJxz5iYTVMu8V'))
 
 #step 1.1 perform a terms aggregation to display the buckets for the product orders per day (730 days total),
 search_body = {
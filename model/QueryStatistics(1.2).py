@@ -3,22 +3,21 @@
 #Assignment: Belsimpel warehouse case
 
 
-from elasticsearch import Elasticsearch
 import json
-import urllib3
+import os
 import pandas as pd
+from es_client import shared_client
 import matplotlib
-matplotlib.use('TkAgg')
+if not os.environ.get("MPLBACKEND"): # Headless runs set MPLBACKEND=Agg
+  matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 
 """ STEP 1.2: DATA DESCRIPTION """
 
-#disable annoying warnings before the start of the code:
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-#load in elasticsearch client
-es = Elasticsearch("https://localhost:9200", ca_certs=False, verify_certs=False, http_auth=('elastic',
-                                                                                            'j3nfTPHpJxz5iYTVMu8V'))
+#load in the shared elasticsearch client, or the in-process emulator when BELSIMPEL_ES_EMULATOR=sales.csv is set
+es = shared_client(os.environ.get("BELSIMPEL_ES_EMULATOR", ""))
+if os.environ.get("BELSIMPEL_ES_EMULATOR"):
+  es.cluster.put_settings(body={"persistent": {"search.max_buckets": 1000000}}) #like set in Kibana
 
 #step 1.1 perform a terms aggregation to display the buckets for the product orders per day (730 days total),
 search_body = {
@@ -81,5 +80,5 @@ plt.errorbar(x=x, y=y, yerr=yerror, color="red", fmt="o", ecolor="black", elinew
 plt.title("Average orders per day with SD error bars")
 plt.xlabel("Index number")
 plt.ylabel("AAverage orders per day")
-plt.savefig("/Users/pellemeuzelaar/PycharmProjects/Practical4/errorbar.png")
+plt.savefig("errorbar.png")
 
@@ -3,9 +3,11 @@
 #Assignment: Belsimpel warehouse case
 
 
+import os
 import pandas as pd
 import matplotlib
-matplotlib.use('TkAgg')
+if not os.environ.get("MPLBACKEND"): # Headless runs set MPLBACKEND=Agg
+  matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 
 """ STEP 1.4: PRODUCT VOLUME """
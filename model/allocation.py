@@ -0,0 +1,263 @@
+# Assignment: Belsimpel warehouse case
+# Which products stay in warehouse 1 (max. 960 pick-up boxes), with or without a Gurobi license
+
+
+import time
+import numpy as np
+
+""" STEP 2.4: THE ALLOCATION PROBLEM """
+
+# Every product that does not fit in warehouse 1 goes to warehouse 2 and loses its
+# avg_daily_profit_loss. So we keep the products with the most profit loss per box in warehouse 1:
+#   maximize sum(loss[i] * x[i])  subject to  sum(boxes[i] * x[i]) <= capacity,  x[i] in {0, 1}
+# and the total daily loss is the loss of the products that are not kept.
+
+def lp_bound(loss, boxes, capacity):
+  # Upper bound on the loss that can be kept (LP relaxation): fill up on the best loss per box ratio
+  # and take a fraction of the first item that does not fit
+  useful = (loss > 0) & (boxes <= capacity)
+  loss, boxes = loss[useful], boxes[useful]
+  order = np.argsort(-loss / boxes, kind="stable")
+  cum_boxes = np.cumsum(boxes[order])
+  full = np.searchsorted(cum_boxes, capacity, side="right") # Number of items that fit completely
+  bound = loss[order][:full].sum()
+  if full < len(order):
+    room = capacity - (cum_boxes[full - 1] if full else 0)
+    bound += room * loss[order][full] / boxes[order][full]
+  return float(bound)
+
+def make_result(backend, loss, selected, bound, optimal, start, **extra):
+  # optimal=None means: optimal when the solution reaches the bound
+  kept = float(loss[selected].sum())
+  gap = max(bound - kept, 0.0)
+  if optimal is None:
+    optimal = gap <= 1e-9 * max(1.0, abs(bound))
+  result = {"backend": backend, "selected": selected, "kept_loss": kept,
+            "total_daily_loss": float(loss.sum()) - kept, "bound": bound, "gap": gap,
+            "optimal": optimal, "seconds": time.perf_counter() - start}
+  result.update(extra)
+  return result
+
+""" BACKEND: GREEDY ON LOSS PER BOX """
+
+def solve_greedy(loss, boxes, capacity):
+  # Take products in order of loss per box and skip the ones that do not fit anymore. The LP bound
+  # tells how far from optimal this can be at most (the gap)
+  start = time.perf_counter()
+  selected = np.zeros(len(loss), dtype=bool)
+  candidates = np.flatnonzero((loss > 0) & (boxes <= capacity))
+  order = candidates[np.argsort(-loss[candidates] / boxes[candidates], kind="stable")]
+
+  # Everything up to the first product that does not fit can be taken at once
+  cum_boxes = np.cumsum(boxes[order])
+  full = np.searchsorted(cum_boxes, capacity, side="right")
+  selected[order[:full]] = True
+  room = capacity - (cum_boxes[full - 1] if full else 0)
+  for i in order[full:].tolist():
+    if boxes[i] <= room:
+      selected[i] = True
+      room -= boxes[i]
+
+  return make_result("greedy", loss, selected, lp_bound(loss, boxes, capacity), None, start)
+
+""" BACKEND: EXACT DYNAMIC PROGRAMMING OVER THE BOXES """
+
+def solve_dp(loss, boxes, capacity, max_cells=200000000):
+  # best[c] is the most loss that can be kept with c boxes. Every product updates the whole best
+  # array at once (numpy), and take[k, c] remembers if product k was used for capacity c
+  start = time.perf_counter()
+  capacity = int(min(capacity, boxes.sum()))
+  if len(loss) * (capacity + 1) > max_cells:
+    raise ValueError("dp needs %d cells, use the branch_and_bound backend"
+                     % (len(loss) * (capacity + 1)))
+
+  best = np.zeros(capacity + 1)
+  take = np.zeros((len(loss), capacity + 1), dtype=bool)
+  for k in range(len(loss)):
+    w = int(boxes[k])
+    if loss[k] <= 0 or w > capacity:
+      continue
+    candidate = best[:capacity + 1 - w] + loss[k]
+    improve = candidate > best[w:]
+    take[k, w:] = improve
+    best[w:] = np.where(improve, candidate, best[w:])
+
+  # Walk back through the products to find the ones that were taken
+  selected = np.zeros(len(loss), dtype=bool)
+  c = capacity
+  for k in range(len(loss) - 1, -1, -1):
+    if take[k, c]:
+      selected[k] = True
+      c -= int(boxes[k])
+
+  value = float(best[capacity])
+  return make_result("dp", loss, selected, value, True, start)
+
+""" BACKEND: EXACT BRANCH AND BOUND """
+
+def solve_branch_and_bound(loss, boxes, capacity, node_limit=10000000):
+  # Depth first search over the products in order of loss per box (Horowitz-Sahni): take products as
+  # long as they fit, and stop a branch as soon as its LP bound cannot beat the best solution so far.
+  # Works for any capacity; if the node limit is reached the best solution so far is returned
+  start = time.perf_counter()
+  items = np.flatnonzero((loss > 0) & (boxes <= capacity))
+  items = items[np.argsort(-loss[items] / boxes[items], kind="stable")]
+  p, w = loss[items].astype(float), boxes[items].astype(float)
+  n = len(items)
+  prefix_p = np.r_[0, np.cumsum(p)]
+  prefix_w = np.r_[0, np.cumsum(w)]
+
+  def upper_bound(j, room):
+    end = int(np.searchsorted(prefix_w, prefix_w[j] + room, side="right")) - 1
+    value = prefix_p[end] - prefix_p[j]
+    if end < n:
+      value += (room - (prefix_w[end] - prefix_w[j])) * p[end] / w[end]
+    return value
+
+  # Start from the greedy solution, so bad branches are cut off right away
+  greedy = solve_greedy(loss, boxes, capacity)
+  best_value = greedy["kept_loss"]
+  best_taken = np.flatnonzero(greedy["selected"][items]).tolist()
+
+  taken, value, room, j, nodes = [], 0.0, float(capacity), 0, 0
+  optimal = True
+  while True:
+    # Forward: take what fits until the bound says this branch cannot win
+    while j < n:
+      nodes += 1
+      if value + upper_bound(j, room) <= best_value + 1e-9:
+        break
+      if w[j] <= room:
+        taken.append(j)
+        value += p[j]
+        room -= w[j]
+      j += 1
+    else:
+      if value > best_value + 1e-9:
+        best_value, best_taken = value, list(taken)
+
+    # Backtrack: leave out the last product that was taken and continue after it
+    if not taken or nodes >= node_limit:
+      optimal = not taken
+      break
+    i = taken.pop()
+    value -= p[i]
+    room += w[i]
+    j = i + 1
+
+  selected = np.zeros(len(loss), dtype=bool)
+  selected[items[best_taken]] = True
+  bound = best_value if optimal else lp_bound(loss, boxes, capacity)
+  return make_result("branch_and_bound", loss, selected, bound, optimal, start, nodes=nodes)
+
+""" BACKEND: GUROBI """
+
+def solve_gurobi(loss, boxes, capacity, start="ratio", time_limit=None, mip_gap=None, threads=None,
+                 output=True):
+  # Needs gurobipy and a license, so it is only imported when this backend is used
+  import gurobipy as gp
+  from gurobipy import GRB
+  begin = time.perf_counter()
+
+  # Build the model with the matrix API straight from the numpy arrays: one vector of binaries, one
+  # linear objective and one capacity row, instead of a quicksum over n pandas lookups
+  m = gp.Model("Belsimpel")
+  m.Params.OutputFlag = 1 if output else 0
+  x = m.addMVar(len(loss), vtype=GRB.BINARY, name="keep_in_warehouse_1")
+  m.setObjective(loss @ x, GRB.MAXIMIZE)
+  m.addConstr(boxes.astype(float) @ x <= capacity, name="capacity")
+
+  # Warm start from the ranking on the ratio of profit loss and boxes (step 2.3), which is feasible
+  # and usually close to optimal. start can also be a boolean array with a solution of our own
+  if isinstance(start, str) and start == "ratio":
+    start = solve_greedy(loss, boxes, capacity)["selected"]
+  if start is not None:
+    x.Start = np.asarray(start, dtype=float)
+
+  if time_limit is not None:
+    m.Params.TimeLimit = time_limit
+  if mip_gap is not None:
+    m.Params.MIPGap = mip_gap
+  if threads is not None:
+    m.Params.Threads = threads
+  m.update()
+  build_seconds = time.perf_counter() - begin
+
+  solve_start = time.perf_counter()
+  m.optimize()
+  solve_seconds = time.perf_counter() - solve_start
+
+  # Read the whole solution vector at once
+  selected = x.X > 0.5
+  return make_result("gurobi", loss, selected, float(m.ObjBound), m.Status == GRB.OPTIMAL, begin,
+                     build_seconds=build_seconds, solve_seconds=solve_seconds, status=m.Status)
+
+""" PLUGGABLE SOLVER INTERFACE """
+
+ALLOCATION_BACKENDS = {
+  "greedy": solve_greedy,
+  "dp": solve_dp,
+  "branch_and_bound": solve_branch_and_bound,
+  "gurobi": solve_gurobi,
+}
+
+def register_backend(name, solver):
+  # A solver is a function (loss, boxes, capacity, **options) -> result dict (see make_result)
+  ALLOCATION_BACKENDS[name] = solver
+
+def solve_allocation(loss, boxes, capacity=960, backend="dp", **options):
+  loss = np.asarray(loss, dtype=float)
+  boxes = np.asarray(boxes, dtype=np.int64)
+  if loss.shape != boxes.shape:
+    raise ValueError("loss and boxes must have the same length")
+  if backend not in ALLOCATION_BACKENDS:
+    raise ValueError("unknown allocation backend %r, choose from %s" % (backend,
+                                                                        sorted(ALLOCATION_BACKENDS)))
+  return ALLOCATION_BACKENDS[backend](loss, boxes, capacity, **options)
+
+""" CO-LOCATION OF CORRELATED COUPLES """
+
+# Products of a couple (step 1.15) have to be stored in the same warehouse. Instead of adding a
+# constraint per couple, the products are merged into groups: a group has the summed boxes and loss of
+# its products and is kept or moved as a whole, so the problem gets smaller with every couple
+
+def couple_groups(n, first, second):
+  # Union-find over the n products: returns the group number of every product (0 .. n_groups - 1)
+  parent = list(range(n))
+
+  def find(i):
+    while parent[i] != i:
+      parent[i] = parent[parent[i]] # Path halving
+      i = parent[i]
+    return i
+
+  for i, j in zip(np.asarray(first).tolist(), np.asarray(second).tolist()):
+    root_i, root_j = find(i), find(j)
+    if root_i != root_j:
+      parent[max(root_i, root_j)] = min(root_i, root_j)
+  roots = np.array([find(i) for i in range(n)], dtype=np.int64)
+  return np.unique(roots, return_inverse=True)[1].reshape(-1)
+
+def solve_colocated_allocation(loss, boxes, capacity=960, couples=None, backend="dp", **options):
+  # couples is a pair of arrays with positions (not product_ids) of the products that go together
+  loss = np.asarray(loss, dtype=float)
+  boxes = np.asarray(boxes, dtype=np.int64)
+  if couples is None or len(couples[0]) == 0:
+    return solve_allocation(loss, boxes, capacity, backend, **options)
+
+  groups = couple_groups(len(loss), *couples)
+  n_groups = int(groups.max()) + 1
+  group_loss = np.bincount(groups, weights=loss, minlength=n_groups)
+  group_boxes = np.bincount(groups, weights=boxes, minlength=n_groups).astype(np.int64)
+  if "start" in options and not isinstance(options["start"], str):
+    options["start"] = np.bincount(groups, weights=options["start"], minlength=n_groups) > 0
+
+  # Solve over the groups and give every product the decision of its group
+  result = solve_allocation(group_loss, group_boxes, capacity, backend, **options)
+  result["selected"] = result["selected"][groups]
+  result["groups"] = n_groups
+  return result
+
+def compare_backends(loss, boxes, capacity=960, backends=("greedy", "dp", "branch_and_bound")):
+  # Solve the same problem with several backends, e.g. to check a MIP result against the exact dp
+  return {backend: solve_allocation(loss, boxes, capacity, backend) for backend in backends}
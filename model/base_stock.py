@@ -0,0 +1,79 @@
+# Assignment: Belsimpel warehouse case
+# Base stock (order-up-to) levels for a whole grid of service levels at once
+
+
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+""" STEP 1.11: SERVICE LEVELS """
+
+REPLENISH_INTERVAL = 7 # Days between two replenishments
+SERVICE_LEVELS = (0.80, 0.85, 0.90, 0.95, 0.975, 0.99, 0.995)
+CLASS_SERVICE_LEVELS = (0.90, 0.95, 0.99) # Target for the low, middle and high class
+
+def service_z(levels):
+  # The service level is the chance of no stockout during a replenish interval, so the safety
+  # factor is the inverse of the standard normal distribution (0.95 -> 1.645), not the level itself
+  return np.array([NormalDist().inv_cdf(level) for level in np.atleast_1d(levels)])
+
+""" PARAMETRIC: NORMAL DEMAND OVER THE INTERVAL """
+
+def parametric_base_stock(mean, std, levels=SERVICE_LEVELS, interval=REPLENISH_INTERVAL):
+  # Daily demand with mean m and sd s gives m * L and s * sqrt(L) over L independent days, and the
+  # base stock is m * L + z * s * sqrt(L). Returns an array of (products, levels)
+  mean = np.asarray(mean, dtype=np.float64)[:, None]
+  std = np.asarray(std, dtype=np.float64)[:, None]
+  return mean * interval + service_z(levels) * std * np.sqrt(interval)
+
+""" EMPIRICAL: QUANTILES OF THE ACTUAL INTERVAL DEMAND """
+
+def empirical_base_stock(matrix, levels=SERVICE_LEVELS, interval=REPLENISH_INTERVAL):
+  # The demand of every window of `interval` consecutive days in the sold range of a product (from
+  # its first to its last sale, the same days as the mean and sd of the parametric mode), and per
+  # product the level-quantile of those sums: the stock that would have covered that share of all
+  # intervals. A product with a shorter sold range gets the one window from its first sale.
+  # Returns an array of (products, levels)
+  levels = np.asarray(levels, dtype=np.float64)
+  sums = matrix.rolling_sum(interval)
+  n_windows = sums.shape[1]
+  if n_windows == 0:
+    # A history shorter than the interval has one (partial) window: all of its days
+    return np.repeat(matrix.total().astype(np.float64)[:, None], len(levels), axis=1)
+  first = np.minimum(matrix.first_sold, n_windows - 1)
+  last = np.clip(matrix.last_sold - interval + 1, first, n_windows - 1)
+  n = last - first + 1
+
+  # Rows with the same number of windows are handled together: their windows are gathered into one
+  # block and np.partition only puts the needed order statistics in place instead of sorting
+  result = np.empty((len(sums), len(levels)))
+  order = np.argsort(n, kind="stable")
+  counts, starts = np.unique(n[order], return_index=True)
+  for count, rows in zip(counts.tolist(), np.split(order, starts[1:])):
+    windows = sums[rows[:, None], first[rows, None] + np.arange(count)]
+    # Smallest sum with at least `level` of the windows at or below it
+    kth = np.clip(np.ceil(levels * count).astype(np.int64) - 1, 0, count - 1)
+    result[rows] = np.partition(windows, np.unique(kth), axis=1)[:, kth]
+  return result
+
+""" PER CLASS TARGETS """
+
+def class_base_stock(curve, levels, classes, class_levels=CLASS_SERVICE_LEVELS):
+  # Pick the column of the curve with the target service level of every product's class (NaN for
+  # products without a class)
+  levels = list(np.round(levels, 6))
+  columns = np.array([levels.index(round(level, 6)) for level in class_levels] + [-1])
+  classes = np.asarray(pd.Series(classes).fillna(-1), dtype=np.int64)
+  result = curve[np.arange(len(curve)), columns[classes]]
+  return np.where(classes >= 0, result, np.nan)
+
+def base_stock_curve(matrix, mode="parametric", levels=SERVICE_LEVELS, interval=REPLENISH_INTERVAL):
+  # One row per product with the base stock for every service level, in one pass over all products.
+  # The mean and sd are those of df_product_orders_per_day (over the sold range of each product)
+  if mode == "parametric":
+    curve = parametric_base_stock(matrix.mean(), matrix.std(), levels, interval)
+  elif mode == "empirical":
+    curve = empirical_base_stock(matrix, levels, interval)
+  else:
+    raise ValueError("mode must be 'parametric' or 'empirical', not %r" % mode)
+  return curve
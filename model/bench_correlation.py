@@ -0,0 +1,72 @@
+# Assignment: Belsimpel warehouse case
+# Benchmark: exact blocked correlation vs. LSH approximation for the product couples (step 1.15)
+
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+from correlation import correlated_pairs, approximate_correlated_pairs, lsh_candidate_probability
+from demand_engine import read_daily_counts
+from demand_store import load_demand_matrix
+
+""" LOAD THE DEMAND MATRIX TO BENCHMARK ON """
+
+def load_matrix(sales, cache):
+  # Use the stored demand matrix when there is one (whatever state it was built from), else sales.csv
+  meta = os.path.join(cache, "meta.json")
+  if os.path.exists(meta):
+    with open(meta) as f:
+      matrix = load_demand_matrix(cache, json.load(f)["source"])
+    if matrix is not None:
+      return matrix
+  return read_daily_counts(sales)
+
+""" EXACT VS APPROXIMATE """
+
+def benchmark(matrix, threshold=0.6, settings=((6, 32), (8, 48), (10, 64)), repeat=3):
+  def best_time(function):
+    times = []
+    for _ in range(repeat):
+      start = time.perf_counter()
+      result = function()
+      times.append(time.perf_counter() - start)
+    return min(times), result
+
+  exact_seconds, exact = best_time(lambda: correlated_pairs(matrix, threshold))
+  exact_pairs = set(zip(exact["i"].tolist(), exact["j"].tolist()))
+  n = matrix.n_products
+  rows = [{"method": "exact", "rows": "-", "bands": "-", "seconds": exact_seconds,
+           "candidates": n * (n - 1) // 2, "pairs": len(exact), "recall": 1.0, "expected_recall": 1.0}]
+
+  for lsh_rows, bands in settings:
+    stats = {}
+    seconds, approx = best_time(lambda: approximate_correlated_pairs(matrix, threshold, lsh_rows, bands,
+                                                                     stats=stats))
+    found = set(zip(approx["i"].tolist(), approx["j"].tolist()))
+    recall = len(found & exact_pairs) / len(exact_pairs) if exact_pairs else 1.0
+    rows.append({"method": "lsh", "rows": lsh_rows, "bands": bands, "seconds": seconds,
+                 "candidates": stats["candidates"], "pairs": len(approx), "recall": recall,
+                 "expected_recall": float(lsh_candidate_probability(threshold, lsh_rows, bands))})
+  return rows
+
+def print_table(rows):
+  print("%-6s %5s %6s %9s %12s %7s %7s %9s" % ("method", "rows", "bands", "seconds", "candidates",
+                                               "pairs", "recall", "expected"))
+  for row in rows:
+    print("%-6s %5s %6s %9.3f %12d %7d %7.3f %9.3f" % (row["method"], row["rows"], row["bands"],
+                                                       row["seconds"], row["candidates"], row["pairs"],
+                                                       row["recall"], row["expected_recall"]))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Compare exact and LSH product couples")
+  parser.add_argument("--sales", default="sales.csv")
+  parser.add_argument("--cache", default="demand_cache")
+  parser.add_argument("--threshold", type=float, default=0.6)
+  parser.add_argument("--repeat", type=int, default=3)
+  args = parser.parse_args()
+
+  matrix = load_matrix(args.sales, args.cache)
+  print(matrix)
+  print_table(benchmark(matrix, args.threshold, repeat=args.repeat))
@@ -0,0 +1,169 @@
+# Assignment: Belsimpel warehouse case
+# Benchmark of the whole pipeline on synthetic data (synthetic_data.py), from 1k products x 730 days
+# up to 20k products x 3650 days (or any PRODUCTSxDAYS), with a comparison table between two runs, e.g.
+#   python bench_pipeline.py --cases 1000x730 10000x1825 --output after.json --baseline before.json
+#   python bench_pipeline.py --compare before.json after.json
+
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from synthetic_data import write_case, read_case_meta
+
+# The stages in the order of the pipeline, every one measured on its own (the steps before it are
+# already in the stage cache, so only its own work is timed)
+STAGES = ("aggregation", "statistics", "classification", "base_stock", "correlation", "allocation")
+
+# Cases from the assignment size up to the largest catalog measured so far: products x days (and rows
+# of sales.csv, None for what the demand gives). Peak RSS on one core with 5 GB: small 93 MB (0.3M
+# rows), medium 451 MB (7.6M rows), large 1360 MB (30M rows), about 10-19 bytes per product x day
+# cell. Past 20k products the LSH candidates of the correlation step dominate: 50000x3650 did not
+# fit in 5 GB, so a 1M x 3650 catalog needs a much larger machine (the float32 standardized
+# matrix alone is 14.6 GB)
+PRESETS = {
+  "small": ("1000x730", None),
+  "medium": ("10000x1825", None),
+  "large": ("20000x3650", None),
+}
+
+""" ONE CASE """
+
+def parse_case(text):
+  products, days = text.lower().split("x")
+  return int(products), int(days)
+
+def run_stages(directory, capacity=960, solver=None, approximate=None):
+  # Runs in a fresh process: main.py reads its settings from the environment and its files from the
+  # working directory when it is imported
+  os.chdir(directory)
+  os.environ["BELSIMPEL_DEMAND_BACKEND"] = "native"
+  os.environ["BELSIMPEL_SALES_CSV"] = "sales.csv"
+  os.environ["BELSIMPEL_DEMAND_CACHE"] = "demand_cache"
+  shutil.rmtree("demand_cache", ignore_errors=True)
+  import main
+
+  timings = {}
+  def timed(name, function):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()): # The steps print their results
+      result = function()
+    timings[name] = time.perf_counter() - start
+    return result
+
+  matrix = timed("aggregation", main.demand_matrix)
+  n = matrix.n_products
+  timed("statistics", main.df_product_orders_per_day)
+  timed("classification", main.products_in_each_class)
+  timed("base_stock", main.compute_base_stock_level)
+  # The exact correlation is n x n, past 20k products the LSH approximation is used
+  approximate = n > 20000 if approximate is None else approximate
+  timed("correlation", lambda: main.product_couples(0.6, approximate))
+  # The dp table is n x capacity, for large catalogs branch and bound is used
+  solver = solver or ("dp" if n * (capacity + 1) <= 2e8 else "branch_and_bound")
+  timed("allocation", lambda: main.knapsack(capacity, solver))
+
+  return {"products": n, "days": matrix.n_days, "stages": timings,
+          "total": sum(timings.values()), "solver": solver, "approximate": approximate,
+          "peak_rss_mb": peak_rss_mb()}
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+  divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+def run_case(work, products, days, rows=None, seed=0, **options):
+  # Generates the files once per (products, days, rows, seed) and times the stages in a new process
+  directory = os.path.join(work, "%dx%d_%s_%d" % (products, days, rows or "auto", seed))
+  meta = read_case_meta(directory)
+  if meta is None:
+    start = time.perf_counter()
+    write_case(directory, products, days, seed, target_rows=rows)
+    meta = read_case_meta(directory)
+    print("Generated %d rows in %s in %.1fs" % (meta["rows"], directory, time.perf_counter() - start))
+  with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+    result = pool.submit(run_stages, os.path.abspath(directory), **options).result()
+  result["rows"] = meta["rows"]
+  result["case"] = "%dx%d" % (products, days)
+  return result
+
+""" RESULTS AND COMPARISON """
+
+def environment():
+  try:
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                            check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  return {"commit": commit, "python": platform.python_version(), "machine": platform.machine(),
+          "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+def print_results(results):
+  print("%-14s %11s" % ("case", "rows") + "".join(" %14s" % stage for stage in STAGES)
+        + " %10s %10s" % ("total", "rss (MB)"))
+  for case in results["cases"]:
+    print("%-14s %11d" % (case["case"], case["rows"])
+          + "".join(" %14.3f" % case["stages"][stage] for stage in STAGES)
+          + " %10.3f %10.0f" % (case["total"], case["peak_rss_mb"]))
+
+def print_comparison(before, after, tolerance=0.1):
+  # Seconds per stage of both runs and after / before. A stage that got slower by more than the
+  # tolerance is marked with ! (faster with *)
+  print("before: %s, after: %s" % (before["environment"]["commit"], after["environment"]["commit"]))
+  print("%-14s %-15s %10s %10s %8s" % ("case", "stage", "before", "after", "ratio"))
+  old_cases = {case["case"]: case for case in before["cases"]}
+  for case in after["cases"]:
+    old = old_cases.get(case["case"])
+    if old is None:
+      print("%-14s (not in the baseline)" % case["case"])
+      continue
+    for stage in STAGES + ("total",):
+      old_seconds = old["total"] if stage == "total" else old["stages"][stage]
+      new_seconds = case["total"] if stage == "total" else case["stages"][stage]
+      ratio = new_seconds / old_seconds if old_seconds else float("inf")
+      mark = "!" if ratio > 1 + tolerance else "*" if ratio < 1 - tolerance else ""
+      print("%-14s %-15s %10.3f %10.3f %7.2fx %s" % (case["case"], stage, old_seconds, new_seconds,
+                                                    ratio, mark))
+
+def load_results(path):
+  with open(path) as f:
+    return json.load(f)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time every stage of the pipeline on synthetic data")
+  parser.add_argument("--cases", nargs="+", default=["small"],
+                      help="PRODUCTSxDAYS (e.g. 1000x730) or a preset: " + ", ".join(PRESETS))
+  parser.add_argument("--rows", type=int, help="rows of sales.csv (default: what the demand gives)")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--capacity", type=int, default=960)
+  parser.add_argument("--solver", help="allocation backend (default: dp, or branch_and_bound)")
+  parser.add_argument("--work", default="bench_data", help="directory for the generated files")
+  parser.add_argument("--output", default="bench_results.json")
+  parser.add_argument("--baseline", help="results of an earlier run to compare with")
+  parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                      help="only print the comparison of two result files")
+  args = parser.parse_args()
+
+  if args.compare:
+    print_comparison(load_results(args.compare[0]), load_results(args.compare[1]))
+  else:
+    results = {"environment": environment(), "cases": []}
+    for text in args.cases:
+      case, rows = PRESETS.get(text, (text, args.rows))
+      products, days = parse_case(case)
+      results["cases"].append(run_case(args.work, products, days, rows, args.seed,
+                                       capacity=args.capacity, solver=args.solver))
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=1)
+    print_results(results)
+    if args.baseline:
+      print_comparison(load_results(args.baseline), results)
@@ -0,0 +1,88 @@
+# Assignment: Belsimpel warehouse case
+# Bootstrap of the avg daily profit: confidence intervals and how sure each product's class is
+
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from incremental import CLASS_QUANTILES
+
+""" RESAMPLED AVERAGES """
+
+# A bootstrap replicate draws n_days days with replacement from the history, the same days for every
+# product (so the quantiles over the products stay consistent). Drawing days is the same as giving
+# every day a weight (how often it was drawn), so the replicated order sums of all products are one
+# matrix product counts @ weights. Every product only averages over the drawn days in its own sold
+# range, like df_product_orders_per_day
+
+# The demand history goes to every worker once (initializer), not with every batch
+WORKER_STATE = {}
+
+def init_worker(state):
+  WORKER_STATE.update(state)
+
+def bootstrap_batch(seed, replicates, block_cells):
+  # Avg daily profit of every product in `replicates` replicates: (products, replicates) float32
+  rng = np.random.default_rng(seed)
+  counts, first, last, margin = (WORKER_STATE[key] for key in ("counts", "first", "last", "margin"))
+  n, n_days = counts.shape
+  weights = rng.multinomial(n_days, np.full(n_days, 1 / n_days), size=replicates).T # (days, reps)
+  weights = weights.astype(np.float32)
+  cumulative = np.zeros((n_days + 1, replicates), dtype=np.float32)
+  np.cumsum(weights, axis=0, out=cumulative[1:])
+
+  profit = np.empty((n, replicates), dtype=np.float32)
+  block = max(1, block_cells // n_days)
+  for start in range(0, n, block):
+    stop = min(start + block, n)
+    orders = counts[start:stop].astype(np.float32) @ weights
+    days = cumulative[last[start:stop] + 1] - cumulative[first[start:stop]]
+    # A replicate that drew none of the sold range days has no average, it counts as 0 orders
+    mean = np.divide(orders, days, out=np.zeros_like(orders), where=days > 0)
+    profit[start:stop] = mean * margin[start:stop, None]
+  return profit
+
+def bootstrap_profits(matrix, margin, replicates=200, seed=0, workers=None, batch_replicates=25,
+                      block_cells=1 << 24):
+  # Replicates are split into batches with their own seed (spawned from `seed`, so the result does
+  # not depend on the number of workers) and run in worker processes
+  state = {"counts": np.asarray(matrix.counts), "first": matrix.first_sold,
+           "last": matrix.last_sold, "margin": np.asarray(margin, dtype=np.float32)}
+  batches = [batch_replicates] * (replicates // batch_replicates)
+  if replicates % batch_replicates:
+    batches.append(replicates % batch_replicates)
+  seeds = np.random.SeedSequence(seed).spawn(len(batches))
+  with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_worker,
+                           initargs=(state,)) as pool:
+    return np.hstack(list(pool.map(bootstrap_batch, seeds, batches,
+                                   [block_cells] * len(batches))))
+
+""" CONFIDENCE INTERVALS AND CLASS PROBABILITIES """
+
+def profit_confidence(matrix, margin, replicates=200, confidence=0.95, seed=0, workers=None):
+  # One row per product: the avg daily profit, its confidence interval and the chance of ending up
+  # in each class. The class boundaries (the 50% and 80% quantiles over all products, see
+  # bin_finder) are computed again in every replicate. Memory is products x replicates float32
+  start = time.perf_counter()
+  margin = np.asarray(margin, dtype=np.float64)
+  profit = bootstrap_profits(matrix, margin, replicates, seed, workers)
+  known = ~np.isnan(margin) # Products without a margin have no profit
+  profit[~known] = np.nan
+
+  alpha = (1 - confidence) / 2
+  low, high = np.full((2, len(margin)), np.nan)
+  low[known], high[known] = np.quantile(profit[known], [alpha, 1 - alpha], axis=1)
+  boundaries = np.nanquantile(profit, CLASS_QUANTILES, axis=0) # (2, replicates)
+  labels = (profit > boundaries[0]).astype(np.int8) + (profit > boundaries[1])
+
+  df = pd.DataFrame({"product_id": matrix.product_ids,
+                     "avg_daily_profit": matrix.mean() * margin,
+                     "ci_low": low, "ci_high": high})
+  for label in range(len(CLASS_QUANTILES) + 1):
+    df["p_class_%d" % label] = (labels == label).mean(axis=1)
+  df.loc[~known, df.columns[df.columns.str.startswith("p_class")]] = np.nan
+  print("Bootstrapped %d replicates of %d products in %.1fs" % (replicates, len(df),
+                                                               time.perf_counter() - start))
+  return df
@@ -0,0 +1,142 @@
+# Assignment: Belsimpel warehouse case
+# The charts of steps 1.2 - 1.16, drawn from frames that are computed once, and rendered headless
+
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+""" CHARTS """
+
+# Every chart is a function (ax, data) -> None that only draws: data is a dict with the frames of
+# the steps (see chart_data in main.py), so nothing is computed again per chart. Series with one
+# value per product are drawn as one collection (vlines / fill_between) instead of a bar patch per
+# product, which keeps drawing fast for the whole catalog
+
+def draw_errorbar_avg_demand(ax, data):
+  df = data["orders"]
+  ax.errorbar(x=df.index, y=df["avg_orders_per_day"], yerr=df["standard_deviation"], color="red",
+              fmt="o", ecolor="black", elinewidth=0.3, capsize=1, errorevery=5, capthick=0.1)
+  ax.set_title("Average orders per day with SD error bars")
+  ax.set_xlabel("Index number")
+  ax.set_ylabel("Average orders per day")
+
+def draw_histogram_avg_profit(ax, data):
+  ax.hist(data["profit"]["avg_daily_profit"], bins=data["bin_ranges"], rwidth=0.95, color="red")
+  ax.set_title("Average profit per product")
+  ax.set_ylabel("Number of products")
+  ax.set_xlabel("Average profit per day")
+
+def draw_volume_histogram(ax, data):
+  ax.hist(data["volume"]["volume"], rwidth=0.95, color="red")
+  ax.set_title("Product volume ranges")
+  ax.set_ylabel("Number of products")
+  ax.set_xlabel("Volume")
+
+def class_chart(label, title, color):
+  def draw(ax, data):
+    df = data["classes"]
+    df = df[df["binned"] == label]
+    ax.vlines(df["product_id"], 0, df["avg_daily_profit"], color=color, linewidth=1.5)
+    ax.set_ylim(bottom=0)
+    ax.set_title(title)
+    ax.set_xlabel("Product number")
+    ax.set_ylabel("Average profits")
+  return draw
+
+def draw_profits_per_product_sorted(ax, data):
+  # All products, highest profit first, as one filled step line. The dashed lines are where the
+  # 80% and 50% class boundaries of bin_finder fall in this order
+  profit = np.sort(data["profit"]["avg_daily_profit"].dropna().to_numpy())[::-1]
+  ax.fill_between(np.arange(len(profit)), profit, step="mid", color="red", linewidth=0)
+  for boundary in data["bin_ranges"][1:-1]:
+    ax.axvline(np.searchsorted(-profit, -boundary, side="right"), color="k", linestyle="dashed",
+               linewidth=1)
+  ax.set_xlim(0, max(len(profit) - 1, 1))
+  ax.set_ylim(bottom=0)
+  ax.set_title("Average profits of all products sorted to class")
+  ax.set_xlabel("Index (not sorted to product number)")
+  ax.set_ylabel("Average profits")
+
+def draw_box_number(ax, data):
+  df = data["boxes"]
+  ax.vlines(df["product_id"], 0, df["required_boxes"], color="red")
+  ax.set_ylim(bottom=0)
+  ax.set_title("Number of boxes required per product")
+  ax.set_ylabel("Number of boxes")
+  ax.set_xlabel("Products")
+
+def draw_correlation_matrix(ax, data):
+  image = ax.matshow(data["corr"])
+  ax.figure.colorbar(image, ax=ax)
+  ax.set_title("Correlation Matrix", fontsize=16)
+
+def draw_product_couples_matrix(ax, data):
+  # The correlation matrix with a red square around every couple (one scatter for all of them)
+  corr, df = data["corr"], data["couples"]
+  image = ax.imshow(corr, aspect="auto", interpolation="nearest")
+  ax.figure.colorbar(image, ax=ax)
+  x = corr.columns.get_indexer(df["product_id_2"])
+  y = corr.index.get_indexer(df["product_id_1"])
+  ax.scatter(x, y, marker="s", s=30, facecolors="none", edgecolors="red", linewidths=1.5)
+  ax.set_title("Product couples")
+
+# name: (draw function, file name, frames it needs)
+CHARTS = {
+  "errorbar_avg_demand": (draw_errorbar_avg_demand, "errorbar.png", ("orders",)),
+  "histogram_avg_profit": (draw_histogram_avg_profit, "histogram_profit.png",
+                           ("profit", "bin_ranges")),
+  "volume_histogram": (draw_volume_histogram, "histogram_volume.png", ("volume",)),
+  "product_low_class": (class_chart(0, "Average profits of 0%-50% class", "red"), "bar1.png",
+                        ("classes",)),
+  "product_middle_class": (class_chart(1, "Average profits of 50%-80% class", "green"),
+                           "bar2.png", ("classes",)),
+  "product_high_class": (class_chart(2, "Average profits of 80%-100% class", "blue"), "bar3.png",
+                         ("classes",)),
+  "profits_per_product_sorted": (draw_profits_per_product_sorted, "profits_sorted.png",
+                                 ("profit", "bin_ranges")),
+  "box_number": (draw_box_number, "boxes.png", ("boxes",)),
+  "correlation_matrix": (draw_correlation_matrix, "correlation_matrix.png", ("corr",)),
+  "product_couples_matrix": (draw_product_couples_matrix, "couples_matrix.png",
+                             ("corr", "couples")),
+}
+
+def draw_chart(name, data, figsize=(10, 6)):
+  # A new figure with the chart on it (pyplot is imported here, after the backend is chosen)
+  import matplotlib.pyplot as plt
+  fig, ax = plt.subplots(figsize=figsize)
+  CHARTS[name][0](ax, data)
+  return fig
+
+""" HEADLESS RENDERING IN WORKER PROCESSES """
+
+# The frames go to every worker once (initializer), every task then only names a chart
+WORKER_DATA = {}
+
+def init_worker(data):
+  import matplotlib
+  matplotlib.use("Agg") # No window, no display needed
+  WORKER_DATA.update(data)
+
+def render_chart(name, directory, dpi):
+  import matplotlib.pyplot as plt
+  fig = draw_chart(name, WORKER_DATA)
+  path = os.path.join(directory, CHARTS[name][1])
+  fig.savefig(path, dpi=dpi)
+  plt.close(fig)
+  return path
+
+def render_charts(data, directory="charts", names=None, workers=None, dpi=100):
+  # Render the charts (all whose frames are in data, or the given names) as png files into
+  # directory, in parallel. Returns the paths of the files
+  start = time.perf_counter()
+  os.makedirs(directory, exist_ok=True)
+  if names is None:
+    names = [name for name, (_, _, needs) in CHARTS.items() if all(key in data for key in needs)]
+  with ProcessPoolExecutor(max_workers=workers or min(len(names), os.cpu_count()) or 1,
+                           initializer=init_worker, initargs=(data,)) as pool:
+    paths = list(pool.map(render_chart, names, [directory] * len(names), [dpi] * len(names)))
+  print("Rendered %d charts into %s in %.1fs" % (len(paths), directory,
+                                                 time.perf_counter() - start))
+  return paths
@@ -0,0 +1,148 @@
+# Assignment: Belsimpel warehouse case
+# Command line entry point: one subcommand per step, e.g.
+#   python cli.py --backend native stats --window 90
+#   python cli.py allocate --capacity 960 --solver branch_and_bound
+# Only the standard library is imported here; numpy, pandas, Elasticsearch and matplotlib are
+# loaded by the subcommand that needs them, so --help and argument errors return immediately
+
+
+import argparse
+import os
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+""" SUBCOMMANDS """
+
+def load_model(args):
+  # main.py reads its settings from the environment when it is imported, so set them first
+  if args.backend:
+    os.environ["BELSIMPEL_DEMAND_BACKEND"] = args.backend
+  if args.sales:
+    os.environ["BELSIMPEL_SALES_CSV"] = args.sales
+  if args.es_emulator:
+    os.environ["BELSIMPEL_ES_EMULATOR"] = args.es_emulator
+  if args.pushdown:
+    os.environ["BELSIMPEL_PUSHDOWN"] = "1"
+  import main
+  return main
+
+def ingest(model, args):
+  model.create_product_index(fast=not args.slow, threads=args.threads, chunk_size=args.chunk_size)
+
+def enrich(model, args):
+  model.enrich_product_index()
+
+def stats(model, args):
+  return model.df_product_orders_per_day(args.window)
+
+def classes(model, args):
+  return model.products_in_each_class(args.window)
+
+def base_stock(model, args):
+  if args.mode:
+    return model.base_stock_curves(args.mode)
+  return model.compute_base_stock_level(args.window)
+
+def couples(model, args):
+  return model.product_couples(args.threshold, args.approximate)
+
+def allocate(model, args):
+  if args.warehouses:
+    model.WAREHOUSES_FILE = args.warehouses
+    df, total = model.multi_warehouse_allocation(backend=args.solver or "decomposition",
+                                                 colocate=not args.no_colocate)
+    return df
+  products, total = model.knapsack(args.capacity, args.solver, not args.no_colocate)
+  import pandas as pd
+  return pd.DataFrame({"product_id": products})
+
+def report(model, args):
+  model.print_table_with_solutions()
+
+def charts(model, args):
+  model.render_report(args.directory, args.workers)
+
+""" ARGUMENTS """
+
+def parser():
+  p = argparse.ArgumentParser(prog="belsimpel", description="Belsimpel warehouse allocation model")
+  p.add_argument("--backend", choices=["elasticsearch", "native"],
+                 help="where the daily demand comes from (default: BELSIMPEL_DEMAND_BACKEND)")
+  p.add_argument("--sales", help="sales.csv for the native backend")
+  p.add_argument("--es-emulator", metavar="SALES_CSV",
+                 help="answer the Elasticsearch queries in-process from this sales.csv (no cluster)")
+  p.add_argument("--pushdown", action="store_true",
+                 help="compute profit, classes and base stock inside Elasticsearch (run enrich first)")
+  p.add_argument("--output", help="write the result table to this csv file")
+  p.add_argument("--timings", action="store_true", help="print startup and command time")
+  p.add_argument("--profile", metavar="DIRECTORY",
+                 help="time every step and write profile.json and trace.json (Chrome trace) here")
+  p.set_defaults(show=False) # Most steps print their own result already
+  commands = p.add_subparsers(dest="command", required=True)
+
+  c = commands.add_parser("ingest", help="load sales.csv into the products index (step 1.1)")
+  c.add_argument("--slow", action="store_true", help="the original one-by-one bulk load")
+  c.add_argument("--threads", type=int, default=4)
+  c.add_argument("--chunk-size", type=int, default=5000)
+  c.set_defaults(run=ingest)
+
+  c = commands.add_parser("enrich", help="margins and dimensions into the products index (pushdown)")
+  c.set_defaults(run=enrich)
+
+  c = commands.add_parser("stats", help="avg and sd of the orders per day (step 1.2)")
+  c.add_argument("--window", type=int, help="only the last WINDOW days")
+  c.set_defaults(run=stats)
+
+  c = commands.add_parser("classes", help="product classes on avg daily profit (step 1.6)")
+  c.add_argument("--window", type=int, help="only the last WINDOW days")
+  c.set_defaults(run=classes, show=True)
+
+  c = commands.add_parser("base-stock", help="base stock levels (step 1.11)")
+  c.add_argument("--window", type=int, help="only the last WINDOW days")
+  c.add_argument("--mode", choices=["parametric", "empirical"],
+                 help="the base stock for a grid of service levels instead of per class")
+  c.set_defaults(run=base_stock, show=True)
+
+  c = commands.add_parser("couples", help="correlated product couples (step 1.15)")
+  c.add_argument("--threshold", type=float, default=0.6)
+  c.add_argument("--approximate", action="store_true", help="LSH for very large catalogs")
+  c.set_defaults(run=couples)
+
+  c = commands.add_parser("allocate", help="products that stay in warehouse 1 (step 2.4)")
+  c.add_argument("--capacity", type=int, default=960)
+  c.add_argument("--solver", help="allocation backend, e.g. dp, branch_and_bound, greedy, gurobi")
+  c.add_argument("--no-colocate", action="store_true", help="ignore the correlated couples")
+  c.add_argument("--warehouses", help="JSON list of warehouses for the multi-warehouse allocation")
+  c.set_defaults(run=allocate)
+
+  c = commands.add_parser("report", help="table with the loss of every method (step 2.5)")
+  c.set_defaults(run=report)
+
+  c = commands.add_parser("charts", help="render all charts as png files, without a display")
+  c.add_argument("--directory", help="output directory (default: BELSIMPEL_CHART_DIR or charts)")
+  c.add_argument("--workers", type=int, help="number of render processes")
+  c.set_defaults(run=charts)
+  return p
+
+def run(argv=None):
+  args = parser().parse_args(argv)
+  startup = time.perf_counter() - STARTED
+  if args.profile:
+    from profiling import profile_to
+    profile_to(args.profile)
+  model = load_model(args)
+  loaded = time.perf_counter() - STARTED
+  result = args.run(model, args)
+  if args.output and result is not None:
+    result.to_csv(args.output, index=False)
+  elif args.show:
+    print(result)
+  if args.timings:
+    print("startup %.3fs, model loaded %.3fs, %s done %.3fs" % (startup, loaded, args.command,
+                                                               time.perf_counter() - STARTED),
+          file=sys.stderr)
+
+if __name__ == "__main__":
+  run()
@@ -0,0 +1,133 @@
+# Assignment: Belsimpel warehouse case
+# Product x product demand correlations, computed in blocks so only the matching pairs are kept
+
+
+import numpy as np
+
+""" STEP 1.14: STANDARDIZED DEMAND """
+
+PAIR_DTYPE = np.dtype([("i", np.int32), ("j", np.int32), ("r", np.float32)])
+
+def standardize(matrix, dtype=np.float32, block_rows=4096):
+  # Scale every product row to mean 0 and length 1, then the dot product of two rows is their
+  # Pearson correlation. Products with the same orders every day have no correlation and become 0.
+  # The arithmetic is float64 per block of rows, written straight into the (float32) output, so only
+  # one block is ever held in float64
+  counts = matrix.counts
+  z = np.empty(counts.shape, dtype=dtype)
+  valid = np.empty(len(counts), dtype=bool)
+  for start in range(0, len(counts), block_rows):
+    stop = min(start + block_rows, len(counts))
+    x = np.asarray(counts[start:stop], dtype=np.float64)
+    x -= x.mean(axis=1, keepdims=True)
+    norm = np.sqrt(np.einsum("ij,ij->i", x, x))
+    valid[start:stop] = norm > 0
+    np.divide(x, norm[:, None], out=z[start:stop], where=norm[:, None] > 0, casting="same_kind")
+    z[start:stop][norm == 0] = 0
+  return z, valid
+
+def full_correlations(matrix):
+  # The whole products x products matrix at once, only meant for plotting small selections
+  z, valid = standardize(matrix)
+  return z @ z.T
+
+""" STEP 1.15: PAIRS ABOVE THE THRESHOLD """
+
+def correlated_pairs(matrix, threshold=0.6, block_size=1024, absolute=True):
+  # Walk over the upper triangle of the correlation matrix in blocks of block_size x block_size and
+  # only keep the (i, j, r) of pairs with r >= threshold (or |r| >= threshold). Memory is one block,
+  # not products x products
+  z, valid = standardize(matrix)
+  n = len(z)
+  pairs = []
+
+  for i0 in range(0, n, block_size):
+    i1 = min(i0 + block_size, n)
+    for j0 in range(i0, n, block_size):
+      j1 = min(j0 + block_size, n)
+      r = z[i0:i1] @ z[j0:j1].T
+      hit = (np.abs(r) if absolute else r) >= threshold
+      if i0 == j0:
+        hit &= np.triu(np.ones_like(hit), k=1) # Only i < j, and not a product with itself
+      ii, jj = np.nonzero(hit)
+      if len(ii):
+        block = np.empty(len(ii), dtype=PAIR_DTYPE)
+        block["i"], block["j"], block["r"] = ii + i0, jj + j0, r[ii, jj]
+        pairs.append(block)
+
+  if not pairs:
+    return np.empty(0, dtype=PAIR_DTYPE)
+  return np.concatenate(pairs)
+
+def pairs_to_product_ids(matrix, pairs):
+  # Translate the row numbers of the pairs back to product_ids
+  return matrix.product_ids[pairs["i"]], matrix.product_ids[pairs["j"]], pairs["r"]
+
+""" STEP 1.15 (LARGE CATALOGS): APPROXIMATE PAIRS WITH RANDOM PROJECTION LSH """
+
+def lsh_candidate_probability(r, rows=8, bands=48):
+  # Chance that a pair with correlation r ends up as a candidate. One random hyperplane puts both
+  # products on the same side with chance 1 - angle / pi, a band needs all its rows to agree and the
+  # pair is a candidate when at least one band agrees. More bands = more recall and more candidates
+  p_same_side = 1 - np.arccos(np.clip(np.abs(r), -1, 1)) / np.pi
+  return 1 - (1 - p_same_side ** rows) ** bands
+
+def bucket_pairs(keys):
+  # All pairs (a, b) of positions that have the same key, without a Python loop over the buckets
+  order = np.argsort(keys, kind="stable")
+  sorted_keys = keys[order]
+  starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+  sizes = np.diff(np.r_[starts, len(keys)])
+
+  # Every element is paired with the elements after it in its bucket
+  position = np.arange(len(keys))
+  n_after = np.repeat(starts + sizes, sizes) - position - 1
+  left = np.repeat(position, n_after)
+  offset = np.arange(len(left)) - np.repeat(np.cumsum(n_after) - n_after, n_after)
+  return order[left], order[left + 1 + offset]
+
+def verify_pairs(z, i, j, threshold, absolute=True, chunk_cells=1 << 24):
+  # Exact correlation of the candidate pairs, in chunks so memory stays around chunk_cells floats
+  chunk = max(1, chunk_cells // max(z.shape[1], 1))
+  r = np.empty(len(i), dtype=np.float32)
+  for start in range(0, len(i), chunk):
+    stop = start + chunk
+    r[start:stop] = np.einsum("ij,ij->i", z[i[start:stop]], z[j[start:stop]])
+  keep = (np.abs(r) if absolute else r) >= threshold
+  pairs = np.empty(int(keep.sum()), dtype=PAIR_DTYPE)
+  pairs["i"], pairs["j"], pairs["r"] = i[keep], j[keep], r[keep]
+  return pairs
+
+def approximate_correlated_pairs(matrix, threshold=0.6, rows=8, bands=48, absolute=True, seed=0,
+                                 stats=None):
+  # Hash every product with rows x bands random hyperplanes (the sign of a random projection of its
+  # standardized demand). Products that share all bits of at least one band are candidate pairs, and
+  # only the candidates get an exact correlation. This is far below the n^2 pairs of the exact
+  # version, at the price of missing some pairs (see lsh_candidate_probability)
+  if rows > 62:
+    raise ValueError("rows must be at most 62 so a band fits into one integer")
+  z, valid = standardize(matrix)
+  products = np.flatnonzero(valid)
+  n = len(z)
+  rng = np.random.default_rng(seed)
+  candidates = []
+
+  for band in range(bands):
+    planes = rng.standard_normal((z.shape[1], rows)).astype(np.float32)
+    bits = (z[products] @ planes) > 0
+    code = bits.astype(np.int64) @ (np.int64(1) << np.arange(rows, dtype=np.int64))
+    if absolute:
+      # A negatively correlated product lands on the opposite side of every plane, so a code and its
+      # complement go into the same bucket
+      complement = code ^ ((1 << rows) - 1)
+      code = np.minimum(code, complement)
+    a, b = bucket_pairs(code)
+    i, j = products[np.minimum(a, b)], products[np.maximum(a, b)]
+    candidates.append(i * n + j)
+
+  if not candidates:
+    return np.empty(0, dtype=PAIR_DTYPE)
+  keys = np.unique(np.concatenate(candidates))
+  if stats is not None:
+    stats["candidates"] = len(keys) # To compare with the n * (n - 1) / 2 pairs of the exact version
+  return verify_pairs(z, keys // n, keys % n, threshold, absolute)
@@ -0,0 +1,129 @@
+# Assignment: Belsimpel warehouse case
+# Native demand aggregation: reads sales.csv directly instead of querying Elasticsearch
+
+
+import numpy as np
+import pandas as pd
+from demand_matrix import DemandMatrix, compact_dtype
+
+""" STEP 1.1 / 1.2 (NATIVE): DAILY ORDER COUNTS PER PRODUCT """
+
+class DailyCounts:
+  # The orders per (product_id, day) that were seen so far, as three arrays with one entry per cell
+  # that has orders. Memory grows with the number of those cells, not with the largest product_id or
+  # day, and nothing is copied into a bigger matrix while reading. The dense matrix is only made at
+  # the end, when the products, the day range and the largest count are known
+  def __init__(self):
+    self.parts = [] # (product, day, orders) of every batch, each without duplicate cells
+    self.merged_cells = 0
+
+  def add(self, product, day, orders=None):
+    orders = np.ones(len(product), dtype=np.int64) if orders is None else orders
+    self.parts.append(merge_cells(product, day, orders))
+    # Merge once the batches hold as many cells as the merged part, so a cell that is in many
+    # batches (one product sold every day) is not kept many times
+    if sum(len(part[0]) for part in self.parts[1:]) > max(self.merged_cells, 1 << 20):
+      self.merge()
+
+  def merge(self):
+    if len(self.parts) > 1:
+      self.parts = [merge_cells(*(np.concatenate(arrays) for arrays in zip(*self.parts)))]
+    self.merged_cells = len(self.parts[0][0]) if self.parts else 0
+    return self.parts[0] if self.parts else (np.zeros(0, dtype=np.int64),) * 3
+
+def merge_cells(product, day, orders):
+  # Sum the orders of the same (product, day), drop cells without orders
+  product = np.asarray(product, dtype=np.int64)
+  day = np.asarray(day, dtype=np.int64)
+  if len(product) == 0:
+    return product, day, np.zeros(0, dtype=np.int64)
+  first_day = day.min()
+  span = int(day.max() - first_day) + 1
+  keys, inverse = np.unique(product * span + (day - first_day), return_inverse=True)
+  total = np.bincount(inverse, weights=orders, minlength=len(keys)).astype(np.int64)
+  sold = total > 0
+  return keys[sold] // span, keys[sold] % span + first_day, total[sold]
+
+def accumulate_counts(counts, product, day, orders=None):
+  # Add a batch of (product_id, day) observations (with their number of orders, default 1 each)
+  if len(product):
+    counts.add(product, day, orders)
+  return counts
+
+def compact_counts(counts):
+  # The DemandMatrix of the products that were sold and the days between the first and last sale.
+  # product_ids are mapped to rows with np.unique and the day axis spans only the sold days
+  product, day, orders = counts.merge()
+  if len(product) == 0:
+    return DemandMatrix.from_counts(np.zeros((0, 0), dtype=np.uint8), np.zeros(0, dtype=np.int64),
+                                    np.zeros(0, dtype=np.int64))
+  product_ids, rows = np.unique(product, return_inverse=True)
+  days = np.arange(day.min(), day.max() + 1)
+  matrix = np.zeros((len(product_ids), len(days)), dtype=compact_dtype(orders.max()))
+  matrix[rows, day - days[0]] = orders
+  return DemandMatrix.from_counts(matrix, product_ids, days)
+
+def read_daily_counts(path="sales.csv", chunksize=1000000):
+  # Stream the csv in chunks so memory is bounded by the chunk size plus the cells with orders.
+  # Every row in sales.csv is one document in the "products" index, so counting rows per
+  # (product_id, day) gives the same numbers as the histogram doc_count in Elasticsearch
+  counts = DailyCounts()
+  for chunk in pd.read_csv(path, usecols=["product_id", "day"], chunksize=chunksize):
+    counts = accumulate_counts(counts, chunk["product_id"].to_numpy(dtype=np.int64),
+                               chunk["day"].to_numpy(dtype=np.int64))
+  return compact_counts(counts)
+
+# read_daily_counts()
+
+""" DATAFRAMES IN THE SHAPE OF THE ELASTICSEARCH RESULTS """
+
+def terms_order(matrix, size=None):
+  # A terms aggregation sorts its buckets on doc_count (highest first) and then on the key, and it
+  # only returns the first "size" buckets
+  order = np.lexsort((matrix.product_ids, -matrix.total()))
+  if size is not None:
+    order = order[:size]
+  return order
+
+def total_demand_frame(matrix, size=None):
+  # One [product_id, day, orders] row per histogram bucket: every day between the first and the last
+  # day the product was sold, so the zero-order days in between are included
+  order = terms_order(matrix, size)
+  rows, cols = np.nonzero(matrix.sold_range_mask()[order])
+  rows = order[rows]
+
+  # Histogram keys come back from Elasticsearch as doubles, so the day column is a float as well
+  df = pd.DataFrame({"product_id": matrix.product_ids[rows],
+                     "day": matrix.days[cols].astype(np.float64),
+                     "orders": matrix.counts[rows, cols].astype(np.int64)})
+  df.sort_values(by=["product_id"], inplace=True)
+  return df
+
+def orders_per_day_frame(matrix, size=None):
+  # extended_stats_bucket with gap_policy insert_zeros: the mean and (population) standard deviation
+  # over the histogram buckets, so zero days count but days outside the sold range do not
+  order = terms_order(matrix, size)
+  df = pd.DataFrame({"product_id": matrix.product_ids[order],
+                     "avg_orders_per_day": matrix.mean()[order],
+                     "standard_deviation": matrix.std()[order]})
+  df = df.sort_values("avg_orders_per_day", ascending=False).reset_index(drop=False)
+  return df
+
+def transposed_frame(matrix, size=None):
+  # Same result as pivoting total_demand_frame() to one row per product and one column per day, but
+  # without going through the long format: days outside a product's histogram range stay NaN
+  keep = np.sort(terms_order(matrix, size))
+  in_range = matrix.sold_range_mask()[keep]
+  values = np.where(in_range, matrix.counts[keep], np.nan)
+  covered = in_range.any(axis=0)
+  df = pd.DataFrame(values[:, covered], index=pd.Index(matrix.product_ids[keep], name="product_id"),
+                    columns=pd.Index(matrix.days[covered].astype(np.float64), name="day"))
+  return df.add_prefix("day ").reset_index()
+
+""" NATIVE VERSIONS OF THE TWO ELASTICSEARCH QUERIES """
+
+def native_total_demand_per_product(path="sales.csv", size=None, chunksize=1000000):
+  return total_demand_frame(read_daily_counts(path, chunksize), size)
+
+def native_product_orders_per_day(path="sales.csv", size=None, chunksize=1000000):
+  return orders_per_day_frame(read_daily_counts(path, chunksize), size)
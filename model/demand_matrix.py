@@ -0,0 +1,135 @@
+# Assignment: Belsimpel warehouse case
+# DemandMatrix: the orders per product per day as one dense, zero-filled array
+
+
+from functools import cached_property
+import numpy as np
+
+""" PRODUCT X DAY DEMAND MATRIX """
+
+def compact_dtype(max_count):
+  # The smallest unsigned integer type that can hold the largest daily count (1 byte per cell for
+  # the current sales data instead of 8)
+  for dtype in (np.uint8, np.uint16, np.uint32):
+    if max_count <= np.iinfo(dtype).max:
+      return dtype
+  return np.int64
+
+def safe_divide(numerator, n):
+  # numerator / n per product, 0 where n is 0 (a product with an empty sold range)
+  numerator = np.asarray(numerator, dtype=np.float64)
+  return np.divide(numerator, n, out=np.zeros_like(numerator), where=n > 0)
+
+class DemandMatrix:
+  # counts[i, j] is the number of orders of product product_ids[i] on day days[j]. Days without
+  # orders are 0, product_ids are sorted and days are consecutive
+  def __init__(self, counts, product_ids, days):
+    if counts.shape != (len(product_ids), len(days)):
+      raise ValueError("counts has shape %s, expected (%d, %d)" % (counts.shape, len(product_ids),
+                                                                   len(days)))
+    self.counts = counts
+    self.product_ids = np.asarray(product_ids, dtype=np.int64)
+    self.days = np.asarray(days, dtype=np.int64)
+
+  @classmethod
+  def from_counts(cls, counts, product_ids, days):
+    # Store the counts in the smallest integer type, as one contiguous block
+    max_count = int(counts.max()) if counts.size else 0
+    return cls(np.ascontiguousarray(counts, dtype=compact_dtype(max_count)), product_ids, days)
+
+  @property
+  def n_products(self):
+    return len(self.product_ids)
+
+  @property
+  def n_days(self):
+    return len(self.days)
+
+  def __repr__(self):
+    return "DemandMatrix(%d products x %d days, %s)" % (self.n_products, self.n_days,
+                                                         self.counts.dtype)
+
+  # Index maps
+
+  def rows(self, product_ids):
+    # Row numbers of the given product_ids (the product_ids are sorted, so this is a binary search)
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    rows = np.searchsorted(self.product_ids, product_ids)
+    found = rows < self.n_products
+    found[found] = self.product_ids[rows[found]] == product_ids[found]
+    if not found.all():
+      raise KeyError("unknown product_id(s): %s" % product_ids[~found][:10].tolist())
+    return rows
+
+  def columns(self, days):
+    days = np.asarray(days, dtype=np.int64)
+    if ((days < self.days[0]) | (days > self.days[-1])).any():
+      raise KeyError("day outside %d-%d" % (self.days[0], self.days[-1]))
+    return days - self.days[0]
+
+  def select(self, product_ids=None, first_day=None, last_day=None):
+    # A smaller DemandMatrix with only the given products and/or days
+    rows = slice(None) if product_ids is None else np.sort(self.rows(product_ids))
+    start = 0 if first_day is None else int(self.columns([first_day])[0])
+    stop = self.n_days if last_day is None else int(self.columns([last_day])[0]) + 1
+    return DemandMatrix(self.counts[rows, start:stop], self.product_ids[rows], self.days[start:stop])
+
+  def last_days(self, n_days):
+    # The most recent n_days of the history
+    return self.select(first_day=self.days[max(self.n_days - n_days, 0)])
+
+  # Sold range (the days a histogram aggregation returns per product)
+
+  # A product that was never sold has first_sold = n_days and last_sold = -1: an empty range
+
+  @cached_property
+  def first_sold(self):
+    sold = self.counts > 0
+    return np.where(sold.any(axis=1), sold.argmax(axis=1), self.n_days)
+
+  @cached_property
+  def last_sold(self):
+    sold = self.counts[:, ::-1] > 0
+    return np.where(sold.any(axis=1), self.n_days - 1 - sold.argmax(axis=1), -1)
+
+  def sold_range_mask(self):
+    day_index = np.arange(self.n_days)
+    return (day_index >= self.first_sold[:, None]) & (day_index <= self.last_sold[:, None])
+
+  def n_sold_range_days(self):
+    return np.maximum(self.last_sold - self.first_sold + 1, 0)
+
+  # Vectorized statistics per product
+
+  def total(self):
+    return self.counts.sum(axis=1, dtype=np.int64)
+
+  def sum_of_squares(self):
+    return np.einsum("ij,ij->i", self.counts, self.counts, dtype=np.float64)
+
+  def mean(self, sold_range=True):
+    # sold_range=True gives the ES numbers (extended_stats_bucket over the histogram buckets), False
+    # divides by every day of the matrix. A product without sales has mean 0
+    n = self.n_sold_range_days() if sold_range else np.full(self.n_products, self.n_days)
+    return safe_divide(self.total(), n)
+
+  def std(self, sold_range=True):
+    # Population standard deviation, like extended_stats_bucket std_deviation
+    n = self.n_sold_range_days() if sold_range else np.full(self.n_products, self.n_days)
+    mean = safe_divide(self.total(), n)
+    return np.sqrt(np.maximum(safe_divide(self.sum_of_squares(), n) - mean ** 2, 0))
+
+  def rolling_sum(self, window):
+    # Sum over every window of consecutive days: shape (products, days - window + 1)
+    cumulative = np.zeros((self.n_products, self.n_days + 1), dtype=np.int64)
+    np.cumsum(self.counts, axis=1, dtype=np.int64, out=cumulative[:, 1:])
+    return cumulative[:, window:] - cumulative[:, :-window]
+
+  def rolling_mean(self, window):
+    return self.rolling_sum(window) / window
+
+  def rolling_std(self, window):
+    squares = np.zeros((self.n_products, self.n_days + 1), dtype=np.float64)
+    np.cumsum(np.square(self.counts, dtype=np.float64), axis=1, out=squares[:, 1:])
+    mean = self.rolling_mean(window)
+    return np.sqrt(np.maximum((squares[:, window:] - squares[:, :-window]) / window - mean ** 2, 0))
@@ -0,0 +1,72 @@
+# Assignment: Belsimpel warehouse case
+# On-disk cache of the product x day demand matrix (.npy files, loaded through memory mapping)
+
+
+import json
+import os
+import numpy as np
+from demand_matrix import DemandMatrix
+from profiling import timed_search
+
+""" STATE OF THE DEMAND SOURCE """
+
+def es_source_state(es, index="products"):
+  # One cheap query: the number of documents and the last day in the index. If either changed since
+  # the matrix was stored, the cached matrix is out of date
+  result = timed_search(es, index=index, body={"size": 0, "track_total_hits": True,
+                                                "aggs": {"max_day": {"max": {"field": "day"}}}})
+  return {"backend": "elasticsearch", "index": index,
+          "doc_count": result["hits"]["total"]["value"],
+          "max_day": result["aggregations"]["max_day"]["value"]}
+
+def csv_source_state(path="sales.csv"):
+  # Counting the rows of sales.csv would cost as much as reading it, so the file size and mtime are
+  # used to detect changes. The doc count and max day are stored next to them when saving
+  stat = os.stat(path)
+  return {"backend": "native", "path": os.path.abspath(path), "size": stat.st_size,
+          "mtime_ns": stat.st_mtime_ns}
+
+""" SAVE AND LOAD THE DEMAND MATRIX """
+
+def save_demand_matrix(directory, matrix, source):
+  os.makedirs(directory, exist_ok=True)
+  counts, days = matrix.counts, matrix.days
+
+  # Remove the old metadata first and write the new one last: between the two the arrays may be a
+  # mix of old and new files, and without meta.json the loader does not trust them
+  try:
+    os.remove(os.path.join(directory, "meta.json"))
+  except FileNotFoundError:
+    pass
+  for name, array in [("counts", counts), ("product_ids", matrix.product_ids), ("days", days)]:
+    tmp = os.path.join(directory, name + ".tmp.npy")
+    np.save(tmp, np.ascontiguousarray(array))
+    os.replace(tmp, os.path.join(directory, name + ".npy"))
+
+  meta = {"source": source, "shape": list(counts.shape), "dtype": str(counts.dtype),
+          "doc_count": int(matrix.total().sum()), "max_day": int(days[-1]) if len(days) else None}
+  tmp = os.path.join(directory, "meta.tmp.json")
+  with open(tmp, "w") as f:
+    json.dump(meta, f, indent=1)
+  os.replace(tmp, os.path.join(directory, "meta.json"))
+
+def load_demand_matrix(directory, source):
+  # Returns a DemandMatrix or None when there is no cache or it belongs to another state
+  # of the source. The counts are memory mapped, so nothing is read until it is used
+  try:
+    with open(os.path.join(directory, "meta.json")) as f:
+      meta = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if meta.get("source") != source:
+    return None
+
+  try:
+    counts = np.load(os.path.join(directory, "counts.npy"), mmap_mode="r")
+    product_ids = np.load(os.path.join(directory, "product_ids.npy"))
+    days = np.load(os.path.join(directory, "days.npy"))
+  except (OSError, ValueError):
+    return None
+  if list(counts.shape) != meta["shape"] or counts.shape != (len(product_ids), len(days)):
+    return None
+  return DemandMatrix(counts, product_ids, days)
@@ -0,0 +1,119 @@
+# Assignment: Belsimpel warehouse case
+# One long-lived, pooled Elasticsearch client per process (sync) and per event loop (asyncio)
+
+
+import asyncio
+import atexit
+import os
+import threading
+import warnings
+
+""" SETTINGS """
+
+ES_URL = os.environ.get("BELSIMPEL_ES_URL", "https://localhost:9200")
+ES_USER = os.environ.get("BELSIMPEL_ES_USER", "elastic")
+ES_PASSWORD = os.environ.get("BELSIMPEL_ES_PASSWORD", "j3nfTPHpJxz5iYTVMu8V")
+# Connections kept open to the cluster, at least as many as queries that run at the same time
+ES_CONNECTIONS = int(os.environ.get("BELSIMPEL_ES_CONNECTIONS", 16))
+ES_TIMEOUT = float(os.environ.get("BELSIMPEL_ES_TIMEOUT", 60))
+
+def client_options():
+  return {"ca_certs": False, "verify_certs": False, "http_auth": (ES_USER, ES_PASSWORD),
+          "maxsize": ES_CONNECTIONS, "timeout": ES_TIMEOUT}
+
+def quiet_client_warnings():
+  # Disable annoying warnings (self signed certificate, deprecated options)
+  import urllib3
+  urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+  warnings.filterwarnings("ignore", category=DeprecationWarning)
+  warnings.filterwarnings("ignore", category=UserWarning)
+
+""" SYNC CLIENT """
+
+# Every step used to build its own client, so every step paid for new TLS connections. Now the first
+# call makes the client and every later call (from any thread) gets the same one with its open
+# connections. The emulator (es_emulator.py) takes its place for offline runs
+
+_client = None
+_client_lock = threading.Lock()
+
+def shared_client(emulator=""):
+  global _client
+  if emulator:
+    from es_emulator import local_elasticsearch
+    return local_elasticsearch(emulator)
+  with _client_lock:
+    if _client is None:
+      from elasticsearch import Elasticsearch
+      quiet_client_warnings()
+      _client = Elasticsearch(ES_URL, **client_options())
+      atexit.register(close_client)
+  return _client
+
+def close_client():
+  global _client
+  with _client_lock:
+    if _client is not None:
+      _client.close()
+      _client = None
+
+""" ASYNCIO CLIENT """
+
+# An AsyncElasticsearch client belongs to the event loop it was made in, so there is one per loop.
+# It lives as long as the loop; close it with await close_async_client() before the loop ends
+
+_async_clients = {}
+
+class AsyncAdapter:
+  # The async interface on top of a sync client (the emulator): searches run in worker threads
+  def __init__(self, client):
+    self.client = client
+
+  async def search(self, **kwargs):
+    return await asyncio.to_thread(self.client.search, **kwargs)
+
+  async def close(self):
+    pass
+
+def shared_async_client(emulator=""):
+  loop = asyncio.get_running_loop()
+  if loop not in _async_clients:
+    if emulator:
+      _async_clients[loop] = AsyncAdapter(shared_client(emulator))
+    else:
+      from elasticsearch import AsyncElasticsearch # Needs the aiohttp extra
+      quiet_client_warnings()
+      _async_clients[loop] = AsyncElasticsearch(ES_URL, **client_options())
+  return _async_clients[loop]
+
+async def close_async_client():
+  client = _async_clients.pop(asyncio.get_running_loop(), None)
+  if client is not None:
+    await client.close()
+
+# Sync callers share one event loop in a background thread, so its async client (and the open
+# connections) lives as long as the process instead of one asyncio.run per fetch
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def background_loop():
+  global _loop
+  with _loop_lock:
+    if _loop is None:
+      _loop = asyncio.new_event_loop()
+      threading.Thread(target=_loop.run_forever, name="es-async", daemon=True).start()
+      atexit.register(stop_background_loop)
+  return _loop
+
+def run_async(coroutine):
+  # Run a coroutine on the background loop and wait for its result
+  return asyncio.run_coroutine_threadsafe(coroutine, background_loop()).result()
+
+def stop_background_loop():
+  global _loop
+  with _loop_lock:
+    loop, _loop = _loop, None
+  if loop is not None:
+    asyncio.run_coroutine_threadsafe(close_async_client(), loop).result(ES_TIMEOUT)
+    loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,1002 @@
+# Assignment: Belsimpel warehouse case
+# In-process stand-in for the Elasticsearch client: es.search(index=..., body=...) with the
+# aggregations this project uses, evaluated over numpy columns (no cluster needed)
+
+
+import ast
+import fnmatch
+import json
+import math
+import os
+import threading
+import time
+import uuid
+import zlib
+import numpy as np
+import pandas as pd
+
+""" COLUMN STORE """
+
+# An index is a dict of equally long numpy arrays, one per field (one row per document). Indices are
+# loaded from csv files when they are first searched, so starting the emulator costs nothing
+
+class EmulatorError(Exception):
+  # Shaped like the error of the Elasticsearch client: status code, error type and reason
+  def __init__(self, status, error, reason):
+    super().__init__("%s(%d): %s" % (error, status, reason))
+    self.status_code = status
+    self.error = error
+    self.info = {"error": {"type": error, "reason": reason}, "status": status}
+
+class ColumnStore:
+  def __init__(self):
+    self.indices = {} # name -> {"columns": {field: array}, "uuid", "index_total", "settings"}
+    self.loaders = {} # name -> function that returns the columns, for indices not loaded yet
+    self.pending = {} # name -> documents from bulk requests, added to the columns when searched
+    # Partitions are searched from several threads: a lazy load or a flush happens once
+    self.lock = threading.RLock()
+
+  def add(self, index, columns, settings=None):
+    columns = {field: np.asarray(values) for field, values in columns.items()}
+    if len({len(values) for values in columns.values()}) > 1:
+      raise ValueError("all columns of an index need the same length")
+    n = len(next(iter(columns.values()))) if columns else 0
+    self.indices[index] = {"columns": columns, "uuid": uuid.uuid4().hex[:22], "index_total": n,
+                           "settings": settings or {}}
+    self.loaders.pop(index, None)
+
+  def add_csv(self, index, path, usecols=None):
+    # The csv is read the first time the index is used
+    def load():
+      df = pd.read_csv(path, usecols=usecols)
+      return {column: df[column].to_numpy() for column in df.columns}
+    self.loaders[index] = load
+
+  def append(self, index, documents):
+    with self.lock:
+      if index not in self.names():
+        self.add(index, {})
+      self.pending.setdefault(index, []).extend(documents)
+
+  def names(self):
+    return sorted(set(self.indices) | set(self.loaders))
+
+  def get(self, index):
+    with self.lock:
+      if index in self.loaders:
+        self.add(index, self.loaders[index]())
+      if index not in self.indices:
+        raise EmulatorError(404, "index_not_found_exception", "no such index [%s]" % index)
+      if self.pending.get(index):
+        self.flush(index)
+      return self.indices[index]
+
+  def flush(self, index):
+    # Nested objects become dotted field names ({"info": {"margin": 1}} -> "info.margin")
+    entry, added = self.indices[index], pd.json_normalize(self.pending.pop(index))
+    columns = entry["columns"]
+    n = len(next(iter(columns.values()), []))
+    for field in set(columns) | set(added.columns):
+      old = columns[field] if field in columns else np.full(n, np.nan)
+      new = added[field].to_numpy() if field in added.columns else np.full(len(added), np.nan)
+      columns[field] = np.concatenate([old, new])
+    entry["index_total"] += len(added)
+
+  def delete(self, index):
+    with self.lock:
+      self.get(index)
+      del self.indices[index]
+
+  def resolve(self, index):
+    # index can be a name, a comma separated list or a list, "_all" / None means every index
+    if index in (None, "_all", "*"):
+      return self.names()
+    if isinstance(index, str):
+      index = index.split(",")
+    return list(index)
+
+# Guards the groups that paged composite aggregations share between searches
+CACHE_LOCK = threading.Lock()
+
+""" QUERIES """
+
+# The query only selects the documents the aggregations run over: match_all, term, terms, range,
+# exists and bool (filter / must / must_not / should)
+
+def query_mask(columns, n, query):
+  if not query or "match_all" in query:
+    return np.ones(n, dtype=bool)
+  kind, params = next(iter(query.items()))
+  if kind == "bool":
+    mask = np.ones(n, dtype=bool)
+    for clause in as_list(params.get("filter")) + as_list(params.get("must")):
+      mask &= query_mask(columns, n, clause)
+    for clause in as_list(params.get("must_not")):
+      mask &= ~query_mask(columns, n, clause)
+    should = as_list(params.get("should"))
+    if should:
+      any_should = np.zeros(n, dtype=bool)
+      for clause in should:
+        any_should |= query_mask(columns, n, clause)
+      if params.get("minimum_should_match", 0 if "filter" in params or "must" in params else 1):
+        mask &= any_should
+    return mask
+  if kind == "match_none":
+    return np.zeros(n, dtype=bool)
+
+  field, condition = next(iter(params.items()))
+  if field not in columns:
+    return np.zeros(n, dtype=bool)
+  values = columns[field]
+  if kind == "term":
+    return values == (condition["value"] if isinstance(condition, dict) else condition)
+  if kind == "terms":
+    return np.isin(values, condition)
+  if kind == "exists":
+    return present(columns[condition]) if condition in columns else np.zeros(n, dtype=bool)
+  if kind == "range":
+    mask = np.ones(n, dtype=bool)
+    for operator, compare in [("gt", np.greater), ("gte", np.greater_equal), ("lt", np.less),
+                              ("lte", np.less_equal)]:
+      if operator in condition:
+        mask &= compare(values, condition[operator])
+    return mask
+  raise EmulatorError(400, "parsing_exception", "unknown query [%s] in the emulator" % kind)
+
+def as_list(value):
+  if value is None:
+    return []
+  return value if isinstance(value, list) else [value]
+
+def present(values):
+  if values.dtype.kind == "f":
+    return ~np.isnan(values)
+  if values.dtype.kind == "O":
+    return pd.notna(values)
+  return np.ones(len(values), dtype=bool)
+
+""" AGGREGATIONS """
+
+# Every aggregation gets the row numbers of the documents in its bucket and returns its part of the
+# response. Bucket aggregations split the rows and run their sub aggregations per bucket. Pipeline
+# aggregations run after the other aggregations on the same level, on their results
+
+class SearchContext:
+  def __init__(self, columns, max_buckets, cache):
+    self.columns = columns
+    self.max_buckets = max_buckets
+    self.cache = cache # Shared between searches, e.g. the groups of a paged composite aggregation
+    self.buckets = 0
+
+  def add_buckets(self, n):
+    # Like search.max_buckets on the cluster
+    self.buckets += n
+    if self.buckets > self.max_buckets:
+      raise EmulatorError(400, "too_many_buckets_exception",
+                          "Trying to create too many buckets. Must be less than or equal to: [%d] "
+                          "but was [%d]. This limit can be set by changing the [search.max_buckets] "
+                          "cluster level setting." % (self.max_buckets, self.buckets))
+
+  def values(self, field, rows):
+    # The values of field in rows, without the documents that have no value
+    if field not in self.columns:
+      return rows[:0], np.empty(0)
+    values = self.columns[field][rows]
+    keep = present(values)
+    if not keep.all():
+      return rows[keep], values[keep]
+    return rows, values
+
+def split_aggregation(name, spec):
+  subs = spec.get("aggs", spec.get("aggregations", {}))
+  kinds = [key for key in spec if key not in ("aggs", "aggregations", "meta")]
+  if len(kinds) != 1:
+    raise EmulatorError(400, "parsing_exception", "expected one aggregation type in [%s]" % name)
+  return kinds[0], spec[kinds[0]], subs
+
+def aggregate(ctx, rows, aggs, doc_count=None):
+  result, pipelines = {}, []
+  for name, spec in aggs.items():
+    kind, params, subs = split_aggregation(name, spec)
+    if kind in PIPELINES:
+      pipelines.append((name, kind, params, spec.get("meta")))
+      continue
+    if kind in BUCKET_AGGREGATIONS:
+      result[name] = BUCKET_AGGREGATIONS[kind](ctx, rows, params, subs)
+    elif kind in METRICS:
+      if subs:
+        raise EmulatorError(400, "aggregation_initialization_exception",
+                            "Aggregator [%s] of type [%s] cannot accept sub-aggregations" % (name, kind))
+      result[name] = METRICS[kind](*ctx.values(params["field"], rows), params)
+    else:
+      raise EmulatorError(400, "parsing_exception", "unknown aggregation [%s] in the emulator" % kind)
+    if spec.get("meta"):
+      result[name]["meta"] = spec["meta"]
+  # A pipeline runs once the aggregations its paths start with are there, so a bucket_script can
+  # use a stats_bucket on the same level whatever order they were written in
+  doc_count = len(rows) if doc_count is None else doc_count
+  while pipelines:
+    ready = [pipeline for pipeline in pipelines if all(
+      parse_path(path)[0] in result or parse_path(path)[0] == "_count"
+      for path in pipeline_paths(pipeline[2]))] or pipelines[:1]
+    for pipeline in ready:
+      name, kind, params, meta = pipeline
+      pipelines.remove(pipeline)
+      value = PIPELINES[kind](result, params, doc_count)
+      if value is None: # A bucket_script skipped because of a gap adds nothing to the bucket
+        continue
+      result[name] = value
+      if meta:
+        result[name]["meta"] = meta
+  return result
+
+def pipeline_paths(params):
+  paths = params.get("buckets_path", {})
+  return list(paths.values()) if isinstance(paths, dict) else as_list(paths)
+
+def make_buckets(ctx, rows, keys, groups, subs, key_output):
+  # groups: the rows of every bucket as (order, starts, counts) of one stable argsort
+  order, starts, counts = groups
+  ctx.add_buckets(len(keys))
+  buckets = []
+  for key, start, count in zip(keys, starts, counts):
+    bucket_rows = rows[order[start:start + count]]
+    bucket = key_output(key)
+    bucket["doc_count"] = int(count)
+    if subs:
+      bucket.update(aggregate(ctx, bucket_rows, subs, int(count)))
+    buckets.append(bucket)
+  return buckets
+
+def group_rows(codes, n_groups):
+  # Stable sort of the rows on their bucket number: the rows of bucket k are order[starts[k]:...]
+  order = np.argsort(codes, kind="stable")
+  counts = np.bincount(codes, minlength=n_groups)
+  starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+  return order, starts, counts
+
+def json_key(value):
+  # Numpy scalars to the int / float / str that the json response would have
+  if isinstance(value, np.generic):
+    return value.item()
+  return value
+
+# Bucket aggregations
+
+def mix64(values):
+  # BitMixer.mix64 of the long values, which Elasticsearch uses to partition numeric terms
+  z = values.astype(np.int64).view(np.uint64)
+  with np.errstate(over="ignore"):
+    z = (z ^ (z >> np.uint64(32))) * np.uint64(0x4cd6944c5cc20b6d)
+    z = (z ^ (z >> np.uint64(29))) * np.uint64(0xfc12c5b19d3259e9)
+    z = z ^ (z >> np.uint64(32))
+  return z.view(np.int64)
+
+def in_partition(keys, include):
+  # terms "include": {"partition": p, "num_partitions": n}: the key hashes to partition p. Numbers
+  # are hashed like Elasticsearch does (so every partition has the same products as on the cluster),
+  # strings with crc32 instead of murmur3
+  n = include["num_partitions"]
+  if keys.dtype.kind in "iub":
+    return np.mod(mix64(keys), n) == include["partition"]
+  return np.array([zlib.crc32(str(key).encode()) % n for key in keys]) == include["partition"]
+
+def include_exclude(keys, params):
+  keep = np.ones(len(keys), dtype=bool)
+  include, exclude = params.get("include"), params.get("exclude")
+  if isinstance(include, dict):
+    keep &= in_partition(keys, include)
+  elif isinstance(include, list):
+    keep &= np.isin(keys, include)
+  if isinstance(exclude, list):
+    keep &= ~np.isin(keys, exclude)
+  return keep
+
+def terms_order(keys, counts, order):
+  # Default order: highest doc_count first, ties on the smallest key
+  order = order or [{"_count": "desc"}, {"_key": "asc"}]
+  if isinstance(order, dict):
+    order = [{key: value} for key, value in order.items()]
+  sort_keys = []
+  for item in order:
+    (by, direction), = item.items()
+    if by not in ("_count", "_key", "_term"):
+      raise EmulatorError(400, "aggregation_execution_exception",
+                          "the emulator can only order terms on _count and _key")
+    values = counts if by == "_count" else keys
+    if direction == "desc":
+      values = -values if values.dtype.kind in "iuf" else -np.unique(values, return_inverse=True)[1]
+    sort_keys.append(values)
+  if not any("_key" in item or "_term" in item for item in order):
+    sort_keys.append(keys) # Ties are always broken on the key
+  return np.lexsort(sort_keys[::-1])
+
+def terms_aggregation(ctx, rows, params, subs):
+  rows, values = ctx.values(params["field"], rows)
+  keys, codes, counts = np.unique(values, return_inverse=True, return_counts=True)
+  keep = include_exclude(keys, params) & (counts >= params.get("min_doc_count", 1))
+  selected = np.flatnonzero(keep)
+  selected = selected[terms_order(keys[selected], counts[selected], params.get("order"))]
+  selected = selected[:params.get("size", 10)]
+
+  order, starts, _ = group_rows(codes, len(keys))
+  buckets = make_buckets(ctx, rows, keys[selected], (order, starts[selected], counts[selected]), subs,
+                         lambda key: {"key": json_key(key)})
+  return {"doc_count_error_upper_bound": 0,
+          "sum_other_doc_count": int(counts[keep].sum() - counts[selected].sum()),
+          "buckets": buckets}
+
+def histogram_aggregation(ctx, rows, params, subs):
+  interval, offset = float(params["interval"]), float(params.get("offset", 0))
+  rows, values = ctx.values(params["field"], rows)
+  index = np.floor((values - offset) / interval).astype(np.int64)
+  low = index.min() if len(index) else None
+  high = index.max() if len(index) else None
+  bounds = params.get("extended_bounds")
+  min_doc_count = params.get("min_doc_count", 0)
+  if bounds and min_doc_count == 0:
+    # Empty buckets are also made up to the extended bounds
+    low = min(x for x in (low, math.floor((bounds["min"] - offset) / interval)) if x is not None)
+    high = max(x for x in (high, math.floor((bounds["max"] - offset) / interval)) if x is not None)
+  if low is None:
+    return {"buckets": []}
+
+  groups = group_rows(index - low, high - low + 1)
+  bucket_index = np.arange(low, high + 1)
+  if min_doc_count > 0:
+    keep = groups[2] >= min_doc_count
+    bucket_index = bucket_index[keep]
+    groups = (groups[0], groups[1][keep], groups[2][keep])
+  if params.get("order") in ({"_key": "desc"}, [{"_key": "desc"}]):
+    bucket_index, groups = bucket_index[::-1], (groups[0], groups[1][::-1], groups[2][::-1])
+  buckets = make_buckets(ctx, rows, bucket_index, groups, subs,
+                         lambda i: {"key": float(i * interval + offset)})
+  return {"buckets": buckets}
+
+def composite_groups(ctx, rows, sources):
+  # Key columns of every source and the sorted unique key tuples, with the rows of each tuple. This
+  # is kept in the search cache, so paging with "after" does not group all documents again
+  names, columns = [], []
+  keep = np.ones(len(rows), dtype=bool)
+  for source in sources:
+    (name, spec), = source.items()
+    kind, params = next((kind, params) for kind, params in spec.items() if kind != "order")
+    if kind not in ("terms", "histogram"):
+      raise EmulatorError(400, "parsing_exception", "unknown composite source [%s]" % kind)
+    field = params["field"]
+    values = ctx.columns[field][rows] if field in ctx.columns else np.full(len(rows), np.nan)
+    keep &= present(values)
+    if kind == "histogram":
+      interval = float(params["interval"])
+      values = np.floor(values / interval) * interval
+    names.append(name)
+    columns.append(values)
+  rows = rows[keep]
+  columns = [values[keep] for values in columns]
+
+  # One integer code per row whose order is the order of the key tuples
+  uniques, code = [], np.zeros(len(rows), dtype=np.int64)
+  for values in columns:
+    unique, inverse = np.unique(values, return_inverse=True)
+    uniques.append(unique)
+    code = code * len(unique) + inverse
+  codes, inverse, counts = np.unique(code, return_inverse=True, return_counts=True)
+  order, starts, _ = group_rows(inverse, len(codes))
+  return {"names": names, "uniques": uniques, "codes": codes, "counts": counts, "order": order,
+          "starts": starts, "rows": rows}
+
+def composite_key(groups, code):
+  key = {}
+  for name, unique in reversed(list(zip(groups["names"], groups["uniques"]))):
+    code, position = divmod(code, len(unique))
+    key[name] = json_key(unique[position])
+  return dict(reversed(list(key.items())))
+
+def composite_start(groups, after):
+  # The first key tuple after the "after" key: the code of the after key, where a value that is not
+  # in the data counts from the next value up
+  code, exact = 0, True
+  for name, unique in zip(groups["names"], groups["uniques"]):
+    position = np.searchsorted(unique, after[name], side="left") if exact else 0
+    exact = exact and position < len(unique) and unique[position] == after[name]
+    code = code * len(unique) + position
+  return np.searchsorted(groups["codes"], code, side="right" if exact else "left")
+
+def composite_aggregation(ctx, rows, params, subs):
+  key = json.dumps([params["sources"], len(rows), int(rows.sum())], sort_keys=True, default=str)
+  groups = ctx.cache.get(key)
+  if groups is None:
+    groups = composite_groups(ctx, rows, params["sources"])
+    with CACHE_LOCK:
+      ctx.cache.clear() # Only the groups of the composite aggregation being paged are kept
+      ctx.cache[key] = groups
+  start = composite_start(groups, params["after"]) if params.get("after") else 0
+  page = slice(start, start + params.get("size", 10))
+  codes = groups["codes"][page]
+  buckets = make_buckets(ctx, groups["rows"], codes,
+                         (groups["order"], groups["starts"][page], groups["counts"][page]), subs,
+                         lambda code: {"key": composite_key(groups, int(code))})
+  result = {"buckets": buckets}
+  if buckets:
+    result["after_key"] = buckets[-1]["key"]
+  return result
+
+BUCKET_AGGREGATIONS = {
+  "terms": terms_aggregation,
+  "histogram": histogram_aggregation,
+  "composite": composite_aggregation,
+}
+
+# Metrics
+
+def float_or_none(value):
+  return None if value is None or np.isnan(value) else float(value)
+
+def stats_of(values, sigma=2.0, extended=False):
+  # The stats / extended_stats response of a list of numbers, with the formulas of Elasticsearch
+  # (population variance from the sum of squares, clipped at 0)
+  values = np.asarray(values, dtype=np.float64)
+  count = len(values)
+  total = float(values.sum()) if count else 0.0
+  result = {"count": count,
+            "min": float(values.min()) if count else None,
+            "max": float(values.max()) if count else None,
+            "avg": total / count if count else None,
+            "sum": total}
+  if not extended:
+    return result
+  if count == 0:
+    for key in ("sum_of_squares", "variance", "variance_population", "variance_sampling",
+                "std_deviation", "std_deviation_population", "std_deviation_sampling"):
+      result[key] = None
+    result["std_deviation_bounds"] = {key: None for key in (
+      "upper", "lower", "upper_population", "lower_population", "upper_sampling", "lower_sampling")}
+    return result
+  squares = float((values * values).sum())
+  variance = max((squares - total * total / count) / count, 0.0)
+  sampling = max((squares - total * total / count) / (count - 1), 0.0) if count > 1 else float("nan")
+  avg = total / count
+  result.update({"sum_of_squares": squares, "variance": variance, "variance_population": variance,
+                 "variance_sampling": float_or_none(sampling),
+                 "std_deviation": math.sqrt(variance),
+                 "std_deviation_population": math.sqrt(variance),
+                 "std_deviation_sampling": float_or_none(math.sqrt(sampling))})
+  result["std_deviation_bounds"] = {
+    "upper": avg + sigma * result["std_deviation"], "lower": avg - sigma * result["std_deviation"],
+    "upper_population": avg + sigma * result["std_deviation"],
+    "lower_population": avg - sigma * result["std_deviation"],
+    "upper_sampling": float_or_none(avg + sigma * math.sqrt(sampling)),
+    "lower_sampling": float_or_none(avg - sigma * math.sqrt(sampling))}
+  return result
+
+def percentiles_of(values, percents, keyed=True):
+  # Exact percentiles (linear interpolation), where the cluster uses a TDigest estimate
+  values = np.asarray(values, dtype=np.float64)
+  result = [(str(float(p)), float(np.percentile(values, p)) if len(values) else None)
+            for p in percents]
+  if keyed:
+    return {"values": dict(result)}
+  return {"values": [{"key": float(key), "value": value} for key, value in result]}
+
+METRICS = {
+  "avg": lambda rows, values, params: {"value": float(values.mean()) if len(values) else None},
+  "sum": lambda rows, values, params: {"value": float(values.sum())},
+  "min": lambda rows, values, params: {"value": float(values.min()) if len(values) else None},
+  "max": lambda rows, values, params: {"value": float(values.max()) if len(values) else None},
+  "value_count": lambda rows, values, params: {"value": len(values)},
+  "cardinality": lambda rows, values, params: {"value": len(np.unique(values))},
+  "stats": lambda rows, values, params: stats_of(values),
+  "extended_stats": lambda rows, values, params: stats_of(values, params.get("sigma", 2.0), True),
+  "percentiles": lambda rows, values, params: percentiles_of(
+    values, params.get("percents", (1, 5, 25, 50, 75, 95, 99)), params.get("keyed", True)),
+}
+
+# Pipelines
+
+def parse_path(path):
+  # "agg>sub.metric" / "agg._count" / "agg>percentiles[99.0]" -> ["agg", "sub", "metric"]
+  parts = path.split(">")
+  last = parts.pop()
+  if "[" in last:
+    name, key = last[:-1].split("[", 1)
+  elif "." in last:
+    name, key = last.split(".", 1)
+  else:
+    name, key = last, None
+  return parts + [name] + ([key] if key is not None else [])
+
+def path_value(result, elements, doc_count):
+  # The value the path points to inside one bucket (or on one level)
+  value = result
+  for element in elements:
+    if element == "_count":
+      return float(doc_count if value is result else value["doc_count"])
+    if element == "_key":
+      return value["key"]
+    if element in value:
+      value = value[element]
+    elif "values" in value and element in value["values"]:
+      value = value["values"][element]
+    else:
+      raise KeyError(">".join(elements))
+  if isinstance(value, dict):
+    value = value.get("value")
+  return value
+
+def is_gap(value):
+  return value is None or (isinstance(value, float) and math.isnan(value))
+
+def bucket_values(result, params):
+  # The values of a sibling pipeline: one per bucket of the multi-bucket aggregation named first in
+  # buckets_path. gap_policy decides what happens with a bucket without a value (no documents, or a
+  # metric that is null / NaN): skip it, count it as 0 (insert_zeros) or keep the value it does
+  # have (keep_values). The _count of an empty bucket is 0, not a gap
+  elements = parse_path(params["buckets_path"])
+  gap_policy = params.get("gap_policy", "skip")
+  if elements[0] not in result or "buckets" not in result[elements[0]]:
+    raise EmulatorError(400, "aggregation_execution_exception",
+                        "buckets_path must reference a multi-bucket aggregation [%s]"
+                        % params["buckets_path"])
+  buckets = result[elements[0]]["buckets"]
+  if isinstance(buckets, dict): # keyed buckets
+    buckets = list(buckets.values())
+  rest = elements[1:] or ["_count"]
+  keys, values, found = [], [], 0
+  for bucket in buckets:
+    try:
+      value = path_value(bucket, rest, bucket["doc_count"])
+      found += 1
+    except KeyError: # e.g. a bucket_script that skipped this bucket
+      value = None
+    gap = is_gap(value)
+    if not gap and bucket["doc_count"] == 0 and rest != ["_count"] and gap_policy != "keep_values":
+      gap = True
+    if gap:
+      if gap_policy != "insert_zeros":
+        continue
+      value = 0.0
+    keys.append(bucket["key"])
+    values.append(float(value))
+  if buckets and not found and rest != ["_count"]:
+    raise EmulatorError(400, "aggregation_execution_exception",
+                        "No aggregation found for path [%s]" % params["buckets_path"])
+  return keys, values
+
+def extreme_bucket(function):
+  def pipeline(result, params, doc_count):
+    keys, values = bucket_values(result, params)
+    if not values:
+      return {"value": None, "keys": []}
+    best = function(values)
+    return {"value": best, "keys": [str(key) for key, value in zip(keys, values) if value == best]}
+  return pipeline
+
+def values_pipeline(function):
+  def pipeline(result, params, doc_count):
+    return function(bucket_values(result, params)[1], params)
+  return pipeline
+
+def percentiles_bucket(result, params, doc_count):
+  # The value at rank round(p / 100 * (n - 1)) of the sorted bucket values, like the cluster does (no
+  # interpolation between two buckets)
+  values = sorted(bucket_values(result, params)[1])
+  percents = params.get("percents", (1, 5, 25, 50, 75, 95, 99))
+  found = [(str(float(p)), values[int(math.floor(p / 100 * (len(values) - 1) + 0.5))] if values
+            else None) for p in percents]
+  if params.get("keyed", True):
+    return {"values": dict(found)}
+  return {"values": [{"key": float(key), "value": value} for key, value in found]}
+
+# bucket_script evaluates a painless expression on the values of one bucket. Only arithmetic is
+# supported: params.<name> for the buckets_path variables and script params, and Math functions.
+# The script is parsed once and checked node by node, anything else is a script_exception
+
+MATH_FUNCTIONS = {"sqrt": math.sqrt, "pow": math.pow, "abs": abs, "log": math.log, "exp": math.exp,
+                  "max": max, "min": min, "floor": math.floor, "ceil": math.ceil, "round": round}
+
+BINARY_OPERATORS = {ast.Add: lambda a, b: a + b, ast.Sub: lambda a, b: a - b,
+                    ast.Mult: lambda a, b: a * b, ast.Div: lambda a, b: a / b,
+                    ast.Mod: lambda a, b: a % b}
+UNARY_OPERATORS = {ast.USub: lambda a: -a, ast.UAdd: lambda a: +a, ast.Not: lambda a: not a}
+COMPARISONS = {ast.Lt: lambda a, b: a < b, ast.LtE: lambda a, b: a <= b,
+               ast.Gt: lambda a, b: a > b, ast.GtE: lambda a, b: a >= b,
+               ast.Eq: lambda a, b: a == b, ast.NotEq: lambda a, b: a != b}
+
+def script_error(reason):
+  return EmulatorError(400, "script_exception", "the emulator only runs arithmetic scripts: " + reason)
+
+def check_script(node):
+  # Raises for every node that is not arithmetic, a comparison, params.<name> or Math.<function>()
+  if isinstance(node, ast.Expression):
+    check_script(node.body)
+  elif isinstance(node, ast.Constant):
+    if not isinstance(node.value, (int, float)):
+      raise script_error("constant %r" % (node.value,))
+  elif isinstance(node, ast.Attribute):
+    if not (isinstance(node.value, ast.Name) and node.value.id == "params"):
+      raise script_error("only params.<name> can be read")
+  elif isinstance(node, ast.Call):
+    function = node.func
+    if (node.keywords or not isinstance(function, ast.Attribute) or
+        not isinstance(function.value, ast.Name) or function.value.id != "Math" or
+        function.attr not in MATH_FUNCTIONS):
+      raise script_error("only Math.%s() can be called" % "/".join(MATH_FUNCTIONS))
+    for argument in node.args:
+      check_script(argument)
+  elif isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+    check_script(node.left)
+    check_script(node.right)
+  elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+    check_script(node.operand)
+  elif isinstance(node, ast.BoolOp):
+    for value in node.values:
+      check_script(value)
+  elif isinstance(node, ast.Compare) and all(type(op) in COMPARISONS for op in node.ops):
+    check_script(node.left)
+    for comparator in node.comparators:
+      check_script(comparator)
+  else:
+    raise script_error(type(node).__name__)
+
+def evaluate_script(node, params):
+  # Walks a checked script tree
+  if isinstance(node, ast.Expression):
+    return evaluate_script(node.body, params)
+  if isinstance(node, ast.Constant):
+    return node.value
+  if isinstance(node, ast.Attribute):
+    if node.attr not in params:
+      raise EmulatorError(400, "script_exception", "params.%s is not defined" % node.attr)
+    return params[node.attr]
+  if isinstance(node, ast.Call):
+    return MATH_FUNCTIONS[node.func.attr](*[evaluate_script(argument, params) for argument in node.args])
+  if isinstance(node, ast.BinOp):
+    return BINARY_OPERATORS[type(node.op)](evaluate_script(node.left, params),
+                                          evaluate_script(node.right, params))
+  if isinstance(node, ast.UnaryOp):
+    return UNARY_OPERATORS[type(node.op)](evaluate_script(node.operand, params))
+  if isinstance(node, ast.BoolOp):
+    if isinstance(node.op, ast.And):
+      return all(evaluate_script(value, params) for value in node.values)
+    return any(evaluate_script(value, params) for value in node.values)
+  left = evaluate_script(node.left, params)
+  for op, comparator in zip(node.ops, node.comparators):
+    right = evaluate_script(comparator, params)
+    if not COMPARISONS[type(op)](left, right):
+      return False
+    left = right
+  return True
+
+_parsed_scripts = {}
+
+def parse_script(source):
+  if source not in _parsed_scripts:
+    if "?" in source or ";" in source:
+      raise script_error("no conditionals or statements")
+    try:
+      tree = ast.parse(source.replace("&&", " and ").replace("||", " or "), mode="eval")
+    except SyntaxError as error:
+      raise script_error(str(error))
+    check_script(tree)
+    _parsed_scripts[source] = tree
+  return _parsed_scripts[source]
+
+def bucket_script(result, params, doc_count):
+  script = params["script"]
+  if isinstance(script, str):
+    script = {"source": script}
+  gap_policy = params.get("gap_policy", "skip")
+  variables = dict(script.get("params", {}))
+  for variable, path in params["buckets_path"].items():
+    try:
+      value = path_value(result, parse_path(path), doc_count)
+    except KeyError:
+      value = None
+    if is_gap(value) or (doc_count == 0 and path != "_count"):
+      if gap_policy != "insert_zeros":
+        return None
+      value = 0.0
+    variables[variable] = value
+  tree = parse_script(script["source"])
+  try:
+    value = evaluate_script(tree, variables)
+  except ZeroDivisionError: # Painless divides doubles to Infinity / NaN
+    value = float("nan")
+  return {"value": None if value is None else float(value)}
+
+PIPELINES = {
+  "bucket_script": bucket_script,
+  "percentiles_bucket": percentiles_bucket,
+  "avg_bucket": values_pipeline(lambda values, params: {
+    "value": sum(values) / len(values) if values else None}),
+  "sum_bucket": values_pipeline(lambda values, params: {"value": float(sum(values))}),
+  "min_bucket": extreme_bucket(min),
+  "max_bucket": extreme_bucket(max),
+  "stats_bucket": values_pipeline(lambda values, params: stats_of(values)),
+  "extended_stats_bucket": values_pipeline(lambda values, params: stats_of(
+    values, params.get("sigma", 2.0), True)),
+}
+
+""" CLIENT """
+
+class Indices:
+  # The part of es.indices the project calls
+  def __init__(self, client):
+    self.client = client
+
+  def create(self, index, body=None, **kwargs):
+    store = self.client.store
+    if index in store.names():
+      raise EmulatorError(400, "resource_already_exists_exception", "index [%s] already exists" % index)
+    body = body or {}
+    fields = (body.get("mappings", {}).get("properties") or {}).keys()
+    store.add(index, {field: np.empty(0) for field in fields}, body.get("settings"))
+    return {"acknowledged": True, "shards_acknowledged": True, "index": index}
+
+  def delete(self, index, ignore=None, **kwargs):
+    try:
+      for name in self.client.store.resolve(index):
+        self.client.store.delete(name)
+    except EmulatorError as error:
+      if error.status_code not in as_list(ignore):
+        raise
+    return {"acknowledged": True}
+
+  def exists(self, index, **kwargs):
+    return all(name in self.client.store.names() for name in self.client.store.resolve(index))
+
+  def refresh(self, index=None, **kwargs):
+    return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+  def put_settings(self, body=None, index=None, **kwargs):
+    for name in self.client.store.resolve(index):
+      self.client.store.get(name)["settings"].update(body or {})
+    return {"acknowledged": True}
+
+  def stats(self, index=None, metric=None, **kwargs):
+    indices = {}
+    for name in self.client.store.resolve(index):
+      entry = self.client.store.get(name)
+      n = len(next(iter(entry["columns"].values()), []))
+      stats = {"docs": {"count": n, "deleted": 0}, "indexing": {"index_total": entry["index_total"]}}
+      indices[name] = {"uuid": entry["uuid"], "primaries": stats, "total": stats}
+    return {"indices": indices}
+
+class Enrich:
+  # Enrich policies of type match: execute_policy takes a snapshot of the source index (like the
+  # .enrich index of the cluster), which the enrich processor of an ingest pipeline looks up
+  def __init__(self, client):
+    self.client = client
+    self.policies = {}
+    self.snapshots = {}
+
+  def put_policy(self, name, body=None, **kwargs):
+    if "match" not in (body or {}):
+      raise EmulatorError(400, "illegal_argument_exception", "the emulator only has match policies")
+    self.policies[name] = body["match"]
+    return {"acknowledged": True}
+
+  def get_policy(self, name=None, **kwargs):
+    return {"policies": [{"config": {"match": dict(policy, name=policy_name)}}
+                         for policy_name, policy in self.policies.items()
+                         if name in (None, policy_name)]}
+
+  def delete_policy(self, name, **kwargs):
+    self.policies.pop(name, None)
+    self.snapshots.pop(name, None)
+    return {"acknowledged": True}
+
+  def execute_policy(self, name, wait_for_completion=True, **kwargs):
+    policy = self.policies[name]
+    columns = self.client.columns(policy["indices"])
+    fields = [policy["match_field"]] + [field for field in policy["enrich_fields"] if field in columns]
+    df = pd.DataFrame({field: columns[field] for field in fields})
+    self.snapshots[name] = df.drop_duplicates(policy["match_field"]).set_index(policy["match_field"],
+                                                                               drop=False)
+    return {"status": {"phase": "COMPLETE"}}
+
+class Ingest:
+  def __init__(self, client):
+    self.client = client
+    self.pipelines = {}
+
+  def put_pipeline(self, id, body=None, **kwargs):
+    for processor in (body or {}).get("processors", []):
+      if set(processor) != {"enrich"}:
+        raise EmulatorError(400, "parse_exception", "the emulator only runs enrich processors")
+    self.pipelines[id] = body
+    return {"acknowledged": True}
+
+  def get_pipeline(self, id=None, **kwargs):
+    return {name: body for name, body in self.pipelines.items() if id in (None, name)}
+
+  def delete_pipeline(self, id, **kwargs):
+    self.pipelines.pop(id, None)
+    return {"acknowledged": True}
+
+  def run(self, pipeline, columns):
+    # The enrich processors on all documents at once: new columns <target_field>.<field>
+    for processor in self.pipelines[pipeline]["processors"]:
+      enrich = processor["enrich"]
+      snapshot = self.client.enrich.snapshots.get(enrich["policy_name"])
+      if snapshot is None:
+        raise EmulatorError(400, "illegal_argument_exception",
+                            "no enrich index exists for policy [%s]" % enrich["policy_name"])
+      if enrich["field"] not in columns:
+        continue
+      rows = snapshot.index.get_indexer(columns[enrich["field"]])
+      found = rows >= 0
+      for field in snapshot.columns:
+        target = "%s.%s" % (enrich["target_field"], field)
+        if target in columns and not enrich.get("override", True):
+          continue
+        values = snapshot[field].to_numpy(dtype=np.float64)[np.maximum(rows, 0)]
+        columns[target] = np.where(found, values, np.nan)
+    return columns
+
+class Cluster:
+  def __init__(self, client):
+    self.client = client
+
+  def put_settings(self, body=None, **kwargs):
+    # Only search.max_buckets means something here (the README sets it in Kibana)
+    for scope in ("persistent", "transient"):
+      settings = (body or {}).get(scope, {})
+      if "search.max_buckets" in settings:
+        self.client.max_buckets = int(settings["search.max_buckets"])
+    return {"acknowledged": True, **(body or {})}
+
+class LocalElasticsearch:
+  # Answers search / count / indices calls like the client does, from a ColumnStore
+  def __init__(self, store=None, max_buckets=65536):
+    self.store = store or ColumnStore()
+    self.max_buckets = max_buckets
+    self.indices = Indices(self)
+    self.cluster = Cluster(self)
+    self.enrich = Enrich(self)
+    self.ingest = Ingest(self)
+    self.cache = {}
+
+  def info(self, **kwargs):
+    return {"name": "local", "cluster_name": "belsimpel-emulator", "version": {"number": "7.17.0"},
+            "tagline": "You Know, for Search"}
+
+  def ping(self, **kwargs):
+    return True
+
+  def columns(self, index):
+    # All documents of the indices as one set of columns (fields missing in an index become NaN)
+    names = self.store.resolve(index)
+    if len(names) == 1:
+      return self.store.get(names[0])["columns"]
+    entries = [self.store.get(name)["columns"] for name in names]
+    fields = sorted(set().union(*entries))
+    return {field: np.concatenate([entry[field] if field in entry else
+                                   np.full(len(next(iter(entry.values()), [])), np.nan)
+                                   for entry in entries]) for field in fields}
+
+  def search(self, index=None, body=None, **kwargs):
+    start = time.perf_counter()
+    body = dict(body or {})
+    for key in ("query", "aggs", "aggregations", "size", "track_total_hits", "from_"):
+      if key in kwargs:
+        body["from" if key == "from_" else key] = kwargs[key]
+    columns = self.columns(index)
+    n = len(next(iter(columns.values()), []))
+    rows = np.flatnonzero(query_mask(columns, n, body.get("query")))
+
+    response = {"took": 0, "timed_out": False,
+                "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                "hits": {"total": self.total_hits(len(rows), body.get("track_total_hits", 10000)),
+                         "max_score": None, "hits": self.hits(index, columns, rows, body)}}
+    aggs = body.get("aggs", body.get("aggregations"))
+    if aggs:
+      # Cached groups belong to one version of the indices (a reloaded index gets a new uuid)
+      version = tuple(self.store.get(name)["uuid"] for name in self.store.resolve(index))
+      ctx = SearchContext(columns, self.max_buckets, self.cache.setdefault(version, {}))
+      response["aggregations"] = aggregate(ctx, rows, aggs)
+    response["took"] = int((time.perf_counter() - start) * 1000)
+    if kwargs.get("filter_path"):
+      response = filter_response(response, kwargs["filter_path"])
+    return response
+
+  def bulk(self, body=None, operations=None, index=None, **kwargs):
+    # index / create actions, as ndjson text or a list of lines / dicts
+    lines = operations if operations is not None else body
+    if isinstance(lines, (str, bytes)):
+      lines = [line for line in (lines.decode() if isinstance(lines, bytes) else lines).splitlines()
+               if line.strip()]
+    lines = [json.loads(line) if isinstance(line, (str, bytes)) else line for line in lines]
+    start, items, documents = time.perf_counter(), [], {}
+    for action, source in zip(lines[::2], lines[1::2]):
+      (kind, meta), = action.items()
+      if kind not in ("index", "create"):
+        raise EmulatorError(400, "illegal_argument_exception", "the emulator only bulk indexes")
+      name = meta.get("_index", index)
+      documents.setdefault(name, []).append(source)
+      items.append({kind: {"_index": name, "_id": meta.get("_id"), "status": 201,
+                           "result": "created"}})
+    for name, sources in documents.items():
+      self.store.append(name, sources)
+    return {"took": int((time.perf_counter() - start) * 1000), "errors": False, "items": items}
+
+  def update_by_query(self, index=None, body=None, pipeline=None, **kwargs):
+    # Only to run an ingest pipeline (enrich) over every document of the index again
+    start, total = time.perf_counter(), 0
+    for name in self.store.resolve(index):
+      entry = self.store.get(name)
+      n = len(next(iter(entry["columns"].values()), []))
+      if pipeline:
+        self.ingest.run(pipeline, entry["columns"])
+      entry["index_total"] += n
+      total += n
+    return {"took": int((time.perf_counter() - start) * 1000), "timed_out": False, "total": total,
+            "updated": total, "deleted": 0, "batches": 1, "noops": 0, "failures": []}
+
+  def count(self, index=None, body=None, **kwargs):
+    columns = self.columns(index)
+    n = len(next(iter(columns.values()), []))
+    query = (body or {}).get("query", kwargs.get("query"))
+    return {"count": int(query_mask(columns, n, query).sum()),
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+
+  @staticmethod
+  def total_hits(n, track_total_hits):
+    if track_total_hits is True or (track_total_hits is not False and n <= track_total_hits):
+      return {"value": n, "relation": "eq"}
+    return {"value": int(track_total_hits or 0), "relation": "gte"}
+
+  @staticmethod
+  def hits(index, columns, rows, body):
+    start = body.get("from", 0)
+    selected = rows[start:start + body.get("size", 10)]
+    return [{"_index": index, "_id": str(row), "_score": 1.0,
+             "_source": {field: json_key(values[row]) for field, values in columns.items()}}
+            for row in selected]
+
+def filter_response(response, filter_path):
+  # filter_path: only the parts of the response on these dotted paths (* matches any one key). Lists
+  # are filtered item by item and empty objects are left out, like the cluster does
+  paths = filter_path.split(",") if isinstance(filter_path, str) else filter_path
+  filtered = filter_node(response, [path.split(".") for path in paths])
+  return {} if filtered is None else filtered
+
+def filter_node(node, patterns):
+  if any(not pattern for pattern in patterns):
+    return node
+  if isinstance(node, list):
+    items = [item for item in (filter_node(item, patterns) for item in node) if item is not None]
+    return items or None
+  if not isinstance(node, dict):
+    return None
+  filtered = {}
+  for key, value in node.items():
+    rest = [pattern[1:] for pattern in patterns if fnmatch.fnmatchcase(key, pattern[0])]
+    if rest:
+      value = filter_node(value, rest)
+      if value is not None:
+        filtered[key] = value
+  return filtered or None
+
+""" THE INDICES OF THIS PROJECT """
+
+# BELSIMPEL_ES_EMULATOR=<sales.csv> makes elasticsearch_setup() in main.py return this emulator: the
+# "products" index is sales.csv (one document per row, like step 1.1 loads it), and margins.csv and
+# dimensions.csv next to it are the "margins" and "dimensions" indices
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def local_elasticsearch(sales="sales.csv", max_buckets=65536):
+  # One emulator per sales file for the whole process, so every csv is read once
+  path = os.path.abspath(sales)
+  with _clients_lock:
+    if path not in _clients:
+      store = ColumnStore()
+      store.add_csv("products", path, usecols=["day", "product_id", "product_orders_per_day"])
+      directory = os.path.dirname(path)
+      for index in ("margins", "dimensions"):
+        if os.path.exists(os.path.join(directory, index + ".csv")):
+          store.add_csv(index, os.path.join(directory, index + ".csv"))
+      _clients[path] = LocalElasticsearch(store, max_buckets)
+    return _clients[path]
@@ -0,0 +1,204 @@
+# Assignment: Belsimpel warehouse case
+# Paged composite aggregation over the products index, streamed straight into the demand counts
+
+
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from profiling import record, recorder, timed_search
+from demand_engine import DailyCounts, accumulate_counts, compact_counts
+from es_client import shared_async_client, run_async
+
+""" STEP 1.1: COMPOSITE AGGREGATION PAGES """
+
+def composite_pages(es, index="products", page_size=10000):
+  # A composite aggregation returns (product_id, day) buckets in pages of page_size, with an
+  # after_key to ask for the next page. Unlike the terms aggregation with "size": 1200 no product is
+  # dropped, and no single response has to hold all buckets (so search.max_buckets is never hit)
+  composite = {
+    "size": page_size,
+    "sources": [
+      {"product_id": {"terms": {"field": "product_id"}}},
+      {"day": {"histogram": {"field": "day", "interval": 1}}}
+    ]
+  }
+
+  while True:
+    result = timed_search(es, index=index,
+                          body={"size": 0, "aggs": {"daily_demand": {"composite": composite}}})
+    aggregation = result["aggregations"]["daily_demand"]
+    if not aggregation["buckets"]:
+      return
+    yield aggregation["buckets"]
+
+    # The last page can still carry an after_key, the empty page after it ends the loop
+    if "after_key" not in aggregation:
+      return
+    composite["after"] = aggregation["after_key"]
+
+def fetch_daily_counts(es, index="products", page_size=10000):
+  # Decode every page into arrays and add it to the count matrix before asking for the next one
+  counts = DailyCounts()
+  for buckets in composite_pages(es, index, page_size):
+    start = time.perf_counter()
+    product = np.fromiter((bucket["key"]["product_id"] for bucket in buckets), dtype=np.int64,
+                          count=len(buckets))
+    day = np.fromiter((bucket["key"]["day"] for bucket in buckets), dtype=np.float64,
+                      count=len(buckets)).astype(np.int64)
+    orders = np.fromiter((bucket["doc_count"] for bucket in buckets), dtype=np.float64,
+                         count=len(buckets))
+    counts = accumulate_counts(counts, product, day, orders)
+    record(decode_seconds=time.perf_counter() - start, buckets=len(buckets))
+
+  # Composite buckets only exist for days with orders, the zero days are filled in by the matrix
+  return compact_counts(counts)
+
+""" STEP 1.1: PARTITIONED TERMS AGGREGATIONS, CONCURRENTLY """
+
+# A terms aggregation with "include": {"partition": p, "num_partitions": n} only returns the products
+# whose id hashes to partition p. The partitions are independent queries, so they are sent at the
+# same time (every one on its own pooled connection) and the cluster works on all of them in parallel,
+# instead of one coordinating request (or one composite page) at a time
+
+def summary_body():
+  return {"size": 0, "track_total_hits": True, "aggs": {
+    "products": {"cardinality": {"field": "product_id", "precision_threshold": 40000}},
+    "first_day": {"min": {"field": "day"}},
+    "last_day": {"max": {"field": "day"}}}}
+
+def index_summary(result):
+  aggs = result["aggregations"]
+  days = 0
+  if aggs["first_day"]["value"] is not None:
+    days = int(aggs["last_day"]["value"] - aggs["first_day"]["value"]) + 1
+  return {"docs": result["hits"]["total"]["value"], "products": aggs["products"]["value"],
+          "days": days}
+
+def partition_plan(summary, partition_buckets=50000):
+  # Every partition returns a bucket per product and one per (product, day) with orders. There are at
+  # most min(docs, products x days) of those (every document is one order), and the hash spreads them
+  # unevenly, so a quarter is kept free. The terms size leaves room for the uneven product counts.
+  # Returns (num_partitions, terms size)
+  pairs = min(summary["docs"], summary["products"] * summary["days"])
+  num_partitions = max(1, math.ceil((pairs + summary["products"]) * 1.25 / partition_buckets))
+  size = int(summary["products"] / num_partitions * 1.5) + 100
+  return num_partitions, max(1, min(size, summary["products"] + 100))
+
+def partition_body(partition, num_partitions, size):
+  return {"size": 0, "aggs": {"products": {
+    "terms": {"field": "product_id", "size": size, "order": {"_key": "asc"},
+              "include": {"partition": partition, "num_partitions": num_partitions}},
+    "aggs": {"days": {"histogram": {"field": "day", "interval": 1, "min_doc_count": 1}}}}}}
+
+def decode_partition(result):
+  # (product_id, day, orders) arrays of one partition, and whether the size cut off products
+  aggregation = result["aggregations"]["products"]
+  product, day, orders = [], [], []
+  for bucket in aggregation["buckets"]:
+    days = bucket["days"]["buckets"]
+    product.append(np.full(len(days), bucket["key"], dtype=np.int64))
+    day.append(np.fromiter((d["key"] for d in days), dtype=np.float64, count=len(days)))
+    orders.append(np.fromiter((d["doc_count"] for d in days), dtype=np.float64, count=len(days)))
+  if not product:
+    return (np.zeros(0, dtype=np.int64),) * 2 + (np.zeros(0),), aggregation["sum_other_doc_count"] > 0
+  return ((np.concatenate(product), np.concatenate(day).astype(np.int64), np.concatenate(orders)),
+          aggregation["sum_other_doc_count"] > 0)
+
+def too_many_buckets(error):
+  return "too_many_buckets" in str(error) + str(getattr(error, "info", ""))
+
+def fetch_partition(es, index, partition, num_partitions, size):
+  # The arrays of one partition plus its timings, as a list: a partition with more buckets than
+  # search.max_buckets allows is split in two (hash mod 2n is p or p + n exactly when hash mod n is
+  # p), a partition whose size cut off products is asked again with twice the size
+  start = time.perf_counter()
+  try:
+    result = es.search(index=index, body=partition_body(partition, num_partitions, size))
+  except Exception as error:
+    if not too_many_buckets(error):
+      raise
+    return (fetch_partition(es, index, partition, 2 * num_partitions, size) +
+            fetch_partition(es, index, partition + num_partitions, 2 * num_partitions, size))
+  seconds = time.perf_counter() - start
+  decode_start = time.perf_counter()
+  arrays, cut_off = decode_partition(result)
+  if cut_off:
+    return fetch_partition(es, index, partition, num_partitions, 2 * size)
+  return [(arrays, result.get("took", 0) / 1000, seconds, time.perf_counter() - decode_start)]
+
+def merge_partitions(counts, parts, record=record):
+  # Add the arrays of finished partitions to the demand counts (in the calling thread, which also
+  # owns the profiler span, or with the recorder of that span)
+  for (product, day, orders), took, seconds, decode_seconds in parts:
+    counts = accumulate_counts(counts, product, day, orders)
+    record(es_requests=1, es_took_seconds=took, es_client_seconds=seconds,
+           decode_seconds=decode_seconds, buckets=len(product), partitions=1)
+  return counts
+
+def fetch_daily_counts_partitioned(es, index="products", partition_buckets=50000, concurrency=8):
+  # The same matrix as fetch_daily_counts, from partitions that are fetched by `concurrency` threads
+  # sharing the pooled client
+  num_partitions, size = partition_plan(index_summary(timed_search(es, index=index,
+                                                                   body=summary_body())),
+                                        partition_buckets)
+  counts = DailyCounts()
+  with ThreadPoolExecutor(max_workers=max(1, min(concurrency, num_partitions))) as pool:
+    futures = [pool.submit(fetch_partition, es, index, partition, num_partitions, size)
+               for partition in range(num_partitions)]
+    for future in as_completed(futures):
+      counts = merge_partitions(counts, future.result())
+  return compact_counts(counts)
+
+# asyncio: the same partitions as tasks on one event loop, at most `concurrency` in flight
+
+async def fetch_partition_async(es, index, partition, num_partitions, size, semaphore):
+  async with semaphore:
+    start = time.perf_counter()
+    try:
+      result = await es.search(index=index, body=partition_body(partition, num_partitions, size))
+      error = None
+    except Exception as caught:
+      if not too_many_buckets(caught):
+        raise
+      error = caught
+    seconds = time.perf_counter() - start
+  if error is not None:
+    halves = await asyncio.gather(
+      fetch_partition_async(es, index, partition, 2 * num_partitions, size, semaphore),
+      fetch_partition_async(es, index, partition + num_partitions, 2 * num_partitions, size,
+                            semaphore))
+    return halves[0] + halves[1]
+  decode_start = time.perf_counter()
+  arrays, cut_off = decode_partition(result)
+  if cut_off:
+    return await fetch_partition_async(es, index, partition, num_partitions, 2 * size, semaphore)
+  return [(arrays, result.get("took", 0) / 1000, seconds, time.perf_counter() - decode_start)]
+
+async def fetch_daily_counts_async(es, index="products", partition_buckets=50000, concurrency=8,
+                                   record=record):
+  # record is the recorder of the caller's span when this runs on the background loop
+  start = time.perf_counter()
+  result = await es.search(index=index, body=summary_body())
+  record(es_requests=1, es_took_seconds=result.get("took", 0) / 1000,
+         es_client_seconds=time.perf_counter() - start)
+  summary = index_summary(result)
+  num_partitions, size = partition_plan(summary, partition_buckets)
+  semaphore = asyncio.Semaphore(concurrency)
+  tasks = [fetch_partition_async(es, index, partition, num_partitions, size, semaphore)
+           for partition in range(num_partitions)]
+  counts = DailyCounts()
+  for task in asyncio.as_completed(tasks):
+    counts = merge_partitions(counts, await task, record)
+  return compact_counts(counts)
+
+def fetch_daily_counts_asyncio(emulator="", index="products", partition_buckets=50000, concurrency=8):
+  # For sync callers: runs the async fetch on the background event loop of es_client, with the
+  # pooled async client that stays open for the next fetch (it is closed at exit). The loop runs in
+  # its own thread, so the metrics go to the caller's span through a recorder
+  record_metrics = recorder()
+  async def run():
+    return await fetch_daily_counts_async(shared_async_client(emulator), index, partition_buckets,
+                                          concurrency, record_metrics)
+  return run_async(run())
@@ -0,0 +1,122 @@
+# Assignment: Belsimpel warehouse case
+# Fast bulk load of sales.csv into the products index (parallel bulk workers, typed documents)
+
+
+import time
+import pandas as pd
+from elasticsearch import helpers
+
+""" STEP 1.1: INDEX LAYOUT FOR LOADING """
+
+SALES_FIELDS = ["day", "product_id", "product_orders_per_day"]
+
+def create_sorted_index(es, index="products", shards=1):
+  # Same mapping as before, but the segments are sorted on product_id and day (so aggregations per
+  # product read neighbouring documents). While loading there are no replicas and no refreshes.
+  # Returns the replicas and refresh interval the index had (from templates or the cluster
+  # defaults), so they can be restored afterwards
+  settings = {
+    "settings": {
+      "index": {
+        "number_of_shards": shards,
+        "sort.field": ["product_id", "day"],
+        "sort.order": ["asc", "asc"]
+      }
+    },
+    "mappings": {
+      "properties": {field: {"type": "long"} for field in SALES_FIELDS}
+    }
+  }
+  es.indices.create(index=index, body=settings)
+  previous = index_settings(es, index)
+  es.indices.put_settings(index=index, body={"index": {"number_of_replicas": 0,
+                                                       "refresh_interval": "-1"}})
+  return previous
+
+def index_settings(es, index="products"):
+  # The replicas and refresh interval in effect, set on the index or else the default
+  result = es.indices.get_settings(index=index, include_defaults=True)[index]
+  def setting(name):
+    for scope in ("settings", "defaults"):
+      value = result.get(scope, {}).get("index", {}).get(name)
+      if value is not None:
+        return value
+    return None
+  return {"number_of_replicas": setting("number_of_replicas"),
+          "refresh_interval": setting("refresh_interval")}
+
+def restore_index_settings(es, index="products", previous=None):
+  # Turn replicas and refreshes back on with the values from before the load (None resets a setting
+  # to the cluster default)
+  previous = previous or {"number_of_replicas": None, "refresh_interval": None}
+  es.indices.put_settings(index=index, body={"index": previous})
+  es.indices.refresh(index=index)
+
+""" STEP 1.1: TYPED DOCUMENTS AND PARALLEL BULK """
+
+def typed_documents(path="sales.csv", index="products", chunksize=100000):
+  # csv.DictReader gives every field as a string that ES has to parse again, here they are longs
+  for chunk in pd.read_csv(path, usecols=lambda column: column in SALES_FIELDS, dtype="int64",
+                           chunksize=chunksize):
+    columns = list(chunk.columns)
+    for row in chunk.itertuples(index=False, name=None):
+      yield {"_index": index, "_source": {field: int(value) for field, value in zip(columns, row)}}
+
+def batches(actions, size):
+  batch = []
+  for action in actions:
+    batch.append(action)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def bulk_load(es, actions, threads=4, chunk_size=5000, max_retries=3, backoff=2.0):
+  # Send the documents with several bulk workers at once. Documents that were rejected because the
+  # cluster was busy (429) are collected and sent again, with a growing pause in between.
+  # parallel_bulk only reports the status of a failed item (not its document when raise_on_error is
+  # off), but it reports the items in the order they were sent. So the actions go in batches that
+  # are kept in memory, and every result is zipped back onto its own action
+  report = {"docs": 0, "failed": 0, "retries": 0, "retry_rounds": 0}
+
+  for batch in batches(actions, threads * chunk_size * 4):
+    pending = batch
+    for attempt in range(max_retries + 1):
+      rejected = []
+      results = helpers.parallel_bulk(es, pending, thread_count=threads, chunk_size=chunk_size,
+                                      raise_on_error=False, raise_on_exception=False)
+      for action, (ok, item) in zip(pending, results):
+        if ok:
+          report["docs"] += 1
+          continue
+        result = next(iter(item.values()))
+        if result.get("status") == 429 and attempt < max_retries:
+          rejected.append(action)
+        else:
+          report["failed"] += 1
+
+      if not rejected:
+        break
+      report["retries"] += len(rejected)
+      report["retry_rounds"] += 1
+      time.sleep(backoff * 2 ** attempt)
+      pending = rejected
+
+  return report
+
+def ingest_sales(es, path="sales.csv", index="products", threads=4, chunk_size=5000, max_retries=3):
+  previous = create_sorted_index(es, index)
+
+  # Whatever happens during the load, the index gets its replicas and refreshes back
+  start = time.perf_counter()
+  try:
+    report = bulk_load(es, typed_documents(path, index), threads, chunk_size, max_retries)
+  finally:
+    restore_index_settings(es, index, previous)
+  report["seconds"] = time.perf_counter() - start
+  report["docs_per_second"] = report["docs"] / report["seconds"] if report["seconds"] else 0.0
+
+  print("loaded {docs} documents in {seconds:.1f}s ({docs_per_second:.0f} docs/s), "
+        "{retries} retried, {failed} failed".format(**report))
+  return report
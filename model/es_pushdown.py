@@ -0,0 +1,191 @@
+# Assignment: Belsimpel warehouse case
+# Steps 1.2 - 1.11 inside Elasticsearch: the margins and dimensions are enriched into the products
+# index, so the avg daily profit, the class boundaries and the base stock are computed by the cluster
+# and only one small row per product comes back
+
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from base_stock import REPLENISH_INTERVAL, CLASS_SERVICE_LEVELS, service_z
+from es_fetch import summary_body, index_summary, partition_plan, too_many_buckets
+from incremental import CLASS_QUANTILES
+from profiling import record, timed_search
+
+PRODUCT_INFO_INDEX = "product_info"
+ENRICH_POLICY = "product_info_policy"
+ENRICH_PIPELINE = "product_info"
+INFO_FIELDS = ["margin", "length", "width", "height"]
+
+""" STEP 1.1: ENRICH THE PRODUCTS INDEX WITH MARGINS AND DIMENSIONS """
+
+# A lookup index with one document per product (margins.csv joined with dimensions.csv), an enrich
+# policy on product_id and an ingest pipeline that copies the fields into "info" of every sales
+# document. The pipeline becomes the default pipeline of the products index, so documents loaded
+# later are enriched as well, and the documents already there are run through it once
+
+def product_info_documents(margins="margins.csv", dimensions="dimensions.csv"):
+  df = pd.read_csv(margins).merge(pd.read_csv(dimensions), on="product_id", how="outer")
+  for row in df.to_dict("records"):
+    yield {key: (None if pd.isna(value) else value) for key, value in row.items()}
+
+def bulk_lines(documents, index, chunk_size=5000):
+  # Plain bulk requests as ndjson, so the same call works on the cluster and on the emulator
+  lines = []
+  for document in documents:
+    lines.append(json.dumps({"index": {"_index": index, "_id": str(int(document["product_id"]))}}))
+    lines.append(json.dumps(document))
+    if len(lines) >= 2 * chunk_size:
+      yield "\n".join(lines) + "\n"
+      lines = []
+  if lines:
+    yield "\n".join(lines) + "\n"
+
+def enrich_products(es, index="products", margins="margins.csv", dimensions="dimensions.csv"):
+  start = time.perf_counter()
+  es.indices.delete(index=PRODUCT_INFO_INDEX, ignore=[400, 404])
+  es.indices.create(index=PRODUCT_INFO_INDEX, body={"mappings": {"properties": dict(
+    {"product_id": {"type": "long"}}, **{field: {"type": "double"} for field in INFO_FIELDS})}})
+  for body in bulk_lines(product_info_documents(margins, dimensions), PRODUCT_INFO_INDEX):
+    es.bulk(body=body)
+  es.indices.refresh(index=PRODUCT_INFO_INDEX)
+
+  # A policy can not be changed while a pipeline uses it, so the pipeline goes first
+  es.ingest.delete_pipeline(id=ENRICH_PIPELINE, ignore=[404])
+  es.enrich.delete_policy(name=ENRICH_POLICY, ignore=[404])
+  es.enrich.put_policy(name=ENRICH_POLICY, body={"match": {
+    "indices": PRODUCT_INFO_INDEX, "match_field": "product_id", "enrich_fields": INFO_FIELDS}})
+  es.enrich.execute_policy(name=ENRICH_POLICY, wait_for_completion=True)
+  es.ingest.put_pipeline(id=ENRICH_PIPELINE, body={
+    "description": "margin and dimensions of the product into info",
+    "processors": [{"enrich": {"policy_name": ENRICH_POLICY, "field": "product_id",
+                               "target_field": "info", "ignore_missing": True}}]})
+
+  es.indices.put_settings(index=index, body={"index": {"default_pipeline": ENRICH_PIPELINE}})
+  result = es.update_by_query(index=index, pipeline=ENRICH_PIPELINE, conflicts="proceed",
+                              slices="auto", wait_for_completion=True, refresh=True)
+  print("enriched %d documents of '%s' with margins and dimensions in %.1fs"
+        % (result["updated"], index, time.perf_counter() - start))
+  return result
+
+def is_enriched(es, index="products"):
+  # Whether the documents carry the enriched fields. The cluster keeps the policy and the enriched
+  # documents, the emulator only within the process that ran enrich_products
+  return es.count(index=index, body={"query": {"exists": {"field": "info.margin"}}})["count"] > 0
+
+""" STEP 1.2 - 1.11: ONE ROW PER PRODUCT FROM THE CLUSTER """
+
+# Per product: the daily histogram stays on the cluster (filter_path drops it from the response),
+# extended_stats_bucket gives the mean and SD over the sold range like step 1.2, and bucket_scripts
+# multiply with the enriched margin (step 1.3), multiply the dimensions (step 1.4) and compute the
+# base stock of every class level (step 1.11). percentiles_bucket over the profits gives the class
+# boundaries of step 1.6
+
+def pushdown_body(partition, num_partitions, size, levels=CLASS_SERVICE_LEVELS,
+                  interval=REPLENISH_INTERVAL):
+  product_aggs = {
+    "days": {"histogram": {"field": "day", "interval": 1}},
+    "stats": {"extended_stats_bucket": {"buckets_path": "days._count", "gap_policy": "insert_zeros"}},
+    "margin": {"max": {"field": "info.margin"}},
+    "length": {"max": {"field": "info.length"}},
+    "width": {"max": {"field": "info.width"}},
+    "height": {"max": {"field": "info.height"}},
+    "profit": {"bucket_script": {"buckets_path": {"avg": "stats.avg", "margin": "margin"},
+                                 "script": "params.avg * params.margin"}},
+    "volume": {"bucket_script": {"buckets_path": {"l": "length", "w": "width", "h": "height"},
+                                 "script": "params.l * params.w * params.h"}},
+  }
+  for label, z in enumerate(service_z(levels)):
+    product_aggs["base_stock_%d" % label] = {"bucket_script": {
+      "buckets_path": {"avg": "stats.avg", "sd": "stats.std_deviation"},
+      "script": {"source": "params.avg * params.interval + params.z * params.sd * "
+                           "Math.sqrt(params.interval)",
+                 "params": {"z": float(z), "interval": interval}}}}
+  terms = {"field": "product_id", "size": size, "order": {"_key": "asc"}}
+  if num_partitions > 1:
+    terms["include"] = {"partition": partition, "num_partitions": num_partitions}
+  return {"size": 0, "aggs": {
+    "products": {"terms": terms, "aggs": product_aggs},
+    "boundaries": {"percentiles_bucket": {"buckets_path": "products>profit",
+                                          "percents": [100 * q for q in CLASS_QUANTILES]}}}}
+
+PUSHDOWN_FILTER = ["took", "aggregations.boundaries", "aggregations.products.sum_other_doc_count",
+                   "aggregations.products.buckets.key", "aggregations.products.buckets.doc_count",
+                   "aggregations.products.buckets.stats.avg",
+                   "aggregations.products.buckets.stats.std_deviation",
+                   "aggregations.products.buckets.margin", "aggregations.products.buckets.profit",
+                   "aggregations.products.buckets.volume",
+                   "aggregations.products.buckets.base_stock_*"]
+
+def value(bucket, name):
+  return (bucket.get(name) or {}).get("value")
+
+def decode_rows(result, levels):
+  # The rows of one response, and whether the terms size cut off products
+  aggregation = result["aggregations"]["products"]
+  rows = [[bucket["key"], bucket["doc_count"], bucket["stats"]["avg"],
+           bucket["stats"]["std_deviation"], value(bucket, "margin"), value(bucket, "profit"),
+           value(bucket, "volume")] + [value(bucket, "base_stock_%d" % label)
+                                       for label in range(len(levels))]
+          for bucket in aggregation.get("buckets", [])]
+  return rows, aggregation.get("sum_other_doc_count", 0) > 0
+
+def fetch_rows(es, index, partition, num_partitions, size, levels):
+  # Like es_fetch.fetch_partition: split a partition with too many buckets, grow a cut off size
+  start = time.perf_counter()
+  try:
+    result = es.search(index=index, body=pushdown_body(partition, num_partitions, size, levels),
+                       filter_path=PUSHDOWN_FILTER)
+  except Exception as error:
+    if not too_many_buckets(error):
+      raise
+    return (fetch_rows(es, index, partition, 2 * num_partitions, size, levels) +
+            fetch_rows(es, index, partition + num_partitions, 2 * num_partitions, size, levels))
+  seconds = time.perf_counter() - start
+  rows, cut_off = decode_rows(result, levels)
+  if cut_off:
+    return fetch_rows(es, index, partition, num_partitions, 2 * size, levels)
+  boundaries = (result["aggregations"].get("boundaries") or {}).get("values")
+  return [(rows, boundaries, result.get("took", 0) / 1000, seconds, len(json.dumps(result)))]
+
+def nearest_rank(values, quantiles):
+  # The percentiles_bucket rule: the sorted value at rank round(q * (n - 1))
+  values = np.sort(values[~np.isnan(values)])
+  if len(values) == 0:
+    return [np.nan] * len(quantiles)
+  return [float(values[int(np.floor(q * (len(values) - 1) + 0.5))]) for q in quantiles]
+
+def pushdown_statistics(es, index="products", partition_buckets=50000, concurrency=8,
+                        levels=CLASS_SERVICE_LEVELS):
+  # One row per product with the avg, SD, margin, avg daily profit, volume and the base stock of
+  # every class level, plus the bin ranges [min, 50%, 80%, max] of the avg daily profit. Large
+  # catalogs are split in terms partitions (like es_fetch); the boundaries of percentiles_bucket are
+  # then per partition, so they are taken with the same nearest rank rule over all returned rows
+  num_partitions, size = partition_plan(index_summary(timed_search(es, index=index,
+                                                                   body=summary_body())),
+                                        partition_buckets)
+  parts = []
+  with ThreadPoolExecutor(max_workers=max(1, min(concurrency, num_partitions))) as pool:
+    futures = [pool.submit(fetch_rows, es, index, partition, num_partitions, size, levels)
+               for partition in range(num_partitions)]
+    for future in as_completed(futures):
+      for rows, boundaries, took, seconds, payload in future.result():
+        record(es_requests=1, es_took_seconds=took, es_client_seconds=seconds,
+               response_bytes=payload, buckets=len(rows), partitions=1)
+        parts.append((rows, boundaries))
+
+  columns = (["product_id", "total_orders", "avg_orders_per_day", "standard_deviation", "margin",
+              "avg_daily_profit", "volume"] + ["base_stock_%d" % label for label in range(len(levels))])
+  df = pd.DataFrame([row for rows, _ in parts for row in rows], columns=columns, dtype=np.float64)
+  df["product_id"] = df["product_id"].astype(np.int64)
+  df = df.sort_values("product_id").reset_index(drop=True)
+
+  profit = df["avg_daily_profit"].to_numpy()
+  if len(parts) == 1 and parts[0][1]:
+    middle = [parts[0][1][str(float(100 * q))] for q in CLASS_QUANTILES]
+  else:
+    middle = nearest_rank(profit, CLASS_QUANTILES)
+  bin_ranges = [float(np.nanmin(profit))] + [float(x) for x in middle] + [float(np.nanmax(profit))]
+  return df, bin_ranges
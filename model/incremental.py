@@ -0,0 +1,180 @@
+# Assignment: Belsimpel warehouse case
+# Incremental daily update of the demand statistics, product classes and base stock levels
+
+
+import numpy as np
+import pandas as pd
+from base_stock import REPLENISH_INTERVAL, CLASS_SERVICE_LEVELS, service_z
+from demand_matrix import safe_divide
+
+""" STEP 1.6 / 1.11: CLASSES AND BASE STOCK FROM THE STATISTICS """
+
+# The classes are cut at the 50% and 80% quantiles of the avg daily profit (see bin_finder), and
+# the base stock uses the service level of the class (see compute_base_stock_level)
+CLASS_QUANTILES = (0.5, 0.8)
+
+def class_labels(profit, boundaries):
+  # Same classes as pd.cut on [min, q50, q80, max]: (min, q50] -> 0, (q50, q80] -> 1 and
+  # (q80, max] -> 2. The lowest profit itself falls outside the first bin of pd.cut and goes to
+  # class 0 as well.
+  # Products without a profit (no margin) get -1
+  labels = np.searchsorted(boundaries[1:-1], profit, side="left")
+  return np.where(np.isnan(profit), -1, labels)
+
+def base_stock_levels(mean, std, labels):
+  # Same formula as compute_base_stock_level, NaN for products without a class
+  avg_demand = mean * REPLENISH_INTERVAL
+  sd_demand = std * REPLENISH_INTERVAL ** (1/2)
+  z = np.append(service_z(CLASS_SERVICE_LEVELS), np.nan)[labels] # Index -1 is the NaN
+  return avg_demand + z * sd_demand
+
+def sorted_quantile(values, q):
+  # Quantile with linear interpolation (like pandas and numpy) of an already sorted array, only
+  # looking at the two values around the quantile
+  index = (len(values) - 1) * q
+  below = int(np.floor(index))
+  return float(np.quantile(values[below:below + 2], index - below))
+
+""" RUNNING STATE PER PRODUCT """
+
+class IncrementalStatistics:
+  # Per product the first and last day it was sold, the total orders and the sum of squared daily
+  # orders. Every statistic of df_product_orders_per_day follows from these (the days in between
+  # that have no orders only add to the number of days), so a new day of sales only touches the
+  # products sold that day. The avg daily profits are also kept sorted, so the class boundaries and
+  # the products that change class can be found without sorting everything again
+  def __init__(self, product_ids, first_day, last_day, total, squares, margins):
+    self.product_ids = np.asarray(product_ids, dtype=np.int64)
+    self.position = pd.Index(self.product_ids)
+    self.first_day = np.asarray(first_day, dtype=np.int64)
+    self.last_day = np.asarray(last_day, dtype=np.int64)
+    self.total = np.asarray(total, dtype=np.int64)
+    self.squares = np.asarray(squares, dtype=np.int64)
+    self.margins = margins # Series of margin per product_id
+    self.margin = self.product_margins(self.product_ids)
+
+    self.mean, self.std, self.profit = self.statistics(np.arange(len(self.product_ids)))
+    known = np.flatnonzero(~np.isnan(self.profit))
+    order = np.lexsort((known, self.profit[known])) # On profit, ties on row number
+    self.sorted_rows = known[order]
+    self.sorted_profit = self.profit[self.sorted_rows]
+    self.boundaries = self.class_boundaries()
+    self.labels = class_labels(self.profit, self.boundaries)
+    self.base_stock = base_stock_levels(self.mean, self.std, self.labels)
+    self.last_update = int(self.last_day.max()) if len(self.last_day) else None
+
+  @classmethod
+  def from_matrix(cls, matrix, margins):
+    # The full recompute: the state of a whole DemandMatrix at once
+    total = matrix.total()
+    squares = matrix.sum_of_squares().astype(np.int64)
+    return cls(matrix.product_ids, matrix.days[0] + matrix.first_sold,
+               matrix.days[0] + matrix.last_sold, total, squares, margins)
+
+  def product_margins(self, product_ids):
+    return pd.Series(product_ids).map(self.margins).to_numpy(dtype=np.float64)
+
+  def statistics(self, rows):
+    # Mean and population std over the days between the first and last sale, like
+    # extended_stats_bucket with insert_zeros (and the same arithmetic as DemandMatrix.mean/std)
+    n = self.last_day[rows] - self.first_day[rows] + 1
+    mean = safe_divide(self.total[rows], n)
+    std = np.sqrt(np.maximum(safe_divide(self.squares[rows], n) - mean ** 2, 0))
+    return mean, std, mean * self.margin[rows]
+
+  def class_boundaries(self):
+    # [min, q50, q80, max] of the avg daily profit, like bin_finder
+    values = self.sorted_profit
+    if len(values) == 0:
+      return np.full(len(CLASS_QUANTILES) + 2, np.nan)
+    return np.array([values[0]] + [sorted_quantile(values, q) for q in CLASS_QUANTILES]
+                    + [values[-1]])
+
+  # Daily update
+
+  def add_products(self, product_ids):
+    # Products that are sold for the first time are added at the end, without statistics yet
+    n = len(product_ids)
+    self.product_ids = np.r_[self.product_ids, product_ids]
+    self.position = pd.Index(self.product_ids)
+    self.first_day = np.r_[self.first_day, np.zeros(n, dtype=np.int64)]
+    self.last_day = np.r_[self.last_day, np.full(n, -1, dtype=np.int64)]
+    self.total = np.r_[self.total, np.zeros(n, dtype=np.int64)]
+    self.squares = np.r_[self.squares, np.zeros(n, dtype=np.int64)]
+    self.margin = np.r_[self.margin, self.product_margins(product_ids)]
+    for name in ("mean", "std", "profit", "base_stock"):
+      setattr(self, name, np.r_[getattr(self, name), np.full(n, np.nan)])
+    self.labels = np.r_[self.labels, np.full(n, -1)]
+
+  def add_day(self, day, product_ids):
+    # product_ids has one entry per order of this day (like the rows of sales.csv). Days must come
+    # in order; the work depends on the number of new rows, not on the length of the history
+    if self.last_update is not None and day <= self.last_update:
+      raise ValueError("day %d is not after the last day %d" % (day, self.last_update))
+    self.last_update = day
+    sold, orders = np.unique(np.asarray(product_ids, dtype=np.int64), return_counts=True)
+    if len(sold) == 0:
+      return sold
+
+    rows = self.position.get_indexer(sold)
+    new = rows < 0
+    if new.any():
+      self.add_products(sold[new])
+      rows = self.position.get_indexer(sold)
+    # New products and products of from_matrix that were never sold (an empty range) start today
+    self.first_day[rows[self.total[rows] == 0]] = day
+    self.last_day[rows] = day
+    self.total[rows] += orders
+    self.squares[rows] += orders ** 2
+
+    self.remove_sorted(rows)
+    self.mean[rows], self.std[rows], self.profit[rows] = self.statistics(rows)
+    self.insert_sorted(rows)
+
+    # Only products between the old and the new position of a boundary can change class
+    old_boundaries = self.boundaries
+    self.boundaries = self.class_boundaries()
+    changed = [rows]
+    for old, new in zip(old_boundaries[1:-1], self.boundaries[1:-1]):
+      if np.isnan(old):
+        changed.append(self.sorted_rows)
+        continue
+      start = np.searchsorted(self.sorted_profit, min(old, new), side="left")
+      stop = np.searchsorted(self.sorted_profit, max(old, new), side="right")
+      changed.append(self.sorted_rows[start:stop])
+    changed = np.unique(np.concatenate(changed))
+    self.labels[changed] = class_labels(self.profit[changed], self.boundaries)
+    self.base_stock[changed] = base_stock_levels(self.mean[changed], self.std[changed],
+                                                 self.labels[changed])
+    return self.product_ids[changed]
+
+  def sorted_positions(self, rows, profit):
+    # Position of (profit, row) in the sorted profits: find the run of equal profits, then the row
+    start = np.searchsorted(self.sorted_profit, profit, side="left")
+    stop = np.searchsorted(self.sorted_profit, profit, side="right")
+    return np.array([a + np.searchsorted(self.sorted_rows[a:b], row)
+                     for row, a, b in zip(rows.tolist(), start.tolist(), stop.tolist())],
+                    dtype=np.int64)
+
+  def remove_sorted(self, rows):
+    rows = rows[~np.isnan(self.profit[rows])]
+    at = self.sorted_positions(rows, self.profit[rows])
+    self.sorted_rows = np.delete(self.sorted_rows, at)
+    self.sorted_profit = np.delete(self.sorted_profit, at)
+
+  def insert_sorted(self, rows):
+    rows = rows[~np.isnan(self.profit[rows])]
+    rows = rows[np.lexsort((rows, self.profit[rows]))]
+    at = self.sorted_positions(rows, self.profit[rows])
+    self.sorted_rows = np.insert(self.sorted_rows, at, rows)
+    self.sorted_profit = np.insert(self.sorted_profit, at, self.profit[rows])
+
+  # Results
+
+  def frame(self):
+    # One row per product, sorted on product_id
+    df = pd.DataFrame({"product_id": self.product_ids, "avg_orders_per_day": self.mean,
+                       "standard_deviation": self.std, "margin": self.margin,
+                       "avg_daily_profit": self.profit, "binned": self.labels,
+                       "base_stock": self.base_stock})
+    return df.sort_values("product_id").reset_index(drop=True)
@@ -3,36 +3,125 @@
 # Assignment: Belsimpel warehouse case
 
 
-from elasticsearch import Elasticsearch, helpers
-import urllib3
-import warnings
 import csv
-import pandas as pd
-import matplotlib
-import matplotlib.pyplot as plt
 import json
+import os
+import pandas as pd
 import numpy as np
-from gurobipy import Model, GRB, quicksum
-import seaborn as sns
-matplotlib.use('TkAgg') #errorsolving
+from demand_engine import read_daily_counts, total_demand_frame, orders_per_day_frame, transposed_frame
+from es_fetch import fetch_daily_counts, fetch_daily_counts_partitioned, fetch_daily_counts_asyncio
+from es_client import shared_client
+from es_pushdown import enrich_products, is_enriched, pushdown_statistics
+from allocation import solve_colocated_allocation
+from incremental import IncrementalStatistics
+from rolling import ROLLING_WINDOWS, RollingWindows, window_frame, windows_frame
+from base_stock import (REPLENISH_INTERVAL, SERVICE_LEVELS, CLASS_SERVICE_LEVELS, service_z,
+                        base_stock_curve, class_base_stock)
+from charts import CHARTS, draw_chart, render_charts
+from bootstrap import profit_confidence
+from simulation import simulate_fill_rates
+from scenarios import scenario_sweep
+from warehouses import TWO_WAREHOUSES, warehouse_losses, warehouse_capacities, solve_warehouses
+from correlation import (correlated_pairs, approximate_correlated_pairs, pairs_to_product_ids,
+                         full_correlations)
+from demand_store import es_source_state, csv_source_state, save_demand_matrix, load_demand_matrix
+from profiling import profiled, record
+from stage_cache import StageCache, cached_stage, file_fingerprint, es_index_fingerprint
+
+# Where the daily demand comes from: "elasticsearch" (the products index) or "native" (sales.csv)
+DEMAND_BACKEND = os.environ.get("BELSIMPEL_DEMAND_BACKEND", "elasticsearch")
+SALES_CSV = os.environ.get("BELSIMPEL_SALES_CSV", "sales.csv")
+# Directory of the stored product x day demand matrix, set it to an empty string to disable the cache
+DEMAND_CACHE_DIR = os.environ.get("BELSIMPEL_DEMAND_CACHE", "demand_cache")
+# Solver for step 2.4: "dp", "branch_and_bound", "greedy" or "gurobi" (needs a license)
+ALLOCATION_BACKEND = os.environ.get("BELSIMPEL_ALLOCATION_BACKEND", "dp")
+# Limits for the gurobi backend (empty means the Gurobi default)
+GUROBI_OPTIONS = {option: kind(os.environ[variable]) for option, variable, kind in [
+  ("time_limit", "BELSIMPEL_GUROBI_TIME_LIMIT", float), ("mip_gap", "BELSIMPEL_GUROBI_MIP_GAP", float),
+  ("threads", "BELSIMPEL_GUROBI_THREADS", int)] if os.environ.get(variable)}
+# JSON file with a list of warehouses for step 2.6 (see warehouses.py), empty means the two of the case
+WAREHOUSES_FILE = os.environ.get("BELSIMPEL_WAREHOUSES", "")
+# Directory for the charts (see render_report)
+CHART_DIR = os.environ.get("BELSIMPEL_CHART_DIR", "charts")
+# sales.csv to serve the Elasticsearch queries from in-process (es_emulator.py), empty means the cluster
+ES_EMULATOR = os.environ.get("BELSIMPEL_ES_EMULATOR", "")
+# How the demand is fetched from Elasticsearch: "partitioned" (concurrent terms partitions, threads),
+# "async" (the same on asyncio) or "composite" (one composite aggregation page after the other)
+ES_FETCH = os.environ.get("BELSIMPEL_ES_FETCH", "partitioned")
+# Partitions in flight at the same time, and the buckets one partition may return (keep it below
+# search.max_buckets of the cluster)
+ES_CONCURRENCY = int(os.environ.get("BELSIMPEL_ES_CONCURRENCY", 8))
+ES_PARTITION_BUCKETS = int(os.environ.get("BELSIMPEL_ES_PARTITION_BUCKETS", 50000))
+# Compute the profit, classes and base stock inside Elasticsearch (es_pushdown.py, run
+# enrich_product_index() once first), so only one row per product comes back
+PUSHDOWN = os.environ.get("BELSIMPEL_PUSHDOWN", "0") == "1"
+# Number of (product, day) buckets per composite aggregation page
+ES_PAGE_SIZE = int(os.environ.get("BELSIMPEL_ES_PAGE_SIZE", 10000))
+
+def pyplot():
+  # matplotlib (and its backend) is only loaded when a chart is drawn
+  import matplotlib.pyplot as plt
+  return plt
+
+def show_chart(name, data, save=False, figsize=(10, 6)):
+  # Draw one chart of charts.py and show it, or save it into CHART_DIR
+  fig = draw_chart(name, data, figsize)
+  if save:
+    os.makedirs(CHART_DIR, exist_ok=True)
+    fig.savefig(os.path.join(CHART_DIR, CHARTS[name][1]))
+    pyplot().close(fig)
+  else:
+    pyplot().show()
 
 """ STEP 1.1: CREATE INDEX AND GATHER TOTAL DEMAND """
 
 def elasticsearch_setup():
-  # Disable annoying warnings before the start of the code:
-  urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-  warnings.filterwarnings("ignore", category=DeprecationWarning)
-  warnings.filterwarnings("ignore", category=UserWarning)
-
-  # Load in elasticsearch client
-  es = Elasticsearch("https://localhost:9200", ca_certs=False, verify_certs=False,
-                     http_auth=('elastic', 'j3nfTPHpJxz5iYTVMu8V'))
-  return es
+  # One pooled client for the whole run (es_client.py), every step reuses its open connections.
+  # Offline runs answer the same queries from the csv files, without a cluster
+  return shared_client(ES_EMULATOR)
 
 # elasticsearch_setup()
 
-def create_product_index():
+def settings_source():
+  # The module settings that change what a step returns. They are read on every call, so changing
+  # e.g. main.PUSHDOWN or main.ALLOCATION_BACKEND in a session does not give an old result
+  return (DEMAND_BACKEND, SALES_CSV, ES_EMULATOR, ES_FETCH, PUSHDOWN, ALLOCATION_BACKEND,
+          tuple(sorted(GUROBI_OPTIONS.items())), WAREHOUSES_FILE)
+
+# Results of the step functions are cached per input state, so every query and join runs once per run
+STAGE_CACHE = StageCache(max_entries=int(os.environ.get("BELSIMPEL_STAGE_CACHE_SIZE", 64)),
+                         enabled=os.environ.get("BELSIMPEL_STAGE_CACHE", "1") != "0",
+                         settings=settings_source)
+
+def demand_source():
+  # Fingerprint of wherever the daily demand comes from (see DEMAND_BACKEND)
+  if DEMAND_BACKEND == "native":
+    return file_fingerprint(SALES_CSV)
+  return es_index_fingerprint(elasticsearch_setup(), "products")
+
+def margins_source():
+  return file_fingerprint("margins.csv")
+
+def dimensions_source():
+  return file_fingerprint("dimensions.csv")
+
+def invalidate_stages(*stages):
+  # Drop cached results explicitly, e.g. after the index is reloaded (no names means everything)
+  STAGE_CACHE.invalidate(*stages)
+
+@profiled()
+def create_product_index(fast=True, threads=4, chunk_size=5000):
   es = elasticsearch_setup() # Call from es function
+
+  # Fast mode: typed documents, parallel bulk workers, a sorted index and no replicas/refreshes while
+  # loading (see es_ingest.py). It prints the docs/s and the number of retried documents
+  if fast:
+    from es_ingest import ingest_sales
+    ingest_sales(es, SALES_CSV, "products", threads=threads, chunk_size=chunk_size)
+    print("index 'products' is created")
+    invalidate_stages()
+    return
+
   # Define the mapping of the index to be created
   settings = {
     "mappings": {
@@ -54,6 +143,7 @@ def create_product_index():
   es.indices.create(index="products", body=settings)
 
   # Load the csv file into the elastic index using bulk command
+  from elasticsearch import helpers
   with open('sales.csv') as f:
     reader = csv.DictReader(f)
     helpers.bulk(es, reader, index='products')
@@ -61,145 +151,141 @@ def create_product_index():
   # Confirm that the index with product orders per day is created
   print("index 'products' is created")
 
+  # Everything that was computed from the old index is out of date now
+  invalidate_stages()
+
   # To delete the index, uncomment the following line
   # es.indices.delete(index='products', ignore=[400, 404])
 
 # create_product_index() #disabled, because you only need to run create index once
 
+@profiled()
+def enrich_product_index():
+  # Margins and dimensions into every document of the products index (enrich policy + pipeline)
+  enrich_products(elasticsearch_setup(), "products", "margins.csv", "dimensions.csv")
+  invalidate_stages()
+
+# enrich_product_index() #disabled, only needed once after the index is created (for PUSHDOWN)
+
+def pushdown(window=None):
+  # The server side statistics cover the whole history of the products index
+  return PUSHDOWN and window is None and DEMAND_BACKEND != "native"
+
+@profiled("server_side_statistics")
+@cached_stage(STAGE_CACHE, "server_side_statistics", [demand_source, margins_source, dimensions_source])
+def server_side_statistics():
+  # One row per product (avg, SD, margin, avg daily profit, volume, base stock per class level) and
+  # the bin ranges, computed by the cluster
+  es = elasticsearch_setup()
+  # A new process on the emulator (or a cluster where enrich_product_index() never ran) has no
+  # margins in the documents yet, so they are enriched first
+  if not is_enriched(es, "products"):
+    enrich_products(es, "products", "margins.csv", "dimensions.csv")
+  return pushdown_statistics(es, "products", ES_PARTITION_BUCKETS, ES_CONCURRENCY)
+
+def server_orders_per_day():
+  # The server rows in the shape of orders_per_day_frame: "index" is the position in the terms order
+  # (doc_count desc, product_id asc) and the rows are sorted on the avg, so the steps that pick
+  # columns by position or line up on the row index get the same frame as without pushdown
+  df = server_side_statistics()[0]
+  df = df.iloc[np.lexsort((df["product_id"], -df["total_orders"]))].reset_index(drop=True)
+  return df.sort_values("avg_orders_per_day", ascending=False).reset_index(drop=False)
+
+@profiled()
+def demand_matrix():
+  # All steps from 1.2 to 1.15 start from this DemandMatrix: the orders per product per day as one
+  # zero-filled array, with maps from product_id and day to its rows and columns (demand_matrix.py)
+
+  # Check in which state the source is, a stored matrix is only used if it was built from that state
+  if DEMAND_BACKEND == "native":
+    source = csv_source_state(SALES_CSV)
+  else:
+    source = es_source_state(elasticsearch_setup(), "products")
+
+  # Load the product x day order counts memory mapped from disk, that takes milliseconds
+  if DEMAND_CACHE_DIR:
+    cached = load_demand_matrix(DEMAND_CACHE_DIR, source)
+    if cached is not None:
+      return cached
+
+  # Otherwise build the matrix from sales.csv or from the aggregations (see ES_FETCH) and store it
+  if DEMAND_BACKEND == "native":
+    matrix = read_daily_counts(SALES_CSV)
+  elif ES_FETCH == "composite":
+    matrix = fetch_daily_counts(elasticsearch_setup(), "products", ES_PAGE_SIZE)
+  elif ES_FETCH == "async":
+    matrix = fetch_daily_counts_asyncio(ES_EMULATOR, "products", ES_PARTITION_BUCKETS, ES_CONCURRENCY)
+  else:
+    matrix = fetch_daily_counts_partitioned(elasticsearch_setup(), "products", ES_PARTITION_BUCKETS,
+                                            ES_CONCURRENCY)
+  if DEMAND_CACHE_DIR:
+    save_demand_matrix(DEMAND_CACHE_DIR, matrix, source)
+  return matrix
+
+# demand_matrix()
+
+@profiled("df_total_demand_per_product")
+@cached_stage(STAGE_CACHE, "df_total_demand_per_product", [demand_source])
 def df_total_demand_per_product():
-  es = elasticsearch_setup() # Call from es function
-
-  #Perform a terms aggregation to display the buckets for the product orders per day (730),
-  search_body = {
-    "size": 0,
-    "aggs": {
-      "total_product_demand": {
-        "terms": {
-          "field": "product_id",
-          "size": 1200
-          },
-          "aggs": {
-            "transactions_per_day": {
-              "histogram": {
-                "field": "day",
-                "interval": 1
-            }
-          }
-        }
-      }
-    }
-  }
-  # Note: 1200 is the total number of keys that could possibly be in a bucket because it is the
-  # total product number available. However, ES/kibana will not allow that many results you have
-  # to it with the set.max.buckets command
+  # The [product_id, day, orders] rows per product, from the first to the last day it was sold. This
+  # used to be a terms aggregation with "size": 1200, which silently dropped the products after 1200
+  return total_demand_frame(demand_matrix())
 
-  # Print the number of orders per product of the above query
-  result = es.search(index="products", body=search_body)
-
-  # Print number of orders per product as we discovered using the query
-  print("query results: ",  json.dumps(result, indent=1))
-
-  # Make a list of products per day
-  orders_per_day = []
-
-  # Iterate over bucket and subbucket to append their data to the empty list of lists
-  for bucket in result["aggregations"]["total_product_demand"]["buckets"]: #iterate the "products"
-    id_count = bucket["key"] #create a list to be included in the above list of lists
-    for bucket in bucket["transactions_per_day"]["buckets"]: #iterate over the sub-buckets
-      orders_per_day.append([id_count, bucket["key"], bucket["doc_count"]]) #append the data
-
-  # Put list into dataframe and print them sorted by product_id
-  df = pd.DataFrame(orders_per_day, columns=["product_id", "day", "orders"])
-  df.sort_values(by=["product_id"], inplace=True)
-  return(df)
-
-df_total_demand_per_product()
+# df_total_demand_per_product()
 
 """ STEP 1.2: AVERAGE AND SD OF DEMAND PER DAY """
 
-def df_product_orders_per_day():
-  es = elasticsearch_setup() # Call from es function
-
-  # Perform a terms aggregation to display the buckets for the product orders per day (730)/stats
-  search_body = {
-    "size": 0,
-    "aggs": {
-      "total_product_demand": {
-        "terms": {
-          "field": "product_id",
-          "size": 1263
-        },
-        "aggs": {
-          "transactions_per_day": {
-            "histogram": {
-              "field": "day",
-              "interval": 1,
-            }
-          },
-          "data_description_per_product": {
-            "extended_stats_bucket": {
-              "buckets_path": "transactions_per_day._count",
-              "gap_policy": "insert_zeros"
-            }
-          }
-        }
-      }
-    }
-  }
-  # I added stats bucket in order to count the average number of orders per day per product & other stats
-
-  # Print the number of orders per product of the above query
-  result = es.search(index="products", body=search_body)
-
-  # Make a list of average per product
-  statistics_per_product = []
-
-  # Iterate over bucket and subbucket to append their data to the empty list of lists
-  for bucket in result["aggregations"]["total_product_demand"]["buckets"]: #iterate the products
-    product_id = bucket["key"]
-    statistics_per_product.append([product_id,
-                                   bucket["data_description_per_product"]["avg"],
-                                   bucket["data_description_per_product"]["std_deviation"]])
-
-  print("query results: ",  json.dumps(result, indent=1))
-
-  # Put list into dataframe and print them sorted by highest average order per day
-  df = pd.DataFrame(statistics_per_product, columns=["product_id", "avg_orders_per_day", "standard_deviation"])
-  df = df.sort_values("avg_orders_per_day", ascending=False).reset_index(drop=False)
+@profiled("df_product_orders_per_day")
+@cached_stage(STAGE_CACHE, "df_product_orders_per_day", [demand_source])
+def df_product_orders_per_day(window=None):
+  # The mean and SD per product come from the demand matrix. This gives the same numbers as the
+  # extended_stats_bucket (gap_policy insert_zeros) per product, but for every product instead of the
+  # 1263 that fitted into one terms aggregation. With a window (e.g. 90) only the last days count,
+  # with the same rule: the sold range of the product, clipped to the window
+  if window:
+    df = window_frame(demand_matrix(), window)
+  else:
+    df = orders_per_day_frame(demand_matrix())
   print(df)
   return df
 
-df_product_orders_per_day()
+# df_product_orders_per_day()
+
+# Statistics over the last 90/180/365 days (or other windows) of every product at once, all from one
+# pass over the demand matrix. The steps below take a window as well, e.g. profit_computation(90) or
+# compute_base_stock_level(180) to tune the classes and base stock on recent demand only
+@profiled("rolling_window_statistics")
+@cached_stage(STAGE_CACHE, "rolling_window_statistics", [demand_source, margins_source])
+def rolling_window_statistics(windows=ROLLING_WINDOWS):
+  margins = pd.read_csv("margins.csv").set_index("product_id")["margin"]
+  return windows_frame(demand_matrix(), margins, windows)
+
+# rolling_window_statistics()
 
 def plot_errorbar_avg_demand():
-  df = df_product_orders_per_day() # Call df from above function
-
-  # Give the parameters for the errorbar plot
-  x = df.index
-  y = df["avg_orders_per_day"]
-  yerror = df["standard_deviation"]
-
-  # Plot and save the data onto an errorbar
-  plt.errorbar(x=x, y=y, yerr=yerror, color="red", fmt="o", ecolor="black", elinewidth=0.3,
-               capsize=1, errorevery=5, capthick=0.1)
-  plt.title("Average orders per day with SD error bars")
-  plt.xlabel("Index number")
-  plt.ylabel("Average orders per day")
-  plt.show()
+  show_chart("errorbar_avg_demand", {"orders": df_product_orders_per_day()})
 
 # plot_errorbar_avg_demand()
 
 """ STEP 1.3: PROFIT COMPUTATION """
 
-def profit_computation():
-  df = df_product_orders_per_day() # Call df from above function
+@profiled("profit_computation")
+@cached_stage(STAGE_CACHE, "profit_computation", [demand_source, margins_source])
+def profit_computation(window=None):
+  if pushdown(window):
+    df = server_orders_per_day()[["index", "product_id", "avg_orders_per_day", "standard_deviation",
+                                  "margin", "avg_daily_profit"]]
+    return df.sort_values("avg_daily_profit", ascending=False)
+
+  df = df_product_orders_per_day(window) # Call df from above function
 
   # Make new dataframe from margins.csv
   df2 = pd.read_csv("margins.csv")
 
-  # Add the margin column from dataframe 2 to a new dataframe:
-  margins = df2["margin"]
-  df = pd.concat([df, margins], axis=1, ignore_index=False)
+  # Add the margin column from dataframe 2 to a new dataframe. The rows of df are sorted on demand,
+  # so the margin is looked up by product_id (a concat on the row index mixes up the products)
+  margins = df2.set_index("product_id")["margin"]
+  df["margin"] = df["product_id"].map(margins)
 
   # Multiply the average number of orders per product with the margin per product
   df["avg_daily_profit"] = df["avg_orders_per_day"] * df["margin"]
@@ -210,8 +296,12 @@ def profit_computation():
 
 # profit_computation()
 
-def bin_finder():
-  df = profit_computation() # Call df from function
+@profiled("bin_finder")
+@cached_stage(STAGE_CACHE, "bin_finder", [demand_source, margins_source])
+def bin_finder(window=None):
+  # With pushdown the profits come from the cluster as well. The boundaries are still taken here:
+  # percentiles_bucket uses the nearest rank, and the classes must be the same in both modes
+  df = profit_computation(window) # Call df from function
 
   # Determine the array to put in the bin by determining the the i'th quantile (namely 50, 70, 80)
   bin_ranges = [df.avg_daily_profit.min(), df.avg_daily_profit.quantile(0.5),
@@ -221,20 +311,29 @@ def bin_finder():
 # bin_finder()
 
 def plot_histogram_avg_profit():
-  df = profit_computation()  # Call from functions
-  bin_ranges = bin_finder()
-
-  # Show average profit per product per day in a histogram, input above range for the bin parameter
-  plt.hist(df["avg_daily_profit"], bins=bin_ranges, rwidth=0.95, color="red")
-  plt.title("Average profit per product")
-  plt.ylabel("Number of products")
-  plt.xlabel("Average profit per day")
-  plt.show()
+  # Show average profit per product per day in a histogram, with the bin_finder ranges as bins
+  show_chart("histogram_avg_profit", {"profit": profit_computation(), "bin_ranges": bin_finder()})
 
 # plot_histogram_avg_profit()
 
+@profiled("profit_confidence_intervals")
+@cached_stage(STAGE_CACHE, "profit_confidence_intervals", [demand_source, margins_source])
+def profit_confidence_intervals(replicates=200, confidence=0.95):
+  matrix = demand_matrix()
+  margins = pd.read_csv("margins.csv").set_index("product_id")["margin"]
+
+  # Resample the days of the history to see how certain the avg daily profit of every product is,
+  # and how often it lands in each class. Products near the 50% / 80% cut-offs have no clear class
+  df = profit_confidence(matrix, pd.Series(matrix.product_ids).map(margins), replicates, confidence)
+  print(df[df[["p_class_0", "p_class_1", "p_class_2"]].max(axis=1) < 0.8])
+  return df
+
+# profit_confidence_intervals()
+
 """ STEP 1.4: VOLUME COMPUTATION """
 
+@profiled("volume_computation")
+@cached_stage(STAGE_CACHE, "volume_computation", [dimensions_source])
 def volume_computation():
   # Make new dataframe from margins.csv
   df2 = pd.read_csv("dimensions.csv")
@@ -250,26 +349,21 @@ def volume_computation():
 # volume_computation()
 
 def plot_volume_histogram():
-  df2 = volume_computation() # Call from function
-
-  # Show volume per product per day in a histogram
-  plt.hist(df2["volume"], rwidth=0.95, color="red")
-  plt.title("Product volume ranges")
-  plt.ylabel("Number of products")
-  plt.xlabel("Volume")
-  plt.show()
+  show_chart("volume_histogram", {"volume": volume_computation()})
 
 # plot_volume_histogram()
 
 """ STEP 1.6: PRODUCT CLASSES """
 
-def products_in_each_class():
-  df = profit_computation() # Call from functions
-  bin_ranges = bin_finder()
+@profiled("products_in_each_class")
+@cached_stage(STAGE_CACHE, "products_in_each_class", [demand_source, margins_source])
+def products_in_each_class(window=None):
+  df = profit_computation(window) # Call from functions
+  bin_ranges = bin_finder(window)
 
   # We found the quartiles using the bin_finder() function, so we bin the df accordingly
   df["binned"] = pd.cut(df["avg_daily_profit"], bins=bin_ranges, labels=False) # classes are 0, 1, 2
-  df.at[1262, "binned"] = 0 # There is a NaN value that throws an error
+  df.loc[df["avg_daily_profit"] == bin_ranges[0], "binned"] = 0 # The lowest profit is not in a bin
 
   return df
 
@@ -294,91 +388,43 @@ def print_list_products_in_each_class():
 """ STEP 1.7: PRODUCT CLASS BAR CHARTS """
 
 def plot_product_low_class_chart():
-  df = products_in_each_class() # Call from functions
-
-  # Input the parameters
-  x = df.loc[df["binned"] == 0, "product_id"]
-  height = df.loc[df["binned"] == 0, "avg_daily_profit"]
-
-  # Plot the bar chart for the lower class
-  plt.bar(x, width=3.5, height=height, bottom=0, align="center", color="red")
-  plt.title("Average profits of 0%-50% class")
-  plt.xlabel("Product number")
-  plt.ylabel("Average profits")
-  plt.savefig("/Users/pellemeuzelaar/PycharmProjects/Practical4/bar1.png")
+  # The chart is saved as bar1.png in CHART_DIR
+  show_chart("product_low_class", {"classes": products_in_each_class()}, save=True)
 
 # plot_product_low_class_chart()
 
 def plot_product_middle_class_chart():
-  df = products_in_each_class() # Call from functions
-
-  # Input the parameters
-  x = df.loc[df["binned"] == 1, "product_id"]
-  height = df.loc[df["binned"] == 1, "avg_daily_profit"]
-
-  # Plot the bar chart for the middle class
-  plt.bar(x, width=3.5, height=height, bottom=0, align="center", color ="green")
-  plt.title("Average profits of 50%-80% class")
-  plt.xlabel("Product number")
-  plt.ylabel("Average profits")
-  plt.savefig("/Users/pellemeuzelaar/PycharmProjects/Practical4/bar2.png")
+  show_chart("product_middle_class", {"classes": products_in_each_class()}, save=True)
 
 # plot_product_middle_class_chart()
 
 def plot_product_high_class_chart():
-  df = products_in_each_class() # Call from functions
-
-  # Input the parameters
-  x = df.loc[df["binned"] == 2, "product_id"]
-  height = df.loc[df["binned"] == 2, "avg_daily_profit"]
-
-  # Plot the bar chart for the middle class
-  plt.bar(x, width=3.5, height=height, bottom=0, align="center", color="blue")
-  plt.title("Average profits of 80%-100% class")
-  plt.xlabel("Product number")
-  plt.ylabel("Average profits")
-  plt.savefig("/Users/pellemeuzelaar/PycharmProjects/Practical4/bar3.png")
+  show_chart("product_high_class", {"classes": products_in_each_class()}, save=True)
 
 # plot_product_high_class_chart()
 
 """ STEP 1.8: PROFIT CHART ALL CLASSES """
 
 def plot_profits_per_product_sorted():
-  df = profit_computation()  # Call from functions
-
-  # Define the bar chart for all classes, sorted highest profit first
-  fig, ax = plt.subplots()
-  df.sort_values("avg_daily_profit", ascending=False)["avg_daily_profit"].plot.bar(
-    ax=ax, xticks=df.index, rot=45, stacked=False, color="red")
-
-  # Set x-axis steps
-  ax.set_xticks(np.arange(0, len(df.index) + 1, 100))
-
-  # Plot vertical lines for classes. These are hardcoded: the values are the product_ids that came
-  # from the output of the list_products_per_class function
-
-  print("put 50% marker at: ", df.query("product_id==742")["index"]) #prod. 742 is border, 123 index
-  print("put 80% marker at: ", df.query("product_id==347")["index"]) #prod. 347 is border, 500 index
-  plt.axvline(123, color="k", linestyle="dashed", linewidth=1)
-  plt.axvline(500, color="k", linestyle="dashed", linewidth=1)
-
-  # Set titles and labels and print the boxplot
-  plt.title("Average profits of all products sorted to class")
-  plt.xlabel("Index (not sorted to product number)")
-  plt.ylabel("Average profits")
-  plt.show()
+  # All products sorted highest profit first, with dashed lines at the class boundaries (found from
+  # bin_finder instead of the hardcoded product_ids 742 and 347)
+  show_chart("profits_per_product_sorted", {"profit": profit_computation(),
+                                            "bin_ranges": bin_finder()})
 
 # plot_profits_per_product_sorted()
 
 """ STEP 1.10: AVERAGE AND MEAN DEMAND OVER REPLENISHMENT INTERVAL """
 
-def avg_and_sd_demand_replenish_interval_low_class():
-  df = df_product_orders_per_day() # Call df from the first product function
+@profiled("avg_and_sd_demand_replenish_interval_low_class")
+@cached_stage(STAGE_CACHE, "avg_and_sd_demand_replenish_interval_low_class", [demand_source])
+def avg_and_sd_demand_replenish_interval_low_class(window=None):
+  df = df_product_orders_per_day(window) # Call df from the first product function
 
   # I need to compute the values m and s per product. I have the m and s per product per day.
-  # I only need to multiply by the replenish interval (1 week/7 days)
-  df["avg_demand_replenish_interval"] = df["avg_orders_per_day"] * 7
-  df["sd_demand_replenish_interval"] = (df["standard_deviation"] * 7) ** (1/2)
+  # Over the replenish interval (1 week/7 days) the mean is 7 times as large and the sd (of 7
+  # independent days) sqrt(7) times as large
+  df["avg_demand_replenish_interval"] = df["avg_orders_per_day"] * REPLENISH_INTERVAL
+  df["sd_demand_replenish_interval"] = df["standard_deviation"] * REPLENISH_INTERVAL ** (1/2)
 
   df = pd.concat([df,
                    df["avg_demand_replenish_interval"],
@@ -390,18 +436,34 @@ def avg_and_sd_demand_replenish_interval_low_class():
 
 """ STEP 1.11: COMPUTE BASE STOCK LEVEL """
 
-def compute_base_stock_level():
-  df = avg_and_sd_demand_replenish_interval_low_class() # Call df from the above function
-  df2 = products_in_each_class()
+@profiled("compute_base_stock_level")
+@cached_stage(STAGE_CACHE, "compute_base_stock_level", [demand_source, margins_source])
+def compute_base_stock_level(window=None):
+  if pushdown(window):
+    # The base stock of all three class levels came from the cluster, the class picks one
+    df = server_orders_per_day()
+    df["avg_demand_replenish_interval"] = df["avg_orders_per_day"] * REPLENISH_INTERVAL
+    df["sd_demand_replenish_interval"] = df["standard_deviation"] * REPLENISH_INTERVAL ** (1/2)
+    df["binned"] = df["product_id"].map(products_in_each_class().set_index("product_id")["binned"])
+    for label in range(len(CLASS_SERVICE_LEVELS)):
+      df.loc[df["binned"] == label, "base_stock"] = df["base_stock_%d" % label]
+    return df[["index", "product_id", "avg_orders_per_day", "standard_deviation",
+               "avg_demand_replenish_interval", "sd_demand_replenish_interval", "binned",
+               "base_stock"]].astype(np.float64)
+
+  df = avg_and_sd_demand_replenish_interval_low_class(window) # Call df from the above function
+  df2 = products_in_each_class(window)
 
   # Add the bin variables as column (because we dit not have it in this df yet)
   df = pd.concat([df, df2["binned"]], axis=1, ignore_index=False)
   df = df.T.drop_duplicates().T # Got an error from importing df, because of duplicate columns
 
-  # Make functions for the base stock formula, z changes to 0.9, 0.95 and 0.99 per class
-  base_stock_low = df["avg_demand_replenish_interval"] + 0.90 * df["sd_demand_replenish_interval"]
-  base_stock_medium = df["avg_demand_replenish_interval"] + 0.95 * df["sd_demand_replenish_interval"]
-  base_stock_high = df["avg_demand_replenish_interval"] + 0.99 * df["sd_demand_replenish_interval"]
+  # Make functions for the base stock formula, the service level is 90%, 95% and 99% per class, so
+  # z is the inverse normal of those levels (1.28, 1.64 and 2.33)
+  z_low, z_medium, z_high = service_z(CLASS_SERVICE_LEVELS)
+  base_stock_low = df["avg_demand_replenish_interval"] + z_low * df["sd_demand_replenish_interval"]
+  base_stock_medium = df["avg_demand_replenish_interval"] + z_medium * df["sd_demand_replenish_interval"]
+  base_stock_high = df["avg_demand_replenish_interval"] + z_high * df["sd_demand_replenish_interval"]
 
   # Depending on the bin value (i.e. the class), the base stock is calculated and added to the df
   df.loc[df["binned"] == 0, "base_stock"] = base_stock_low
@@ -412,8 +474,87 @@ def compute_base_stock_level():
 
 # compute_base_stock_level()
 
+@profiled("base_stock_curves")
+@cached_stage(STAGE_CACHE, "base_stock_curves", [demand_source, margins_source])
+def base_stock_curves(mode="parametric", levels=SERVICE_LEVELS):
+  df = products_in_each_class() # Call from previous functions
+  matrix = demand_matrix()
+
+  # The base stock of every product for every service level in the grid: "parametric" assumes normal
+  # demand (mean and sd of step 1.2), "empirical" takes the quantiles of the real 7-day demand
+  levels = sorted(set(levels) | set(CLASS_SERVICE_LEVELS))
+  curve = base_stock_curve(matrix, mode, levels)
+  df_curve = pd.DataFrame(curve, columns=["base_stock_%g" % level for level in levels])
+  df_curve.insert(0, "product_id", matrix.product_ids)
+
+  # Then the target of the product's class (90%, 95% or 99%) gives its base stock
+  classes = df.set_index("product_id")["binned"]
+  df_curve["binned"] = df_curve["product_id"].map(classes)
+  df_curve["base_stock"] = class_base_stock(curve, levels, df_curve["binned"])
+  return df_curve
+
+# base_stock_curves("empirical")
+
+@profiled()
+def simulate_base_stock(mode="bootstrap", cycles=2000):
+  df = compute_base_stock_level() # Call from above functions
+  matrix = demand_matrix()
+
+  # Simulate weekly replenishment up to the base stock with resampled daily demand, to see which fill
+  # rate the levels really give per product and per class
+  df = df.set_index(pd.to_numeric(df["product_id"]).astype(np.int64))
+  base_stock = pd.to_numeric(df["base_stock"]).reindex(matrix.product_ids)
+  classes = pd.to_numeric(df["binned"]).reindex(matrix.product_ids).fillna(-1).astype(int)
+  df_products, df_classes = simulate_fill_rates(matrix, base_stock.to_numpy(), classes.to_numpy(),
+                                                mode, cycles)
+  print(df_classes)
+  return df_products, df_classes
+
+# simulate_base_stock()
+
+""" STEP 1.11 (DAILY): INCREMENTAL UPDATE OF THE STATISTICS """
+
+INCREMENTAL_STATE = None
+ROLLING_STATE = None
+
+def incremental_statistics():
+  # Running totals per product, built once from the full history
+  global INCREMENTAL_STATE
+  if INCREMENTAL_STATE is None:
+    margins = pd.read_csv("margins.csv").set_index("product_id")["margin"]
+    INCREMENTAL_STATE = IncrementalStatistics.from_matrix(demand_matrix(), margins)
+  return INCREMENTAL_STATE
+
+def rolling_windows():
+  # The sums of the last 90/180/365 days per product, built once from the full history
+  global ROLLING_STATE
+  if ROLLING_STATE is None:
+    ROLLING_STATE = RollingWindows.from_matrix(demand_matrix())
+  return ROLLING_STATE
+
+@profiled()
+def add_sales_day(day, product_ids):
+  # A new day of sales (one product_id per order) updates the avg/sd, the bin_finder boundaries,
+  # the classes and the base stock levels of only the products that are affected. The result is
+  # the same as recomputing everything from the full history. The window statistics move one day
+  # as well (see daily_window_statistics)
+  state = incremental_statistics()
+  changed = state.add_day(day, product_ids)
+  rolling_windows().add_day(day, product_ids)
+  print("Updated %d products, class boundaries: %s" % (len(changed), state.boundaries))
+  return state.frame()
+
+def daily_window_statistics():
+  # rolling_window_statistics() including the days added with add_sales_day
+  margins = pd.read_csv("margins.csv").set_index("product_id")["margin"]
+  return rolling_windows().frame(margins)
+
+# add_sales_day(731, pd.read_csv("sales_day_731.csv")["product_id"])
+
 """ STEP 1.12: COMPUTE PICK UP BOXES """
 
+@profiled("pickup_box")
+@cached_stage(STAGE_CACHE, "pickup_box", [dimensions_source])
 def pickup_box():
   df2 = volume_computation() # Call df from the above function
 
@@ -430,101 +571,85 @@ def pickup_box():
 # pickup_box()
 
 def plot_box_number():
-  df2 = pickup_box() # Call from above function
-
-  #Set parameters
-  height = df2["required_boxes"]
-
-  # Show required box number per product in a histogram
-  plt.bar(df2["product_id"], height=height, color="red")
-  plt.title("Number of boxes required per product")
-  plt.ylabel("Number of boxes")
-  plt.xlabel("Products")
-  plt.show()
+  show_chart("box_number", {"boxes": pickup_box()})
 
 # plot_box_number()
 
 """ STEP 1.14: CORRELATION MATRIX """
 
+@profiled("transpose_data")
+@cached_stage(STAGE_CACHE, "transpose_data", [demand_source])
 def transpose_data():
-  df = df_total_demand_per_product() # Call the function from the beginning, with total products/day
+  matrix = demand_matrix() # Same counts as df_total_demand_per_product()
 
   # Tranpose the current df so that it displays the days as columns instead of as a group in one row
-  df2 = df.pivot(index="product_id", columns="day", values="orders").add_prefix("day ").reset_index()
-  df.set_index("product_id") #Fix the dataframe
+  # (built straight from the matrix, so there is no long dataframe to pivot)
+  df2 = transposed_frame(matrix)
   return df2
 
 # transpose_data()
 
-def correlation_matrix():
-  df2 = transpose_data()  # Call from previous function
+@profiled("correlation_values")
+@cached_stage(STAGE_CACHE, "correlation_values", [demand_source])
+def correlation_values():
+  # Correlate the products (rows) with each other over the days. df2.corr() on the transposed data
+  # correlated the day columns instead of the products. The n x n array is read-only, so a cache
+  # hit shares it instead of copying it
+  corr = full_correlations(demand_matrix())
+  corr.flags.writeable = False
+  return corr
 
-  # Plot the data in a matrix in python output
-  corr = df2.corr()
+@profiled()
+def correlation_matrix():
+  matrix = demand_matrix() # Call from previous function
+  corr = pd.DataFrame(correlation_values(), index=matrix.product_ids, columns=matrix.product_ids,
+                      copy=False)
   print(corr)
   return corr
 
 #correlation_matrix():
 
 def plot_correlation_matrix():
-  df = transpose_data() # Call from previous function
-
-  # Plot the above correlation matrix as heatmap
-  fig = plt.figure(figsize=(19, 15))
-  plt.matshow(df.corr(), fignum=fig.number)
-  plt.title("Correlation Matrix", fontsize=16);
-  cb = plt.colorbar()
-  cb.ax.tick_params(labelsize=14)
-  plt.show()
+  show_chart("correlation_matrix", {"corr": correlation_matrix()}, figsize=(19, 15))
 
 # plot_correlation_matrix()
 
 """ STEP 1.15: PRODUCT COUPLES """
 
-def product_couples():
-  corr = correlation_matrix() # Call from previous function
-
-  # Filter the the matrix values to display correlations as a sorted list
-  s = corr.unstack()
-  so = s.sort_values(kind="quicksort")
-  print(so)
-
-  # Make a list that displays
-  df = pd.DataFrame(so, columns=["correlations"])
-
-  # Locate the couples that match the threshold 0.6
-  df.loc[df["correlations"] >= 0.6, "match"] = 1 # If product corr higher than 0.6, input 1 in col
-  df.loc[df["correlations"] <= -0.6, "match"] = 1 # If product has negative 0.6, input 1 in the col
-  df.loc[df["correlations"] < 0.6, "match"] = 0 # If product has lower than 0.6, input 0 in the col
-  df.loc[df["correlations"] == 1, "match"] = 0 # If product is 1 (same values), we don't want them
-
+@profiled("product_couples")
+@cached_stage(STAGE_CACHE, "product_couples", [demand_source])
+def product_couples(threshold=0.6, approximate=False):
+  matrix = demand_matrix() # Call from previous function
+
+  # Standardize the demand once and multiply it in blocks, only the pairs with a correlation of at
+  # least 0.6 (or at most -0.6) come out. A product with itself is not a couple. For very large
+  # catalogs the approximate (LSH) version only checks likely pairs, see bench_correlation.py
+  if approximate:
+    pairs = approximate_correlated_pairs(matrix, threshold)
+  else:
+    pairs = correlated_pairs(matrix, threshold)
+  product_1, product_2, r = pairs_to_product_ids(matrix, pairs)
+
+  # Make a list that displays the couples, strongest correlation first
+  df = pd.DataFrame({"product_id_1": product_1, "product_id_2": product_2, "correlations": r})
+  df = df.sort_values("correlations", ascending=False, key=abs).reset_index(drop=True)
+  print(df)
   return df
 
-  # I WAS NOT ABLE TO TELL WHICH PRODUCTS WERE CORRELATED AND WHICH 1 OF THE 2 WAS IN A HIGH CLASS
-
 # product_couples()
 
 """ STEP 1.16: PRODUCT COUPLES MATRIX """
 
 def plot_product_couples_matrix():
-  df = product_couples() # Call from above function
-  corr = correlation_matrix()
-
-  # Formulate x/y values for the matched products that are to be marked
-  coords = df.loc[df["match"] == 1]
-
-  # Plot a new correlation matrix and input the match as variable in "patch" plot function to get mark
-  fig, ax = plt.subplots()
-  ax = sns.heatmap(corr, annot=True, linewidths=.5, ax=ax)
-  ax.add_patch(plt.Rectangle((coords), 1, 1, fill=True, edgecolor="red", lw=3))
-  plt.show()
-
-# THIS FUNCTION RETURNS NOTHING BECAUSE I FOUND NO MATCHED VARIABLES, IF MATCH = 0 IT WILL WORK
+  # The correlation matrix with every couple marked
+  show_chart("product_couples_matrix", {"corr": correlation_matrix(), "couples": product_couples()})
 
 # plot_product_couples_matrix()
 
 """ STEP 2.1: LOSS IN SALES """
 
+@profiled("loss_in_profit")
+@cached_stage(STAGE_CACHE, "loss_in_profit", [demand_source, margins_source])
 def loss_in_profit():
   df = products_in_each_class() # Call df from function
 
@@ -544,6 +669,8 @@ def loss_in_profit():
 
 """ STEP 2.2: RANKING BASED ON PROFIT LOSS """
 
+@profiled("ranking_on_profit_loss")
+@cached_stage(STAGE_CACHE, "ranking_on_profit_loss", [demand_source, margins_source])
 def ranking_on_profit_loss():
   df = loss_in_profit() # Call from above function
 
@@ -565,6 +692,8 @@ def ranking_on_profit_loss():
 
 """ STEP 2.3: RANKING TO RATIO OF PROFIT LOSS AND BOXES """
 
+@profiled("ranking_on_ratio_losses_and_boxes")
+@cached_stage(STAGE_CACHE, "ranking_on_ratio_losses_and_boxes", [demand_source, margins_source, dimensions_source])
 def ranking_on_ratio_losses_and_boxes():
   df = loss_in_profit() # Call from above functions
   df2 = pickup_box()
@@ -589,44 +718,59 @@ def ranking_on_ratio_losses_and_boxes():
 
 """ STEP 2.4: KNAPSACK PROBLEM """
 
-def knapsack():
+def couple_positions(df):
+  # The couples of step 1.15 as row positions in df (couples with a product that is not in df are
+  # left out)
+  df3 = product_couples()
+  position = pd.Series(np.arange(len(df)), index=df["product_id"])
+  first = df3["product_id_1"].map(position)
+  second = df3["product_id_2"].map(position)
+  known = first.notna() & second.notna()
+  return first[known].to_numpy(dtype=np.int64), second[known].to_numpy(dtype=np.int64)
+
+@profiled("knapsack")
+@cached_stage(STAGE_CACHE, "knapsack", [demand_source, margins_source, dimensions_source])
+def knapsack(capacity=960, backend=None, colocate=True):
   df = loss_in_profit() # Call from previous function
+  df2 = pickup_box()
 
-  # The upper limit of storage in the storage warehouse 1 may not exceed 960 pick-up boxes (ub)
-  # and if 2 products have a correlation higher than 0.6, they have to be stored together (constraint).
-  # However, since none of the products correlate more than 0.6, this is not a constraint.
-
-  # Decision variables (capacity, profit loss, number of products selected):
-  p = df["avg_daily_profit_loss"] # P stands for profit loss
-  n = len(p) # Number of products that we could potentially lose profits on
-
-  # Call the Gurobi model
-  m = Model("Belsimpel")
-  x = m.addVars(n, vtype=GRB.BINARY, ub=960, name="Average daily profit loss") # The lower bound is 960
-
-  # Objective (minimize profit loss):
-  m.setObjective(quicksum(p[i] * x[i] for i in range(n)), GRB.MAXIMIZE) # We need to display the max
-  # loss if the full capacity is used
-
-  # Run the model
-  m.optimize()
+  # The products that stay in warehouse 1 may not use more than 960 pick-up boxes (capacity), every
+  # other product moves to warehouse 2 and loses its avg_daily_profit_loss. So we keep the products
+  # with the most profit loss in warehouse 1.
+  df = df.merge(df2[["product_id", "required_boxes"]], on="product_id", how="left")
+  p = df["avg_daily_profit_loss"].fillna(0).to_numpy() # P stands for profit loss
+  boxes = df["required_boxes"].fillna(1).to_numpy()
+
+  # Products with a correlation above 0.6 (step 1.15) are stored together, so every couple is merged
+  # into one group that is kept or moved as a whole
+  couples = None
+  if colocate:
+    couples = couple_positions(df)
+
+  # Solve with the chosen backend: exact dp / branch_and_bound, greedy, or gurobi (see allocation.py)
+  # Gurobi gets a warm start from the step 2.3 ranking and the time limit / gap / threads above
+  backend = backend or ALLOCATION_BACKEND
+  options = GUROBI_OPTIONS if backend == "gurobi" else {}
+  result = solve_colocated_allocation(p, boxes, capacity, couples, backend, **options)
+  record(solver_seconds=result["seconds"], solver_build_seconds=result.get("build_seconds", 0),
+         solver_solve_seconds=result.get("solve_seconds", 0))
+  if "build_seconds" in result:
+    print("model build: %.3fs, solve: %.3fs" % (result["build_seconds"], result["solve_seconds"]))
 
   # Display the output
-  sum_losses_3 = m.ObjVal
-  products_selected = []
-  for i in range(n):
-    if x[i].X > 0.5:
-      products_selected.append(i)
-
+  sum_losses_3 = result["total_daily_loss"]
+  products_selected = df.loc[result["selected"], "product_id"].tolist()
   print("If the products", products_selected,
         "are selected, total profit loss will be minimal: ", sum_losses_3)
   return products_selected, sum_losses_3
 
-knapsack()
+# knapsack()
 
 """ STEP 2.5: TABLE OF PROFIT """
 
+@profiled()
 def print_table_with_solutions():
+  plt = pyplot()
   sum_losses_1 = ranking_on_profit_loss()
   sum_losses_2 = ranking_on_ratio_losses_and_boxes()
   sum_losses_3 = knapsack()
@@ -643,4 +787,105 @@ def print_table_with_solutions():
   plt.table(cellText=df.values, colLabels=df.columns, loc="center")
   plt.show()
 
-# print_table_with_solutions()
\ No newline at end of file
+# print_table_with_solutions()
+
+""" STEP 2.6: ALLOCATION OVER SEVERAL WAREHOUSES """
+
+def load_warehouses():
+  if not WAREHOUSES_FILE:
+    return TWO_WAREHOUSES
+  with open(WAREHOUSES_FILE) as f:
+    return json.load(f)
+
+@profiled("multi_warehouse_allocation")
+@cached_stage(STAGE_CACHE, "multi_warehouse_allocation", [demand_source, margins_source, dimensions_source])
+def multi_warehouse_allocation(warehouses=None, backend="decomposition", colocate=True):
+  df = loss_in_profit() # Call from previous functions
+  df2 = pickup_box()
+  warehouses = warehouses or load_warehouses()
+
+  # Every warehouse has its own capacity and its own drop in sales per class, so the loss of a
+  # product depends on where it is stored. Couples are kept in the same warehouse like in step 2.4
+  df = df.merge(df2[["product_id", "required_boxes"]], on="product_id", how="left")
+  # A product without a margin has no profit and no class, it loses nothing in any warehouse
+  loss = warehouse_losses(df["avg_daily_profit"].fillna(0), df["binned"].fillna(0).astype(int),
+                          warehouses)
+  boxes = df["required_boxes"].fillna(1).to_numpy()
+
+  couples = None
+  if colocate:
+    couples = couple_positions(df)
+
+  options = GUROBI_OPTIONS if backend == "gurobi" else {}
+  result = solve_warehouses(loss, boxes, warehouse_capacities(warehouses), couples, backend, **options)
+  record(solver_seconds=result["seconds"], solver_build_seconds=result.get("build_seconds", 0),
+         solver_solve_seconds=result.get("solve_seconds", 0))
+
+  # One row per product with the warehouse it goes to
+  names = np.array([warehouse["name"] for warehouse in warehouses])
+  df_assignment = pd.DataFrame({"product_id": df["product_id"],
+                                "warehouse": names[result["assignment"]]})
+  for name, boxes_used, loss_w in zip(names, result["boxes_per_warehouse"],
+                                      result["loss_per_warehouse"]):
+    print("%s: %d boxes, daily profit loss %.2f" % (name, boxes_used, loss_w))
+  print("Total daily profit loss:", result["total_daily_loss"])
+  return df_assignment, result["total_daily_loss"]
+
+# multi_warehouse_allocation()
+
+""" STEP 2.7: SCENARIO SWEEP """
+
+@profiled("scenarios")
+@cached_stage(STAGE_CACHE, "scenarios", [demand_source, margins_source, dimensions_source])
+def scenarios(loss_rates=((0.2, 0.3, 0.5),), cutoffs=((0.5, 0.8),), capacities=(960,), colocate=True):
+  df = profit_computation() # Call from previous functions
+  df2 = pickup_box()
+
+  # Every combination of the loss rates of step 2.1, the class cut-offs of step 1.6 and the capacity
+  # of step 2.4, without querying the data again: the losses of all scenarios are computed at once
+  # and the knapsacks are solved in worker processes
+  df = df.merge(df2[["product_id", "required_boxes"]], on="product_id", how="left")
+  couples = couple_positions(df) if colocate else None
+  df_scenarios = scenario_sweep(df["product_id"], df["avg_daily_profit"],
+                                df["required_boxes"].fillna(1), loss_rates, cutoffs, capacities,
+                                couples, ALLOCATION_BACKEND,
+                                options=GUROBI_OPTIONS if ALLOCATION_BACKEND == "gurobi" else None)
+  return df_scenarios
+
+# scenarios(loss_rates=[(0.2, 0.3, 0.5), (0.1, 0.2, 0.4)], cutoffs=[(0.5, 0.8), (0.6, 0.9)],
+#           capacities=[800, 960, 1100])
+
+@profiled()
+def print_table_with_scenarios(**options):
+  # Not cached itself, so the table is also shown when the scenarios come from the stage cache
+  plt = pyplot()
+  df_scenarios = scenarios(**options)
+
+  # Show the table like print_table_with_solutions, without the (long) lists of products
+  table = df_scenarios.drop(columns=["products_selected"]).reset_index()
+  plt.table(cellText=table.round(3).values, colLabels=table.columns, loc="center")
+  plt.show()
+  return df_scenarios
+
+# print_table_with_scenarios(capacities=[800, 960, 1100])
+
+""" REPORT: ALL CHARTS AT ONCE """
+
+@profiled()
+def chart_data(max_matrix_products=2000):
+  # Every frame the charts need, computed once. The correlation matrix charts are only made for
+  # catalogs that fit in a readable heatmap
+  data = {"orders": df_product_orders_per_day(), "profit": profit_computation(),
+          "bin_ranges": bin_finder(), "classes": products_in_each_class(),
+          "volume": volume_computation(), "boxes": pickup_box()}
+  if demand_matrix().n_products <= max_matrix_products:
+    data["corr"] = correlation_matrix()
+    data["couples"] = product_couples()
+  return data
+
+@profiled()
+def render_report(directory=None, workers=None):
+  # Render all charts headless (Agg backend) in worker processes, as png files in CHART_DIR
+  return render_charts(chart_data(), directory or CHART_DIR, workers=workers)
+
+# render_report()
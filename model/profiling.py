@@ -0,0 +1,175 @@
+# Assignment: Belsimpel warehouse case
+# Per-step timing: wall and CPU time, peak memory, Elasticsearch and solver times, as a JSON report
+# and a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev)
+
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+""" PROFILER """
+
+# Switched on with BELSIMPEL_PROFILE=<directory> (or --profile in cli.py). When it is off, a
+# profiled step costs one attribute check; nothing is measured or stored
+
+class Profiler:
+  def __init__(self):
+    self.enabled = False
+    self.memory = False
+    self.spans = [] # Finished spans, in the order they ended
+    self.local = threading.local() # Stack of open spans per thread
+    self.lock = threading.Lock() # Metrics can be added from other threads (see recorder)
+    self.origin = time.perf_counter()
+
+  def enable(self, memory=True):
+    self.enabled = True
+    self.memory = memory
+    if memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def disable(self):
+    self.enabled = False
+    if self.memory and tracemalloc.is_tracing():
+      tracemalloc.stop()
+
+  def stack(self):
+    if not hasattr(self.local, "stack"):
+      self.local.stack = []
+    return self.local.stack
+
+  def start(self, name):
+    span = {"name": name, "start": time.perf_counter(), "cpu_start": time.process_time(),
+            "depth": len(self.stack()), "thread": threading.get_ident(), "metrics": {},
+            "peak": 0}
+    if self.memory:
+      # tracemalloc has one peak, so the peak so far goes to the parent before it is reset
+      current, peak = tracemalloc.get_traced_memory()
+      if self.stack():
+        self.stack()[-1]["peak"] = max(self.stack()[-1]["peak"], peak)
+      tracemalloc.reset_peak()
+      span["memory_start"] = current
+    self.stack().append(span)
+    return span
+
+  def stop(self, span):
+    span["wall_seconds"] = time.perf_counter() - span["start"]
+    span["cpu_seconds"] = time.process_time() - span.pop("cpu_start")
+    self.stack().pop()
+    if self.memory:
+      peak = max(span["peak"], tracemalloc.get_traced_memory()[1])
+      span["peak_memory_bytes"] = peak - span.pop("memory_start")
+      if self.stack():
+        self.stack()[-1]["peak"] = max(self.stack()[-1]["peak"], peak)
+    del span["peak"]
+    self.spans.append(span)
+
+  def record(self, **metrics):
+    # Add numbers to the innermost open span (summed when recorded more than once)
+    if not self.enabled or not self.stack():
+      return
+    self.add(self.stack()[-1], metrics)
+
+  def add(self, span, metrics):
+    with self.lock:
+      span_metrics = span["metrics"]
+      for key, value in metrics.items():
+        span_metrics[key] = span_metrics.get(key, 0) + value
+
+  # Output
+
+  def summary(self):
+    # Totals per step name
+    steps = {}
+    for span in self.spans:
+      step = steps.setdefault(span["name"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                             "peak_memory_bytes": 0, "metrics": {}})
+      step["calls"] += 1
+      step["wall_seconds"] += span["wall_seconds"]
+      step["cpu_seconds"] += span["cpu_seconds"]
+      step["peak_memory_bytes"] = max(step["peak_memory_bytes"], span.get("peak_memory_bytes", 0))
+      for key, value in span["metrics"].items():
+        step["metrics"][key] = step["metrics"].get(key, 0) + value
+    return steps
+
+  def report(self):
+    spans = [{key: value for key, value in span.items() if key != "start"}
+             | {"start_seconds": span["start"] - self.origin} for span in self.spans]
+    return {"steps": self.summary(), "spans": spans}
+
+  def chrome_trace(self):
+    # Complete ("X") events in microseconds, nested by time per thread
+    events = [{"name": span["name"], "ph": "X", "pid": os.getpid(), "tid": span["thread"],
+               "ts": (span["start"] - self.origin) * 1e6, "dur": span["wall_seconds"] * 1e6,
+               "args": dict(span["metrics"], cpu_seconds=span["cpu_seconds"],
+                            peak_memory_bytes=span.get("peak_memory_bytes"))}
+              for span in self.spans]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+  def write(self, directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "profile.json"), "w") as f:
+      json.dump(self.report(), f, indent=1)
+    with open(os.path.join(directory, "trace.json"), "w") as f:
+      json.dump(self.chrome_trace(), f)
+    return os.path.join(directory, "profile.json"), os.path.join(directory, "trace.json")
+
+  def print_summary(self):
+    print("%-45s %6s %10s %10s %12s" % ("step", "calls", "wall (s)", "cpu (s)", "peak (MB)"))
+    for name, step in sorted(self.summary().items(), key=lambda item: -item[1]["wall_seconds"]):
+      print("%-45s %6d %10.3f %10.3f %12.1f" % (name, step["calls"], step["wall_seconds"],
+                                                 step["cpu_seconds"],
+                                                 step["peak_memory_bytes"] / 1e6))
+
+PROFILER = Profiler()
+
+def profiled(name=None):
+  # Decorator for a step function
+  def decorator(function):
+    label = name or function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if not PROFILER.enabled:
+        return function(*args, **kwargs)
+      span = PROFILER.start(label)
+      try:
+        return function(*args, **kwargs)
+      finally:
+        PROFILER.stop(span)
+    return wrapper
+  return decorator
+
+def record(**metrics):
+  if PROFILER.enabled:
+    PROFILER.record(**metrics)
+
+def recorder():
+  # A record function for the innermost span of the calling thread, to hand to work that runs in
+  # another thread (like the background event loop of es_client), where record() has no open span
+  if not PROFILER.enabled or not PROFILER.stack():
+    return lambda **metrics: None
+  span = PROFILER.stack()[-1]
+  return lambda **metrics: PROFILER.add(span, metrics)
+
+def timed_search(es, **kwargs):
+  # es.search that records the time Elasticsearch reports ("took") next to the time the client
+  # waited, the difference is network, (de)serialization and the client itself
+  if not PROFILER.enabled:
+    return es.search(**kwargs)
+  start = time.perf_counter()
+  result = es.search(**kwargs)
+  PROFILER.record(es_requests=1, es_took_seconds=result.get("took", 0) / 1000,
+                  es_client_seconds=time.perf_counter() - start)
+  return result
+
+def profile_to(directory, memory=True):
+  # Switch profiling on and write the report and trace when the program ends
+  PROFILER.enable(memory)
+  atexit.register(lambda: (PROFILER.print_summary(), PROFILER.write(directory)))
+
+if os.environ.get("BELSIMPEL_PROFILE"):
+  profile_to(os.environ["BELSIMPEL_PROFILE"])
@@ -0,0 +1,163 @@
+# Assignment: Belsimpel warehouse case
+# Demand statistics over the last 90/180/365 days, with constant work per day and window
+
+
+import numpy as np
+import pandas as pd
+from demand_engine import terms_order
+from demand_matrix import safe_divide
+
+""" STATISTICS OVER THE LAST DAYS """
+
+ROLLING_WINDOWS = (90, 180, 365)
+
+def window_moments(total, squares, n):
+  # Mean and population standard deviation from the sum and the sum of squares over n days (0 for a
+  # product without days)
+  mean = safe_divide(total, n)
+  return mean, np.sqrt(np.maximum(safe_divide(squares, n) - mean ** 2, 0))
+
+def window_days(first_sold, last_sold, start):
+  # The sold range of every product (first to last sale, like df_product_orders_per_day) clipped to
+  # the window that starts on day index `start`: a window that covers the whole history gives the
+  # same numbers as the full history, and a product without sales in the window has 0 days
+  return np.maximum(last_sold - np.maximum(first_sold, start) + 1, 0)
+
+def window_statistics(matrix, windows=ROLLING_WINDOWS):
+  # One pass over the days gives the running sums of the orders and squared orders per product, and
+  # every window is then the difference of two columns. The sums are divided by the days of the
+  # sold range inside the window (see window_days); a window longer than the history is cut off at
+  # the first day. Returns {window: (mean, std)} for the windows that end on the last day
+  cumulative = np.zeros((matrix.n_products, matrix.n_days + 1), dtype=np.int64)
+  squares = np.zeros((matrix.n_products, matrix.n_days + 1), dtype=np.float64)
+  np.cumsum(matrix.counts, axis=1, dtype=np.int64, out=cumulative[:, 1:])
+  np.cumsum(np.square(matrix.counts, dtype=np.float64), axis=1, out=squares[:, 1:])
+
+  statistics = {}
+  for window in windows:
+    n = min(window, matrix.n_days)
+    days = window_days(matrix.first_sold, matrix.last_sold, matrix.n_days - n)
+    statistics[window] = window_moments(cumulative[:, -1] - cumulative[:, -1 - n],
+                                        squares[:, -1] - squares[:, -1 - n], days)
+  return statistics
+
+def window_frame(matrix, window, size=None):
+  # The statistics of one window in the shape of df_product_orders_per_day
+  order = terms_order(matrix, size)
+  mean, std = window_statistics(matrix, [window])[window]
+  df = pd.DataFrame({"product_id": matrix.product_ids[order], "avg_orders_per_day": mean[order],
+                     "standard_deviation": std[order]})
+  df = df.sort_values("avg_orders_per_day", ascending=False).reset_index(drop=False)
+  return df
+
+def windows_frame(matrix, margins, windows=ROLLING_WINDOWS):
+  # One row per product with the mean, standard deviation and avg daily profit of every window
+  return statistics_frame(matrix.product_ids, margins, window_statistics(matrix, windows))
+
+def statistics_frame(product_ids, margins, statistics):
+  margin = pd.Series(product_ids).map(margins).to_numpy(dtype=np.float64)
+  columns = {"product_id": product_ids, "margin": margin}
+  for window, (mean, std) in statistics.items():
+    columns["avg_orders_per_day_%d" % window] = mean
+    columns["standard_deviation_%d" % window] = std
+    columns["avg_daily_profit_%d" % window] = mean * margin
+  return pd.DataFrame(columns)
+
+""" SLIDING WINDOWS, DAY BY DAY """
+
+class RollingWindows:
+  # Sums and sums of squares per product for several windows at once, for the daily update
+  # (main.add_sales_day). When a day is added its orders are added to every window, and the day
+  # that falls out of a window is subtracted again, so a day costs the same no matter how long the
+  # windows are. The last max(windows) days are kept in a ring buffer for that. The ring is int64
+  # like the sums: days added later can have more orders than the compact dtype of the matrix
+  def __init__(self, product_ids, windows=ROLLING_WINDOWS):
+    self.windows = tuple(windows)
+    self.product_ids = np.asarray(product_ids, dtype=np.int64)
+    self.position = pd.Index(self.product_ids)
+    n_products = len(self.product_ids)
+    self.ring = np.zeros((max(self.windows), n_products), dtype=np.int64)
+    self.sums = np.zeros((len(self.windows), n_products), dtype=np.int64)
+    self.squares = np.zeros((len(self.windows), n_products), dtype=np.int64)
+    # Day indexes (0 is the first day) of the first and last sale, an empty range before a sale
+    self.first_sold = np.zeros(n_products, dtype=np.int64)
+    self.last_sold = np.full(n_products, -1, dtype=np.int64)
+    self.first_day = None # The day of day index 0
+    self.n_days = 0
+
+  @classmethod
+  def from_matrix(cls, matrix, windows=ROLLING_WINDOWS):
+    # The sums of every window and the last days of the ring straight from the matrix, instead of
+    # adding the history day by day
+    rolling = cls(matrix.product_ids, windows)
+    rolling.first_day = int(matrix.days[0]) if matrix.n_days else None
+    rolling.n_days = matrix.n_days
+    rolling.first_sold = matrix.first_sold.astype(np.int64)
+    rolling.last_sold = matrix.last_sold.astype(np.int64)
+    for k, window in enumerate(rolling.windows):
+      counts = matrix.counts[:, max(matrix.n_days - window, 0):].astype(np.int64)
+      rolling.sums[k] = counts.sum(axis=1)
+      rolling.squares[k] = (counts ** 2).sum(axis=1)
+    for j in range(max(matrix.n_days - len(rolling.ring), 0), matrix.n_days):
+      rolling.ring[j % len(rolling.ring)] = matrix.counts[:, j]
+    return rolling
+
+  def add_products(self, product_ids):
+    # Products that are sold for the first time get zero rows
+    n = len(product_ids)
+    self.product_ids = np.r_[self.product_ids, product_ids]
+    self.position = pd.Index(self.product_ids)
+    self.ring = np.hstack([self.ring, np.zeros((len(self.ring), n), dtype=np.int64)])
+    self.sums = np.hstack([self.sums, np.zeros((len(self.windows), n), dtype=np.int64)])
+    self.squares = np.hstack([self.squares, np.zeros((len(self.windows), n), dtype=np.int64)])
+    self.first_sold = np.r_[self.first_sold, np.zeros(n, dtype=np.int64)]
+    self.last_sold = np.r_[self.last_sold, np.full(n, -1, dtype=np.int64)]
+
+  def add_day(self, day, product_ids):
+    # product_ids has one entry per order of this day (like the rows of sales.csv). Days must come
+    # in order; days in between without sales are added as empty days
+    if self.first_day is None:
+      self.first_day = day
+    if day < self.first_day + self.n_days:
+      raise ValueError("day %d is not after the last day %d" % (day, self.first_day + self.n_days - 1))
+    sold, orders = np.unique(np.asarray(product_ids, dtype=np.int64), return_counts=True)
+    new = self.position.get_indexer(sold) < 0
+    if new.any():
+      self.add_products(sold[new])
+    rows = self.position.get_indexer(sold)
+
+    while self.first_day + self.n_days < day:
+      self.roll(np.zeros(len(self.product_ids), dtype=np.int64))
+    orders_per_product = np.zeros(len(self.product_ids), dtype=np.int64)
+    orders_per_product[rows] = orders
+    unsold = self.last_sold[rows] < 0
+    self.first_sold[rows[unsold]] = self.n_days
+    self.last_sold[rows] = self.n_days
+    self.roll(orders_per_product)
+    return sold
+
+  def roll(self, orders):
+    # orders is the number of orders of every product on the next day
+    for k, window in enumerate(self.windows):
+      if self.n_days >= window:
+        leaving = self.ring[(self.n_days - window) % len(self.ring)]
+        self.sums[k] += orders - leaving
+        self.squares[k] += orders ** 2 - leaving ** 2
+      else:
+        self.sums[k] += orders
+        self.squares[k] += orders ** 2
+    self.ring[self.n_days % len(self.ring)] = orders
+    self.n_days += 1
+
+  def statistics(self):
+    # {window: (mean, std)} over the last days, with the same days as window_statistics. Before the
+    # first day every window has 0 days, so the means are 0
+    return {window: window_moments(self.sums[k], self.squares[k].astype(np.float64),
+                                   window_days(self.first_sold, self.last_sold,
+                                               self.n_days - min(window, self.n_days)))
+            for k, window in enumerate(self.windows)}
+
+  def frame(self, margins):
+    # Like windows_frame, sorted on product_id
+    df = statistics_frame(self.product_ids, margins, self.statistics())
+    return df.sort_values("product_id").reset_index(drop=True)
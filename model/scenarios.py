@@ -0,0 +1,76 @@
+# Assignment: Belsimpel warehouse case
+# What-if sweep over the loss rates (step 2.1), class cut-offs (step 1.6) and capacities (step 2.4)
+
+
+import contextlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from allocation import solve_colocated_allocation
+from warehouses import run_inline
+
+""" LOSSES OF ALL SCENARIOS AT ONCE """
+
+def scenario_losses(avg_daily_profit, loss_rates, cutoffs):
+  # avg_daily_profit has one value per product, loss_rates is a (rates, 3) grid of the drop in sales
+  # for the low, middle and high class and cutoffs a (cutoffs, 2) grid of the quantiles that split
+  # the classes. Returns loss[r, c, i]: the daily profit loss of product i in warehouse 2 under
+  # loss rates r and cut-offs c, with classes like products_in_each_class
+  profit = np.asarray(avg_daily_profit, dtype=np.float64)
+  loss_rates = np.asarray(loss_rates, dtype=np.float64).reshape(-1, 3)
+  cutoffs = np.asarray(cutoffs, dtype=np.float64).reshape(-1, 2)
+
+  # (cutoffs, 2) boundaries, then the class of every product per cut-off: (min, q_low] -> 0,
+  # (q_low, q_high] -> 1 and (q_high, max] -> 2. Products without a profit (no margin) are left
+  # out of the quantiles and lose nothing
+  boundaries = np.nanquantile(profit, cutoffs)
+  labels = (profit > boundaries[:, :1]).astype(np.int64) + (profit > boundaries[:, 1:])
+  return loss_rates[:, labels] * np.nan_to_num(profit), labels
+
+""" ALLOCATION OF EVERY SCENARIO IN WORKER PROCESSES """
+
+def solve_capacities(loss, boxes, capacities, couples, backend, options=None):
+  # One set of losses for every capacity of the grid, so the losses only go to a worker once.
+  # options go to the solver like in step 2.4 (the Gurobi time limit, gap and threads)
+  results = []
+  for capacity in capacities:
+    result = solve_colocated_allocation(loss, boxes, capacity, couples, backend, **(options or {}))
+    results.append((result["total_daily_loss"], result["kept_loss"],
+                    np.flatnonzero(result["selected"])))
+  return results
+
+def scenario_sweep(product_ids, avg_daily_profit, boxes, loss_rates=((0.2, 0.3, 0.5),),
+                   cutoffs=((0.5, 0.8),), capacities=(960,), couples=None, backend="dp",
+                   workers=None, options=None):
+  # Every combination of loss rates x cut-offs x capacities, one row per scenario. A single set of
+  # losses is solved in the calling process, more are spread over worker processes
+  start = time.perf_counter()
+  loss_rates = np.asarray(loss_rates, dtype=np.float64).reshape(-1, 3)
+  cutoffs = np.asarray(cutoffs, dtype=np.float64).reshape(-1, 2)
+  losses, labels = scenario_losses(avg_daily_profit, loss_rates, cutoffs)
+  boxes = np.asarray(boxes, dtype=np.int64)
+  product_ids = np.asarray(product_ids)
+
+  pairs = list(itertools.product(range(len(loss_rates)), range(len(cutoffs))))
+  pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count()) if len(pairs) > 1 else None
+  with pool or contextlib.nullcontext():
+    submit = pool.submit if pool else run_inline
+    jobs = [submit(solve_capacities, losses[r, c], boxes, list(capacities), couples, backend, options)
+            for r, c in pairs]
+    rows = []
+    for (r, c), job in zip(pairs, jobs):
+      for capacity, (total, kept, selected) in zip(capacities, job.result()):
+        rows.append({"loss_low": loss_rates[r, 0], "loss_medium": loss_rates[r, 1],
+                     "loss_high": loss_rates[r, 2], "cutoff_low": cutoffs[c, 0],
+                     "cutoff_high": cutoffs[c, 1], "capacity": capacity,
+                     "products_high_class": int((labels[c] == 2).sum()),
+                     "total_daily_loss": total, "kept_loss": kept,
+                     "products_selected": product_ids[selected].tolist()})
+
+  df = pd.DataFrame(rows)
+  df.index.name = "scenario"
+  print("%d scenarios in %.2fs" % (len(df), time.perf_counter() - start))
+  return df
@@ -0,0 +1,115 @@
+# Assignment: Belsimpel warehouse case
+# Monte Carlo check of the fill rate that the base stock levels deliver with weekly replenishment
+
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from base_stock import REPLENISH_INTERVAL
+
+""" ONE BATCH OF REPLENISHMENT CYCLES """
+
+# Every cycle starts with the stock replenished up to the base stock S, then `interval` days of
+# demand come in. Demand that does not fit in what is left of S is lost, so per day:
+#   filled = min(cumulative demand, S) - min(cumulative demand of the day before, S)
+# A stockout day is a day with demand that could not be filled
+
+def simulate_cycles(demand, base_stock):
+  # demand is (products, cycles, days), base_stock (products,). Returns per product the total
+  # demand, the filled demand and the number of stockout days
+  cumulative = np.cumsum(demand, axis=2)
+  filled = np.minimum(cumulative, base_stock[:, None, None])
+  filled = np.diff(filled, axis=2, prepend=0)
+  stockout = (demand > filled).sum(axis=(1, 2))
+  return demand.sum(axis=(1, 2)), filled.sum(axis=(1, 2)), stockout
+
+def sample_demand(rng, mode, rows, cycles, interval, state):
+  # Daily demand for the products in rows: "bootstrap" draws days from the product's own history
+  # (between its first and last sale), "parametric" draws from a normal with its mean and sd,
+  # rounded to whole orders and never below 0
+  shape = (len(rows), cycles, interval)
+  if mode == "bootstrap":
+    counts, first, n_days = state["counts"], state["first"][rows], state["n_days"][rows]
+    # A product that was never sold (empty range) draws its last day, which has 0 orders
+    first, n_days = np.minimum(first, counts.shape[1] - 1), np.maximum(n_days, 1)
+    days = first[:, None, None] + (rng.random(shape) * n_days[:, None, None]).astype(np.int64)
+    return counts[rows[:, None, None], days].astype(np.float64)
+  if mode == "parametric":
+    mean, std = state["mean"][rows], state["std"][rows]
+    draw = rng.normal(mean[:, None, None], std[:, None, None], shape)
+    return np.maximum(np.round(draw), 0)
+  raise ValueError("mode must be 'bootstrap' or 'parametric', not %r" % mode)
+
+""" WORKER PROCESSES """
+
+# The demand history goes to every worker once (initializer), not with every batch
+WORKER_STATE = {}
+
+def init_worker(state):
+  WORKER_STATE.update(state)
+
+def simulate_batch(seed, mode, cycles, interval, block_cells):
+  # All products, `cycles` cycles, in blocks of products so one block of demand is about
+  # block_cells numbers
+  rng = np.random.default_rng(seed)
+  state = WORKER_STATE
+  n = len(state["base_stock"])
+  block = max(1, block_cells // (cycles * interval))
+  totals = np.zeros((3, n))
+  for start in range(0, n, block):
+    rows = np.arange(start, min(start + block, n))
+    demand = sample_demand(rng, mode, rows, cycles, interval, state)
+    totals[:, rows] = simulate_cycles(demand, state["base_stock"][rows])
+  return totals
+
+""" FILL RATES """
+
+def simulate_fill_rates(matrix, base_stock, classes=None, mode="bootstrap", cycles=2000,
+                        interval=REPLENISH_INTERVAL, seed=0, workers=None, batch_cycles=100,
+                        block_cells=1 << 22):
+  # base_stock has one level per product of the matrix (in the same order). The cycles are split
+  # into batches with their own seed (spawned from `seed`, so the result does not depend on the
+  # number of workers), and the batches are spread over the worker processes.
+  # Returns one row per product and one row per class
+  start = time.perf_counter()
+  base_stock = np.nan_to_num(np.asarray(base_stock, dtype=np.float64))
+  state = {"base_stock": base_stock}
+  if mode == "bootstrap":
+    state.update(counts=np.asarray(matrix.counts), first=matrix.first_sold,
+                 n_days=matrix.n_sold_range_days())
+  else:
+    state.update(mean=matrix.mean(), std=matrix.std())
+
+  batches = [batch_cycles] * (cycles // batch_cycles)
+  if cycles % batch_cycles:
+    batches.append(cycles % batch_cycles)
+  seeds = np.random.SeedSequence(seed).spawn(len(batches))
+  totals = np.zeros((3, len(base_stock)))
+  with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_worker,
+                           initargs=(state,)) as pool:
+    for result in pool.map(simulate_batch, seeds, [mode] * len(batches), batches,
+                           [interval] * len(batches), [block_cells] * len(batches)):
+      totals += result
+
+  demand, filled, stockout_days = totals
+  fill_rate = np.divide(filled, demand, out=np.ones_like(demand), where=demand > 0)
+  df = pd.DataFrame({"product_id": matrix.product_ids, "base_stock": base_stock,
+                     "demand": demand, "filled": filled, "fill_rate": fill_rate,
+                     "stockout_days": stockout_days.astype(np.int64),
+                     "stockout_day_rate": stockout_days / (cycles * interval)})
+
+  # Per class: the share of all demand of the class that was filled, and the stockout days
+  df_class = None
+  if classes is not None:
+    df["binned"] = np.asarray(classes)
+    df_class = df.groupby("binned").agg(products=("product_id", "size"), demand=("demand", "sum"),
+                                        filled=("filled", "sum"),
+                                        stockout_days=("stockout_days", "sum"))
+    df_class["fill_rate"] = df_class["filled"] / df_class["demand"]
+    df_class["stockout_day_rate"] = df_class["stockout_days"] / (df_class["products"] * cycles
+                                                                 * interval)
+  print("Simulated %d cycles of %d products in %.1fs" % (cycles, len(df),
+                                                         time.perf_counter() - start))
+  return df, df_class
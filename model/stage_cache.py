@@ -0,0 +1,137 @@
+# Assignment: Belsimpel warehouse case
+# Stage result cache: every step function in main.py runs once per input state instead of once per call
+
+
+from collections import OrderedDict
+import functools
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+""" FINGERPRINTS OF THE STAGE INPUTS """
+
+_file_hashes = {} # (path, mtime, size) -> sha1, so an unchanged file is only hashed once
+
+def file_fingerprint(path):
+  # The mtime and size tell us cheaply if a file changed, the hash makes sure a touched file with
+  # the same contents still hits the cache
+  stat = os.stat(path)
+  state = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+  if state not in _file_hashes:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+      for block in iter(lambda: f.read(1 << 20), b""):
+        sha1.update(block)
+    _file_hashes[state] = sha1.hexdigest()
+  return state[0], _file_hashes[state]
+
+def es_index_fingerprint(es, index):
+  # The document count and the number of index operations change on every (re)load of the index,
+  # the uuid changes when the index is deleted and created again
+  stats = es.indices.stats(index=index, metric="docs,indexing")["indices"][index]
+  primaries = stats["primaries"]
+  return index, stats.get("uuid"), primaries["docs"]["count"], primaries["indexing"]["index_total"]
+
+""" LRU CACHE OF STAGE RESULTS """
+
+class StageCache:
+  def __init__(self, max_entries=64, enabled=True, settings=None):
+    self.max_entries = max_entries
+    self.enabled = enabled
+    # A function that returns the settings that change results (backend, pushdown, solver options),
+    # part of every key so switching one of them in the same process is a cache miss
+    self.settings = settings
+    self.entries = OrderedDict() # (stage, settings, fingerprints, arguments) -> result
+    self.hits = 0
+    self.misses = 0
+    self.depth = 0 # Number of cached stages running, the outermost call is depth 1
+    self.fingerprints = {} # Fingerprint function -> value, for the current top-level call
+
+  def lookup(self, key):
+    if key not in self.entries:
+      self.misses += 1
+      return False, None
+    self.entries.move_to_end(key) # Mark as most recently used
+    self.hits += 1
+    return True, self.entries[key]
+
+  def store(self, key, result):
+    self.entries[key] = result
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False) # Evict the least recently used stage result
+
+  def fingerprint(self, function):
+    # A stage calls other stages, which ask for the same fingerprints (an indices.stats request to
+    # Elasticsearch, a file stat). Within one top-level call every fingerprint is computed once
+    if function not in self.fingerprints:
+      self.fingerprints[function] = function()
+    return self.fingerprints[function]
+
+  def invalidate(self, *stages):
+    # Without stage names the whole cache is cleared, otherwise only the results of those stages
+    if not stages:
+      self.entries.clear()
+      return
+    for key in [key for key in self.entries if key[0] in stages]:
+      del self.entries[key]
+
+def hashable(value):
+  # The arguments of a stage as part of the key: lists become tuples and dicts sorted tuples of their
+  # items, so scenarios(capacities=[800, 960]) is cached like scenarios(capacities=(800, 960))
+  if isinstance(value, (list, tuple)):
+    return tuple(hashable(item) for item in value)
+  if isinstance(value, dict):
+    return tuple(sorted((key, hashable(item)) for key, item in value.items()))
+  if isinstance(value, (set, frozenset)):
+    return frozenset(hashable(item) for item in value)
+  hash(value) # Raises TypeError for anything else that can not be in a key
+  return value
+
+def copy_result(result):
+  # The step functions add columns to the dataframes they get, so every caller gets its own copy of
+  # the frames and arrays. Read-only arrays (a large result that callers only read) and everything
+  # else (numbers, strings, other objects) are shared
+  if isinstance(result, np.ndarray) and not result.flags.writeable:
+    return result
+  if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+    return result.copy()
+  if isinstance(result, list):
+    return [copy_result(item) for item in result]
+  if isinstance(result, tuple):
+    return tuple(copy_result(item) for item in result)
+  if isinstance(result, dict):
+    return {key: copy_result(value) for key, value in result.items()}
+  return result
+
+def cached_stage(cache, name, inputs=()):
+  # inputs is a list of functions that each return the fingerprint of one input of the stage (the
+  # ES index, margins.csv, ...). They are evaluated once per top-level call, so an input that changed
+  # since the last call is a cache miss
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if not cache.enabled:
+        return function(*args, **kwargs)
+
+      try:
+        arguments = (hashable(args), hashable(kwargs))
+      except TypeError:
+        return function(*args, **kwargs) # Arguments that can not be a key (a dataframe) are not cached
+
+      if cache.depth == 0:
+        cache.fingerprints.clear()
+      cache.depth += 1
+      try:
+        settings = cache.settings() if cache.settings else None
+        key = (name, settings, tuple(cache.fingerprint(fingerprint) for fingerprint in inputs)) + arguments
+        found, result = cache.lookup(key)
+        if not found:
+          result = function(*args, **kwargs)
+          cache.store(key, result)
+      finally:
+        cache.depth -= 1
+      return copy_result(result)
+    return wrapper
+  return decorator
@@ -0,0 +1,116 @@
+# Assignment: Belsimpel warehouse case
+# Deterministic synthetic sales.csv, margins.csv and dimensions.csv of any size, for benchmarks
+
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from demand_matrix import DemandMatrix
+
+""" DEMAND """
+
+# Most products sell on few days (intermittent demand): every product gets a chance to sell on a day
+# (mostly small, Beta(0.6, 3)) and a size when it sells (1 + Poisson). A weekly pattern makes
+# weekends busier. A share of the products is the second half of a couple: it sells on exactly the
+# same days as its partner (with its own sizes), so those pairs have a clear correlation
+
+def product_parameters(rng, products, days, target_rows=None):
+  p_sell = rng.beta(0.6, 3.0, products)
+  size = rng.gamma(1.0, 1.5, products)
+  if target_rows:
+    # Scale the chance to sell so the expected number of orders (rows of sales.csv) is target_rows
+    expected = days * (p_sell * (1 + size)).sum()
+    p_sell = np.minimum(p_sell * target_rows / expected, 1.0)
+  return p_sell, size
+
+def couple_partners(rng, products, couple_share):
+  # partner[i] = the product whose sale days product i copies, or -1
+  partner = np.full(products, -1)
+  n_couples = int(products * couple_share / 2)
+  chosen = rng.permutation(products)[:2 * n_couples].reshape(-1, 2)
+  partner[chosen[:, 1]] = chosen[:, 0]
+  return partner
+
+def demand_block(seed, rows, p_sell, size, partner, days):
+  # The daily orders of the products in rows (and of their partners). Every product has its own
+  # random stream, so a block gives the same numbers no matter how the products are split
+  weekly = 1 + 0.3 * np.sin(2 * np.pi * np.arange(days) / 7)
+  counts = np.zeros((len(rows), days), dtype=np.int64)
+  for k, i in enumerate(rows.tolist()):
+    leader = partner[i] if partner[i] >= 0 else i
+    sells = np.random.default_rng([seed, leader]).random(days) < np.minimum(p_sell[leader] * weekly, 1)
+    orders = 1 + np.random.default_rng([seed, i, 1]).poisson(size[i], days)
+    counts[k] = np.where(sells, orders, 0)
+  return counts
+
+def synthetic_demand(products=1000, days=730, seed=0, couple_share=0.02, target_rows=None):
+  # The whole DemandMatrix in memory (for benchmarks that skip sales.csv)
+  rng = np.random.default_rng(seed)
+  p_sell, size = product_parameters(rng, products, days, target_rows)
+  partner = couple_partners(rng, products, couple_share)
+  counts = demand_block(seed, np.arange(products), p_sell, size, partner, days)
+  return DemandMatrix.from_counts(counts, np.arange(1, products + 1), np.arange(1, days + 1))
+
+""" FILES IN THE FORMAT OF THE CASE """
+
+def write_sales(path, products=1000, days=730, seed=0, couple_share=0.02, target_rows=None,
+                block=5000):
+  # One row per order (day, product_id, product_orders_per_day = 1), written per block of products
+  # so memory stays small. product_ids are 1..products and days 1..days. Returns the number of rows
+  rng = np.random.default_rng(seed)
+  p_sell, size = product_parameters(rng, products, days, target_rows)
+  partner = couple_partners(rng, products, couple_share)
+  n_rows = 0
+  with open(path, "w") as f:
+    f.write("day,product_id,product_orders_per_day\n")
+    for start in range(0, products, block):
+      rows = np.arange(start, min(start + block, products))
+      counts = demand_block(seed, rows, p_sell, size, partner, days)
+      product, day = np.nonzero(counts)
+      repeat = counts[product, day]
+      df = pd.DataFrame({"day": np.repeat(day + 1, repeat),
+                         "product_id": np.repeat(rows[product] + 1, repeat),
+                         "product_orders_per_day": 1})
+      df.to_csv(f, header=False, index=False)
+      n_rows += len(df)
+  return n_rows
+
+def write_margins(path, products=1000, seed=0):
+  rng = np.random.default_rng([seed, 2])
+  margin = np.round(rng.lognormal(3.3, 0.8, products), 2)
+  pd.DataFrame({"product_id": np.arange(1, products + 1), "margin": margin}).to_csv(path, index=False)
+
+def write_dimensions(path, products=1000, seed=0):
+  # Mostly phones and accessories that fit in one pick-up box, a few bigger products need two
+  rng = np.random.default_rng([seed, 3])
+  big = rng.random(products) < 0.02
+  df = pd.DataFrame({"product_id": np.arange(1, products + 1),
+                     "length": np.round(np.where(big, rng.uniform(35, 45, products),
+                                                 rng.uniform(5, 25, products)), 1),
+                     "width": np.round(np.where(big, rng.uniform(35, 45, products),
+                                                rng.uniform(3, 20, products)), 1),
+                     "height": np.round(np.where(big, rng.uniform(18, 25, products),
+                                                 rng.uniform(1, 10, products)), 1)})
+  df.to_csv(path, index=False)
+
+def write_case(directory, products=1000, days=730, seed=0, couple_share=0.02, target_rows=None):
+  # sales.csv, margins.csv and dimensions.csv in directory, like the files of the case, and
+  # meta.json with the parameters and the number of rows (written last, so it marks a complete case)
+  os.makedirs(directory, exist_ok=True)
+  n_rows = write_sales(os.path.join(directory, "sales.csv"), products, days, seed, couple_share,
+                       target_rows)
+  write_margins(os.path.join(directory, "margins.csv"), products, seed)
+  write_dimensions(os.path.join(directory, "dimensions.csv"), products, seed)
+  with open(os.path.join(directory, "meta.json"), "w") as f:
+    json.dump({"products": products, "days": days, "seed": seed, "couple_share": couple_share,
+               "target_rows": target_rows, "rows": n_rows}, f, indent=1)
+  return n_rows
+
+def read_case_meta(directory):
+  # The meta.json of write_case, or None for a missing or unfinished case
+  path = os.path.join(directory, "meta.json")
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
@@ -0,0 +1,19 @@
+# Assignment: Belsimpel warehouse case
+# Shared fixtures: the modules of model/ are imported flat (like main.py does), and a small synthetic
+# case (synthetic_data.py) stands in for the csv files of the assignment
+
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_data import write_case
+
+@pytest.fixture(scope="session")
+def case_dir(tmp_path_factory):
+  # sales.csv, margins.csv and dimensions.csv for 60 products over 120 days
+  directory = str(tmp_path_factory.mktemp("case"))
+  write_case(directory, products=60, days=120, seed=3)
+  return directory
@@ -0,0 +1,86 @@
+# Assignment: Belsimpel warehouse case
+# The allocation solvers against brute force on instances small enough to try every assignment
+
+
+import itertools
+import numpy as np
+import pytest
+from allocation import couple_groups, solve_allocation, solve_colocated_allocation
+from warehouses import solve_warehouses
+
+def instance(seed, n=10, warehouses=None):
+  rng = np.random.default_rng(seed)
+  boxes = rng.integers(1, 6, n)
+  loss = rng.exponential(10, n) if warehouses is None else rng.exponential(10, (n, warehouses))
+  return loss, boxes
+
+def brute_force_kept(loss, boxes, capacity, groups=None):
+  # Most loss that can be kept in warehouse 1, over every subset (of groups)
+  groups = np.arange(len(loss)) if groups is None else groups
+  best = 0.0
+  for keep in itertools.product([False, True], repeat=int(groups.max()) + 1):
+    selected = np.array(keep)[groups]
+    if boxes[selected].sum() <= capacity:
+      best = max(best, loss[selected].sum())
+  return best
+
+def brute_force_warehouses(loss, boxes, capacities):
+  # Least total loss over every assignment of products to warehouses that fits
+  best = np.inf
+  for assignment in itertools.product(range(loss.shape[1]), repeat=len(loss)):
+    assignment = np.array(assignment)
+    used = np.bincount(assignment, weights=boxes, minlength=loss.shape[1])
+    if (used <= capacities).all():
+      best = min(best, loss[np.arange(len(loss)), assignment].sum())
+  return best
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("backend", ["dp", "branch_and_bound"])
+def test_exact_backends_match_brute_force(seed, backend):
+  loss, boxes = instance(seed)
+  capacity = int(boxes.sum()) // 2
+  result = solve_allocation(loss, boxes, capacity, backend)
+  assert boxes[result["selected"]].sum() <= capacity
+  assert result["kept_loss"] == pytest.approx(brute_force_kept(loss, boxes, capacity))
+  assert result["optimal"]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_greedy_is_feasible_and_bounded(seed):
+  loss, boxes = instance(seed)
+  capacity = int(boxes.sum()) // 2
+  best = brute_force_kept(loss, boxes, capacity)
+  result = solve_allocation(loss, boxes, capacity, "greedy")
+  assert boxes[result["selected"]].sum() <= capacity
+  assert result["kept_loss"] <= best + 1e-9
+  assert result["bound"] >= best - 1e-9
+
+@pytest.mark.parametrize("seed", range(3))
+def test_couples_stay_together(seed):
+  loss, boxes = instance(seed)
+  couples = (np.array([0, 2, 5]), np.array([1, 3, 2]))
+  capacity = int(boxes.sum()) // 2
+  result = solve_colocated_allocation(loss, boxes, capacity, couples, "dp")
+  selected = result["selected"]
+  assert (selected[couples[0]] == selected[couples[1]]).all()
+  groups = couple_groups(len(loss), *couples)
+  assert result["kept_loss"] == pytest.approx(brute_force_kept(loss, boxes, capacity, groups))
+
+@pytest.mark.parametrize("seed", range(3))
+def test_decomposition_with_one_limited_warehouse_is_the_knapsack(seed):
+  loss, boxes = instance(seed, n=9, warehouses=2)
+  loss[:, 0] = 0 # Like the case: nothing is lost in warehouse 1
+  capacities = np.array([boxes.sum() // 2, np.inf])
+  best = brute_force_warehouses(loss, boxes, capacities)
+  result = solve_warehouses(loss, boxes, capacities, backend="decomposition")
+  assert result["total_daily_loss"] == pytest.approx(best)
+  assert result["bound"] <= best + 1e-9
+
+@pytest.mark.parametrize("seed", range(3))
+def test_decomposition_bound_with_two_limited_warehouses(seed):
+  loss, boxes = instance(seed, n=8, warehouses=3)
+  capacities = np.array([boxes.sum() // 3, boxes.sum() // 4, np.inf])
+  best = brute_force_warehouses(loss, boxes, capacities)
+  result = solve_warehouses(loss, boxes, capacities, backend="decomposition", workers=1)
+  used = np.bincount(result["assignment"], weights=boxes, minlength=3)
+  assert (used <= capacities).all()
+  assert result["bound"] <= best + 1e-9 <= result["total_daily_loss"] + 2e-9
@@ -0,0 +1,54 @@
+# Assignment: Belsimpel warehouse case
+# empirical_base_stock against a plain per product loop, also for histories and sold ranges that are
+# shorter than the replenishment interval
+
+
+import numpy as np
+import pytest
+from base_stock import SERVICE_LEVELS, empirical_base_stock
+from demand_matrix import DemandMatrix
+
+def reference_base_stock(counts, levels, interval):
+  # Per product: the sums of the windows in the sold range, and the smallest sum with at least
+  # `level` of them at or below it
+  result = []
+  for row in counts.astype(np.int64):
+    sold = np.flatnonzero(row)
+    first = sold[0] if len(sold) else len(row)
+    last = sold[-1] if len(sold) else -1
+    sums = np.array([row[day:day + interval].sum() for day in range(len(row) - interval + 1)])
+    if len(sums) == 0:
+      result.append([float(row.sum())] * len(levels))
+      continue
+    first = min(first, len(sums) - 1)
+    last = min(max(last - interval + 1, first), len(sums) - 1)
+    windows = np.sort(sums[first:last + 1])
+    result.append([float(windows[max(int(np.ceil(level * len(windows))) - 1, 0)]) for level in levels])
+  return np.array(result)
+
+def matrix_of(counts):
+  return DemandMatrix.from_counts(np.asarray(counts), np.arange(len(counts)),
+                                  np.arange(np.shape(counts)[1]))
+
+def test_random_histories():
+  rng = np.random.default_rng(0)
+  counts = rng.poisson(1.5, (40, 60)) * (rng.random((40, 60)) < 0.4)
+  counts[3] = 0 # Never sold
+  counts[5, :50] = 0 # Sold only in the last 10 days
+  counts[7, 4:] = 0 # Sold only in the first days
+  expected = reference_base_stock(counts, SERVICE_LEVELS, 7)
+  np.testing.assert_array_equal(empirical_base_stock(matrix_of(counts), SERVICE_LEVELS, 7), expected)
+
+def test_sold_range_shorter_than_the_interval():
+  counts = np.zeros((2, 30), dtype=np.int64)
+  counts[0, 10:13] = [2, 1, 3] # Three days of sales: the one window from the first sale
+  counts[1, 27:] = [1, 1, 1] # At the end of the history: the last window
+  result = empirical_base_stock(matrix_of(counts), (0.5, 0.99), 7)
+  np.testing.assert_array_equal(result, [[6, 6], [3, 3]])
+
+@pytest.mark.parametrize("n_days", [1, 4, 6])
+def test_history_shorter_than_the_interval(n_days):
+  counts = np.arange(3 * n_days).reshape(3, n_days) % 3
+  result = empirical_base_stock(matrix_of(counts), SERVICE_LEVELS, 7)
+  assert result.shape == (3, len(SERVICE_LEVELS))
+  np.testing.assert_array_equal(result, np.repeat(counts.sum(axis=1)[:, None], len(SERVICE_LEVELS), 1))
@@ -0,0 +1,37 @@
+# Assignment: Belsimpel warehouse case
+# The demand matrix is the same whichever way it is built: from sales.csv, from composite pages, or
+# from concurrent terms partitions (threads and asyncio) on the emulator
+
+
+import os
+import numpy as np
+import pytest
+from demand_engine import read_daily_counts
+from es_emulator import local_elasticsearch
+from es_fetch import fetch_daily_counts, fetch_daily_counts_partitioned, fetch_daily_counts_asyncio
+
+def assert_same_matrix(matrix, expected):
+  np.testing.assert_array_equal(matrix.product_ids, expected.product_ids)
+  np.testing.assert_array_equal(matrix.days, expected.days)
+  np.testing.assert_array_equal(matrix.counts, expected.counts)
+
+@pytest.fixture(scope="module")
+def native(case_dir):
+  return read_daily_counts(os.path.join(case_dir, "sales.csv"), chunksize=1000)
+
+def test_native_matrix_counts_every_row(case_dir, native):
+  assert native.counts.sum() == sum(1 for _ in open(os.path.join(case_dir, "sales.csv"))) - 1
+
+def test_composite_pages(case_dir, native):
+  es = local_elasticsearch(os.path.join(case_dir, "sales.csv"))
+  assert_same_matrix(fetch_daily_counts(es, "products", page_size=250), native)
+
+@pytest.mark.parametrize("partition_buckets", [50000, 300])
+def test_partitions_on_threads(case_dir, native, partition_buckets):
+  es = local_elasticsearch(os.path.join(case_dir, "sales.csv"))
+  assert_same_matrix(fetch_daily_counts_partitioned(es, "products", partition_buckets, concurrency=4),
+                     native)
+
+def test_partitions_on_asyncio(case_dir, native):
+  matrix = fetch_daily_counts_asyncio(os.path.join(case_dir, "sales.csv"), "products", 300, 4)
+  assert_same_matrix(matrix, native)
@@ -0,0 +1,42 @@
+# Assignment: Belsimpel warehouse case
+# Steps 1.3 to 1.7 give the same frames with BELSIMPEL_PUSHDOWN (statistics computed by the cluster,
+# here the emulator) as without it (statistics computed from the demand matrix)
+
+
+import os
+import pandas as pd
+import pytest
+import main
+
+STEPS = ["profit_computation", "bin_finder", "products_in_each_class", "compute_base_stock_level"]
+
+def run_steps(case_dir, monkeypatch, pushdown):
+  monkeypatch.chdir(case_dir)
+  monkeypatch.setattr(main, "DEMAND_BACKEND", "elasticsearch")
+  monkeypatch.setattr(main, "ES_EMULATOR", os.path.join(case_dir, "sales.csv"))
+  monkeypatch.setattr(main, "DEMAND_CACHE_DIR", "")
+  monkeypatch.setattr(main, "PUSHDOWN", pushdown)
+  return {step: getattr(main, step)() for step in STEPS}
+
+@pytest.fixture(scope="module")
+def both_modes(case_dir):
+  with pytest.MonkeyPatch.context() as monkeypatch:
+    client = run_steps(case_dir, monkeypatch, False)
+    server = run_steps(case_dir, monkeypatch, True)
+  main.invalidate_stages()
+  return client, server
+
+def assert_same(result, expected):
+  if isinstance(expected, pd.DataFrame):
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9)
+  elif isinstance(expected, (list, tuple)):
+    assert len(result) == len(expected)
+    for part, expected_part in zip(result, expected):
+      assert_same(part, expected_part)
+  else:
+    assert result == pytest.approx(expected, rel=1e-9)
+
+@pytest.mark.parametrize("step", STEPS)
+def test_pushdown_gives_the_client_frames(both_modes, step):
+  client, server = both_modes
+  assert_same(server[step], client[step])
@@ -0,0 +1,236 @@
+# Assignment: Belsimpel warehouse case
+# Allocation over several warehouses, each with its own box capacity and loss rates per class
+
+
+import contextlib
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+from allocation import couple_groups, solve_allocation
+
+""" WAREHOUSES AND THEIR LOSSES """
+
+# A warehouse is a dict with a name, a capacity in pick-up boxes (None = no limit, like warehouse 2)
+# and the drop in sales per class (low, middle, high) for products stored there. The two warehouse
+# case of the assignment is:
+TWO_WAREHOUSES = [
+  {"name": "warehouse 1", "capacity": 960, "loss_rates": (0.0, 0.0, 0.0)},
+  {"name": "warehouse 2", "capacity": None, "loss_rates": (0.2, 0.3, 0.5)},
+]
+
+def warehouse_losses(avg_daily_profit, classes, warehouses):
+  # loss[i, w] is the avg daily profit that product i loses when it is stored in warehouse w
+  rates = np.array([warehouse["loss_rates"] for warehouse in warehouses], dtype=float) # (W, 3)
+  classes = np.asarray(classes, dtype=np.int64)
+  return np.asarray(avg_daily_profit, dtype=float)[:, None] * rates.T[classes]
+
+def warehouse_capacities(warehouses):
+  return np.array([np.inf if warehouse["capacity"] is None else warehouse["capacity"]
+                   for warehouse in warehouses], dtype=float)
+
+def make_assignment_result(backend, loss, boxes, assignment, bound, optimal, start, **extra):
+  n_warehouses = loss.shape[1]
+  product_loss = loss[np.arange(len(loss)), assignment]
+  total = float(product_loss.sum())
+  if optimal is None:
+    optimal = total - bound <= 1e-9 * max(1.0, abs(bound))
+  result = {"backend": backend, "assignment": assignment, "total_daily_loss": total,
+            "loss_per_warehouse": np.bincount(assignment, weights=product_loss,
+                                              minlength=n_warehouses),
+            "boxes_per_warehouse": np.bincount(assignment, weights=boxes,
+                                               minlength=n_warehouses).astype(np.int64),
+            "bound": bound, "gap": max(total - bound, 0.0), "optimal": optimal,
+            "seconds": time.perf_counter() - start}
+  result.update(extra)
+  return result
+
+""" BACKEND: PARALLEL DECOMPOSITION PER WAREHOUSE """
+
+# Every product starts in the cheapest warehouse without a capacity limit. Each warehouse with a
+# capacity then solves its own knapsack on the loss it saves compared to that default, all warehouses
+# at the same time in worker processes. A product picked by more than one warehouse goes to the one
+# where it saves the most; the other warehouses get their boxes back and try again with the products
+# that are still free, until no warehouse can add anything. With one limited warehouse this is
+# exactly the knapsack of step 2.4, solved in the calling process
+
+def solve_subproblem(saving, boxes, room, backend):
+  # dp when its table fits in memory, branch and bound for very large catalogs
+  try:
+    return solve_allocation(saving, boxes, room, backend)
+  except ValueError:
+    return solve_allocation(saving, boxes, room, "branch_and_bound")
+
+def run_inline(function, *args):
+  # A finished future, for the single warehouse case that needs no worker processes
+  future = Future()
+  future.set_result(function(*args))
+  return future
+
+def lagrangian_bound(loss, boxes, capacities, upper, iterations=200):
+  # Lower bound on the total loss: with a price lambda_w >= 0 per box of every limited warehouse,
+  # sum_i min_w (loss[i, w] + lambda_w * boxes[i]) - sum_w lambda_w * capacity_w is at most the loss
+  # of any assignment that fits. The prices are improved with subgradient steps (towards the loss
+  # `upper` of a known assignment) and the best bound is kept. It reaches the LP relaxation
+  limited = np.flatnonzero(~np.isinf(capacities))
+  prices = np.zeros(loss.shape[1])
+  best = -np.inf
+  for _ in range(iterations):
+    priced = loss + prices[None, :] * boxes[:, None]
+    choice = priced.argmin(axis=1)
+    value = float(priced[np.arange(len(loss)), choice].sum() - prices[limited] @ capacities[limited])
+    best = max(best, value)
+    used = np.bincount(choice, weights=boxes, minlength=loss.shape[1])
+    step = np.zeros(loss.shape[1])
+    step[limited] = used[limited] - capacities[limited]
+    norm = float(step @ step)
+    if norm == 0 or upper - value <= 1e-9 * max(1.0, abs(upper)):
+      break
+    prices = np.maximum(prices + (upper - value) / norm * step, 0)
+  return best
+
+def solve_decomposition(loss, boxes, capacities, backend="dp", workers=None, max_rounds=100):
+  start = time.perf_counter()
+  n, n_warehouses = loss.shape
+  unlimited = np.flatnonzero(np.isinf(capacities))
+  if len(unlimited) == 0:
+    raise ValueError("the decomposition needs at least one warehouse without a capacity limit")
+  limited = np.flatnonzero(~np.isinf(capacities))
+
+  default = unlimited[loss[:, unlimited].argmin(axis=1)]
+  default_loss = loss[np.arange(n), default]
+  saving = default_loss[:, None] - loss # What moving product i to warehouse w saves
+
+  assignment = default.copy()
+  fixed = np.zeros(n, dtype=bool)
+  room = capacities.copy()
+  rounds = 0
+  first_round = {}
+  pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count()) if len(limited) > 1 else None
+  with pool or contextlib.nullcontext():
+    submit = pool.submit if pool else run_inline
+    while rounds < max_rounds:
+      rounds += 1
+      # Every limited warehouse that still has room picks from the free products that save something
+      jobs = {}
+      for w in limited:
+        candidates = np.flatnonzero(~fixed & (saving[:, w] > 0) & (boxes <= room[w]))
+        if len(candidates):
+          jobs[w] = (candidates, submit(solve_subproblem, saving[candidates, w], boxes[candidates],
+                                        int(room[w]), backend))
+      if not jobs:
+        break
+
+      # Products that were picked more than once go to the warehouse where they save the most
+      best_saving = np.zeros(n)
+      winner = np.full(n, -1)
+      for w, (candidates, job) in jobs.items():
+        result = job.result()
+        if rounds == 1:
+          first_round[w] = result
+        picked = candidates[result["selected"]]
+        better = saving[picked, w] > best_saving[picked]
+        best_saving[picked[better]] = saving[picked[better], w]
+        winner[picked[better]] = w
+
+      won = np.flatnonzero(winner >= 0)
+      if len(won) == 0:
+        break
+      assignment[won] = winner[won]
+      fixed[won] = True
+      room -= np.bincount(winner[won], weights=boxes[won], minlength=n_warehouses)
+
+  total = float(loss[np.arange(n), assignment].sum())
+  if len(limited) == 1:
+    # The knapsack bound on what the one limited warehouse can save (exact for dp and an optimal
+    # branch and bound)
+    savings = first_round[limited[0]]["bound"] if first_round else 0.0
+    bound = float(default_loss.sum()) - savings
+  elif len(limited) == 0:
+    bound = total
+  else:
+    bound = lagrangian_bound(loss, boxes.astype(float), capacities, total)
+  return make_assignment_result("decomposition", loss, boxes, assignment, min(bound, total), None,
+                                start, rounds=rounds)
+
+""" BACKEND: EXACT MIP WITH GUROBI """
+
+def solve_warehouses_gurobi(loss, boxes, capacities, start="decomposition", time_limit=None,
+                            mip_gap=None, threads=None, output=True):
+  import gurobipy as gp
+  from gurobipy import GRB
+  begin = time.perf_counter()
+  n, n_warehouses = loss.shape
+  limited = np.flatnonzero(~np.isinf(capacities))
+
+  # x[i, w] = 1 when product i is stored in warehouse w; every product goes to exactly one warehouse
+  m = gp.Model("Belsimpel warehouses")
+  m.Params.OutputFlag = 1 if output else 0
+  x = m.addMVar((n, n_warehouses), vtype=GRB.BINARY, name="store")
+  m.setObjective((loss * x).sum(), GRB.MINIMIZE)
+  m.addConstr(x.sum(axis=1) == 1, name="one_warehouse")
+  for w in limited:
+    m.addConstr(boxes.astype(float) @ x[:, w] <= capacities[w], name="capacity_%d" % w)
+
+  # Warm start from the decomposition, which is feasible
+  if isinstance(start, str) and start == "decomposition":
+    start = solve_decomposition(loss, boxes, capacities)["assignment"]
+  if start is not None:
+    initial = np.zeros((n, n_warehouses))
+    initial[np.arange(n), start] = 1
+    x.Start = initial
+
+  if time_limit is not None:
+    m.Params.TimeLimit = time_limit
+  if mip_gap is not None:
+    m.Params.MIPGap = mip_gap
+  if threads is not None:
+    m.Params.Threads = threads
+  m.update()
+  build_seconds = time.perf_counter() - begin
+
+  solve_start = time.perf_counter()
+  m.optimize()
+  solve_seconds = time.perf_counter() - solve_start
+
+  assignment = x.X.argmax(axis=1)
+  return make_assignment_result("gurobi", loss, boxes, assignment, float(m.ObjBound),
+                                m.Status == GRB.OPTIMAL, begin, build_seconds=build_seconds,
+                                solve_seconds=solve_seconds, status=m.Status)
+
+""" PLUGGABLE INTERFACE """
+
+WAREHOUSE_BACKENDS = {
+  "decomposition": solve_decomposition,
+  "gurobi": solve_warehouses_gurobi,
+}
+
+def solve_warehouses(loss, boxes, capacities, couples=None, backend="decomposition", **options):
+  # loss is a products x warehouses array (see warehouse_losses), capacities has np.inf for the
+  # warehouses without a limit. Couples are merged into groups like in solve_colocated_allocation.
+  # The result has the warehouse number of every product in "assignment"
+  start = time.perf_counter()
+  loss = np.asarray(loss, dtype=float)
+  boxes = np.asarray(boxes, dtype=np.int64)
+  capacities = np.asarray(capacities, dtype=float)
+  if loss.shape != (len(boxes), len(capacities)):
+    raise ValueError("loss must have shape (products, warehouses)")
+  if backend not in WAREHOUSE_BACKENDS:
+    raise ValueError("unknown warehouse backend %r, choose from %s" % (backend,
+                                                                       sorted(WAREHOUSE_BACKENDS)))
+  if couples is None or len(couples[0]) == 0:
+    return WAREHOUSE_BACKENDS[backend](loss, boxes, capacities, **options)
+
+  groups = couple_groups(len(loss), *couples)
+  n_groups = int(groups.max()) + 1
+  group_loss = np.zeros((n_groups, loss.shape[1]))
+  np.add.at(group_loss, groups, loss)
+  group_boxes = np.bincount(groups, weights=boxes, minlength=n_groups).astype(np.int64)
+  result = WAREHOUSE_BACKENDS[backend](group_loss, group_boxes, capacities, **options)
+
+  # Give every product the warehouse of its group
+  expanded = make_assignment_result(result["backend"], loss, boxes, result["assignment"][groups],
+                                    result["bound"], result["optimal"], start, groups=n_groups)
+  for key in result.keys() - expanded.keys():
+    expanded[key] = result[key]
+  return expanded